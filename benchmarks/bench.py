@@ -0,0 +1,404 @@
+"""
+Benchmarks for the upload hot paths of the tus router.
+
+The router is mounted in-process and driven through httpx's ASGI transport,
+or with `--socket` through a uvicorn server on a local port. Results are
+printed as a table and, with `--json`, written as JSON to compare runs.
+
+    python benchmarks/bench.py create patch head gc --json results.json
+
+Needs `httpx`, and `uvicorn` for `--socket`.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import base64
+import datetime
+import json
+import os
+import platform
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+import httpx
+from fastapi import FastAPI
+
+from tuspyserver import create_tus_router
+from tuspyserver.params import TusUploadParams
+from tuspyserver.storage import FileSystemStorage
+
+SCENARIOS = ("create", "patch", "head", "gc")
+METADATA = ", ".join(
+    f"{key} {base64.b64encode(value.encode()).decode()}"
+    for key, value in (("filename", "bench.bin"), ("filetype", "bin"))
+)
+
+
+class Counters:
+    """
+    Process-wide i/o counters, fsyncs are counted by wrapping `os.fsync`.
+    """
+
+    fsyncs = 0
+
+    @classmethod
+    def install(cls) -> None:
+        for name in ("fsync", "fdatasync"):
+            original = getattr(os, name, None)
+            if original is None:
+                continue
+
+            def counted(fd, _original=original):
+                cls.fsyncs += 1
+                return _original(fd)
+
+            setattr(os, name, counted)
+
+    @classmethod
+    def snapshot(cls) -> Dict[str, int]:
+        counters = {"fsyncs": cls.fsyncs}
+        # not available outside of linux
+        try:
+            with open("/proc/self/io") as f:
+                for line in f:
+                    key, value = line.split(":")
+                    counters[key] = int(value)
+        except OSError:
+            pass
+        return counters
+
+
+class Latencies:
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = defaultdict(list)
+
+    async def request(self, client: httpx.AsyncClient, route: str, *args, **kwargs):
+        started = time.perf_counter()
+        response = await client.request(*args, **kwargs)
+        self.samples[route].append(time.perf_counter() - started)
+        if response.status_code >= 400:
+            raise RuntimeError(f"{route} failed: {response.status_code}")
+        return response
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        return {
+            route: {
+                "count": len(samples),
+                "p50_ms": percentile(samples, 50) * 1000,
+                "p99_ms": percentile(samples, 99) * 1000,
+            }
+            for route, samples in sorted(self.samples.items())
+        }
+
+
+def percentile(samples: List[float], p: float) -> float:
+    if len(samples) < 2:
+        return samples[0] if samples else 0.0
+    return statistics.quantiles(samples, n=100, method="inclusive")[int(p) - 1]
+
+
+async def body(size: int, chunk_size: int):
+    chunk = os.urandom(min(chunk_size, size))
+    sent = 0
+    while sent < size:
+        n = min(chunk_size, size - sent)
+        yield chunk[:n]
+        sent += n
+
+
+async def create(client, latencies, size: Optional[int]) -> str:
+    headers = {"Tus-Resumable": "1.0.0", "Upload-Metadata": METADATA}
+    if size is None:
+        headers["Upload-Defer-Length"] = "1"
+    else:
+        headers["Upload-Length"] = str(size)
+    response = await latencies.request(
+        client, "POST", "POST", "/files/", headers=headers
+    )
+    return response.headers["location"].rsplit("/", 1)[1]
+
+
+async def upload(client, latencies, uid, size, chunk_size, resume_every) -> None:
+    offset = 0
+    while offset < size:
+        if offset > 0:
+            # resuming clients ask for the offset first
+            response = await latencies.request(
+                client, "HEAD", "HEAD", f"/files/{uid}"
+            )
+            offset = int(response.headers["upload-offset"])
+        n = min(resume_every or size, size - offset)
+        await latencies.request(
+            client,
+            "PATCH",
+            "PATCH",
+            f"/files/{uid}",
+            content=body(n, chunk_size),
+            headers={
+                "Tus-Resumable": "1.0.0",
+                "Content-Type": "application/offset+octet-stream",
+                "Upload-Offset": str(offset),
+                "Content-Length": str(n),
+            },
+        )
+        offset += n
+
+
+async def gather_limited(concurrency: int, jobs) -> None:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(job):
+        async with semaphore:
+            await job
+
+    await asyncio.gather(*(run(job) for job in jobs))
+
+
+async def scenario_create(client, latencies, args) -> Dict:
+    # many small uploads, created and sent in one go
+    async def one():
+        uid = await create(client, latencies, args.small_size)
+        await upload(client, latencies, uid, args.small_size, args.chunk_size, 0)
+
+    await gather_limited(args.concurrency, [one() for _ in range(args.uploads)])
+    return {"bytes": args.uploads * args.small_size, "requests": 2 * args.uploads}
+
+
+async def scenario_patch(client, latencies, args) -> Dict:
+    # few large uploads, streamed in long PATCH requests, resumed every
+    # `resume_every` bytes
+    async def one():
+        uid = await create(client, latencies, args.size)
+        await upload(
+            client, latencies, uid, args.size, args.chunk_size, args.resume_every
+        )
+
+    await gather_limited(args.concurrency, [one() for _ in range(args.streams)])
+    return {"bytes": args.streams * args.size}
+
+
+async def scenario_head(client, latencies, args) -> Dict:
+    uids = []
+    for _ in range(min(args.uploads, 100)):
+        uid = await create(client, latencies, 1)
+        uids.append(uid)
+    latencies.samples.pop("POST", None)
+    await gather_limited(
+        args.concurrency,
+        [
+            latencies.request(client, "HEAD", "HEAD", f"/files/{uids[i % len(uids)]}")
+            for i in range(args.heads)
+        ],
+    )
+    return {"requests": args.heads}
+
+
+def scenario_gc(router, storage, args) -> Dict:
+    # expired uploads are written straight to storage, only the gc is timed
+    expires = (datetime.datetime.now() - datetime.timedelta(days=1)).isoformat()
+    for i in range(args.gc_files):
+        uid = f"{i:032x}"
+        storage.create(uid, 0)
+        storage.put_info(
+            uid,
+            TusUploadParams(
+                metadata={},
+                size=0,
+                offset=0,
+                upload_part=0,
+                created_at=str(datetime.datetime.now()),
+                defer_length=False,
+                expires=expires,
+            ).model_dump(),
+        )
+    started = time.perf_counter()
+    router.remove_expired_files()
+    elapsed = time.perf_counter() - started
+    return {"files": args.gc_files, "gc_seconds": elapsed}
+
+
+class SocketServer:
+    def __init__(self, app, port: int):
+        import uvicorn
+
+        config = uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning")
+        self.server = uvicorn.Server(config)
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        while not self.server.started:
+            time.sleep(0.01)
+        return self
+
+    def __exit__(self, *exc):
+        self.server.should_exit = True
+        self.thread.join()
+
+
+async def run_scenario(name: str, args, router_options: Dict) -> Dict:
+    files_dir = tempfile.mkdtemp(prefix="tus-bench-", dir=args.files_dir)
+    try:
+        storage = FileSystemStorage(
+            files_dir,
+            preallocate=router_options.get("preallocate", False),
+            shard_depth=router_options.get("shard_depth", 0),
+        )
+        router = create_tus_router(
+            files_dir=files_dir, storage=storage, **router_options
+        )
+        app = FastAPI()
+        app.include_router(router)
+        latencies = Latencies()
+        before = Counters.snapshot()
+        started = time.perf_counter()
+        if name == "gc":
+            result = scenario_gc(router, storage, args)
+        else:
+            scenario = globals()[f"scenario_{name}"]
+            if args.socket:
+                with SocketServer(app, args.port):
+                    async with httpx.AsyncClient(
+                        base_url=f"http://127.0.0.1:{args.port}", timeout=None
+                    ) as client:
+                        result = await scenario(client, latencies, args)
+            else:
+                async with httpx.AsyncClient(
+                    transport=httpx.ASGITransport(app=app),
+                    base_url="http://bench",
+                    timeout=None,
+                ) as client:
+                    result = await scenario(client, latencies, args)
+        elapsed = time.perf_counter() - started
+        after = Counters.snapshot()
+    finally:
+        shutil.rmtree(files_dir, ignore_errors=True)
+
+    result["seconds"] = elapsed
+    if "bytes" in result:
+        result["mib_per_second"] = result["bytes"] / elapsed / 2**20
+    if "requests" in result:
+        result["requests_per_second"] = result["requests"] / elapsed
+    result["routes"] = latencies.summary()
+    io = {key: after[key] - before.get(key, 0) for key in after}
+    result["io"] = io
+    if result.get("bytes"):
+        gb = result["bytes"] / 1e9
+        result["per_gb"] = {
+            key: io[key] / gb for key in ("syscr", "syscw", "fsyncs") if key in io
+        }
+    # peak of the whole process so far, linux reports KiB
+    result["peak_rss_mib"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return result
+
+
+def machine() -> Dict:
+    try:
+        revision = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except OSError:
+        revision = ""
+    return {
+        "revision": revision,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "time": datetime.datetime.now().isoformat(),
+    }
+
+
+def parse_option(value: str):
+    key, _, raw = value.partition("=")
+    try:
+        return key, json.loads(raw)
+    except ValueError:
+        return key, raw
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument(
+        "scenarios", nargs="*", metavar="scenario", help=", ".join(SCENARIOS)
+    )
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--uploads", type=int, default=500, help="uploads for create")
+    parser.add_argument("--small-size", type=int, default=64 * 1024)
+    parser.add_argument("--streams", type=int, default=4, help="uploads for patch")
+    parser.add_argument("--size", type=int, default=256 * 2**20)
+    parser.add_argument("--chunk-size", type=int, default=64 * 1024)
+    parser.add_argument(
+        "--resume-every", type=int, default=0, help="bytes per PATCH, 0 for one"
+    )
+    parser.add_argument("--heads", type=int, default=10_000)
+    parser.add_argument("--gc-files", type=int, default=10_000)
+    parser.add_argument("--files-dir", default=None, help="parent of the upload dirs")
+    parser.add_argument("--socket", action="store_true", help="go through uvicorn")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument(
+        "--option",
+        action="append",
+        default=[],
+        type=parse_option,
+        help="create_tus_router option as key=json, e.g. checkpoint_bytes=1048576",
+    )
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args(argv)
+    for name in args.scenarios:
+        if name not in SCENARIOS:
+            parser.error(f"unknown scenario: {name}")
+    args.scenarios = args.scenarios or list(SCENARIOS)
+
+    Counters.install()
+    router_options = dict(args.option)
+    results = {
+        "machine": machine(),
+        "arguments": {k: v for k, v in vars(args).items() if k != "option"},
+        "router_options": router_options,
+        "scenarios": {},
+    }
+    for name in args.scenarios:
+        result = asyncio.run(run_scenario(name, args, router_options))
+        results["scenarios"][name] = result
+        report(name, result)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+def report(name: str, result: Dict) -> None:
+    line = [f"{name:<8}", f"{result['seconds']:8.2f}s"]
+    if "mib_per_second" in result:
+        line.append(f"{result['mib_per_second']:9.1f} MiB/s")
+    if "requests_per_second" in result:
+        line.append(f"{result['requests_per_second']:9.0f} req/s")
+    if "gc_seconds" in result:
+        line.append(f"{result['files']} files in {result['gc_seconds']:.2f}s")
+    for key, value in result.get("per_gb", {}).items():
+        line.append(f"{key}/GB={value:.0f}")
+    line.append(f"rss={result['peak_rss_mib']:.0f}MiB")
+    print("  ".join(line), file=sys.stderr)
+    for route, stats in result["routes"].items():
+        print(
+            f"  {route:<6} n={stats['count']:<6} p50={stats['p50_ms']:.2f}ms "
+            f"p99={stats['p99_ms']:.2f}ms",
+            file=sys.stderr,
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -23,6 +23,7 @@ app.add_middleware(
         "Upload-Offset",
         "Upload-Length",
         "Upload-Expires",
+        "Upload-Concat",
     ],
 )
 
@@ -0,0 +1,231 @@
+from __future__ import annotations
+
+import math
+import time
+import typing
+from typing import Any, Callable, Dict, Hashable, Optional
+
+if typing.TYPE_CHECKING:
+    from tuspyserver.router import TusRouterOptions
+
+from fastapi import Depends, Header, HTTPException, Request
+
+# reasons a request was turned away, as passed to `TusMetrics.upload_rejected`
+MAX_UPLOADS = "max_uploads"
+MAX_INFLIGHT_BYTES = "max_inflight_bytes"
+BANDWIDTH = "bandwidth"
+
+
+class TusTokenBucket:
+    """
+    Token bucket of `rate` bytes per second that holds at most `burst`
+    bytes. Takes may overdraw the bucket, the caller then waits for it to
+    refill.
+    """
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = rate
+        self.burst = burst if burst is not None else rate
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(
+            self.burst, self._tokens + (now - self._updated) * self.rate
+        )
+        self._updated = now
+
+    def take(self, size: int) -> float:
+        """
+        Take `size` bytes, returns the seconds to wait until they are paid.
+        """
+        self._refill()
+        self._tokens -= size
+        return max(0.0, -self._tokens / self.rate)
+
+    def delay(self) -> float:
+        """
+        Seconds until the bucket is out of debt.
+        """
+        self._refill()
+        return max(0.0, -self._tokens / self.rate)
+
+
+class _Usage:
+    def __init__(self, rate: Optional[float], burst: Optional[float]):
+        self.uploads = 0
+        self.inflight_bytes = 0
+        self.bucket = TusTokenBucket(rate, burst) if rate else None
+
+
+class TusAdmissionTicket:
+    """
+    Admission of a single request, released when the request ends.
+    """
+
+    def __init__(self, admission: TusAdmission, key: Hashable, size: int):
+        self.admission = admission
+        self.key = key
+        self.size = size
+
+    def take(self, size: int) -> float:
+        return self.admission.take(self, size)
+
+    def release(self) -> None:
+        self.admission.release(self)
+
+
+class TusAdmission:
+    """
+    Limits the upload requests that stream data, globally and per client:
+
+    * `max_uploads`, `max_uploads_per_client`: concurrent requests
+    * `max_inflight_bytes`, `max_inflight_bytes_per_client`: sum of the
+      `Content-Length` of the requests being streamed
+    * `bandwidth`, `client_bandwidth`: bytes per second, as token buckets
+      that hold one second worth of data unless `burst` is given
+
+    Requests over a limit are turned away before their body is read, with
+    `503` for global and `429` for per-client limits, and a `Retry-After`
+    of `retry_after` seconds, or of the time until the bandwidth is
+    available again. Requests are only turned away for bandwidth if they
+    would have to wait longer than `max_delay` seconds for their first
+    byte; admitted requests are slowed down to the bandwidth instead.
+
+    Clients are told apart by `key`, which is called with the request and
+    the value returned by the router's `auth` dependency. By default, this
+    is the `auth` value, or the client address if it returns `None`.
+
+    The state is kept in memory, limits apply to each process separately.
+    """
+
+    def __init__(
+        self,
+        max_uploads: Optional[int] = None,
+        max_uploads_per_client: Optional[int] = None,
+        max_inflight_bytes: Optional[int] = None,
+        max_inflight_bytes_per_client: Optional[int] = None,
+        bandwidth: Optional[float] = None,
+        client_bandwidth: Optional[float] = None,
+        burst: Optional[float] = None,
+        max_delay: float = 1.0,
+        retry_after: int = 1,
+        key: Optional[Callable[[Request, Any], Hashable]] = None,
+    ):
+        self.max_uploads = max_uploads
+        self.max_uploads_per_client = max_uploads_per_client
+        self.max_inflight_bytes = max_inflight_bytes
+        self.max_inflight_bytes_per_client = max_inflight_bytes_per_client
+        self.client_bandwidth = client_bandwidth
+        self.burst = burst
+        self.max_delay = max_delay
+        self.retry_after = retry_after
+        self.key = key or client_key
+        self._total = _Usage(bandwidth, burst)
+        self._clients: Dict[Hashable, _Usage] = {}
+
+    def admit(self, key: Hashable, size: int) -> TusAdmissionTicket:
+        """
+        Admit a request of `size` bytes by client `key`, or raise a
+        `HTTPException` with the status and `Retry-After` to answer with.
+        """
+        client = self._clients.get(key) or _Usage(self.client_bandwidth, self.burst)
+        for usage, max_uploads, max_inflight_bytes, status_code in (
+            (self._total, self.max_uploads, self.max_inflight_bytes, 503),
+            (
+                client,
+                self.max_uploads_per_client,
+                self.max_inflight_bytes_per_client,
+                429,
+            ),
+        ):
+            if max_uploads is not None and usage.uploads >= max_uploads:
+                raise AdmissionDenied(status_code, MAX_UPLOADS, self.retry_after)
+            # a single request larger than the cap is admitted on its own
+            if (
+                max_inflight_bytes is not None
+                and usage.inflight_bytes > 0
+                and usage.inflight_bytes + size > max_inflight_bytes
+            ):
+                raise AdmissionDenied(
+                    status_code, MAX_INFLIGHT_BYTES, self.retry_after
+                )
+            if usage.bucket is not None:
+                delay = usage.bucket.delay()
+                if delay > self.max_delay:
+                    raise AdmissionDenied(
+                        status_code, BANDWIDTH, max(1, math.ceil(delay))
+                    )
+
+        self._clients[key] = client
+        for usage in (self._total, client):
+            usage.uploads += 1
+            usage.inflight_bytes += size
+        return TusAdmissionTicket(self, key, size)
+
+    def take(self, ticket: TusAdmissionTicket, size: int) -> float:
+        """
+        Account for `size` bytes received by an admitted request, returns the
+        seconds to wait before reading on.
+        """
+        delay = 0.0
+        for usage in (self._total, self._clients.get(ticket.key)):
+            if usage is not None and usage.bucket is not None:
+                delay = max(delay, usage.bucket.take(size))
+        return delay
+
+    def release(self, ticket: TusAdmissionTicket) -> None:
+        client = self._clients.get(ticket.key)
+        for usage in (self._total, client):
+            if usage is not None:
+                usage.uploads -= 1
+                usage.inflight_bytes -= ticket.size
+        # forget idle clients, their buckets have been paid off while waiting
+        if client is not None and client.uploads <= 0:
+            del self._clients[ticket.key]
+
+
+class AdmissionDenied(HTTPException):
+    def __init__(self, status_code: int, reason: str, retry_after: int):
+        super().__init__(
+            status_code=status_code,
+            detail="Too many uploads, retry later",
+            headers={"Retry-After": str(retry_after)},
+        )
+        self.reason = reason
+
+
+def client_key(request: Request, auth: Any) -> Hashable:
+    if auth is not None:
+        try:
+            hash(auth)
+            return auth
+        except TypeError:
+            pass
+    return request.client.host if request.client is not None else None
+
+
+def make_admission_dep(options: TusRouterOptions):
+    async def admission_dep(
+        request: Request,
+        content_length: Optional[int] = Header(None),
+        auth=Depends(options.auth),
+    ):
+        admission = options.admission
+        # requests without data, e.g. creations, aren't limited
+        if admission is None or not content_length or content_length < 0:
+            yield None
+            return
+        try:
+            ticket = admission.admit(admission.key(request, auth), content_length)
+        except AdmissionDenied as e:
+            if options.metrics is not None:
+                options.metrics.upload_rejected(e.reason)
+            raise
+        try:
+            yield ticket
+        finally:
+            ticket.release()
+
+    return admission_dep
@@ -0,0 +1,54 @@
+from __future__ import annotations
+
+import threading
+from collections import OrderedDict
+from typing import Hashable, Optional, Tuple
+
+from tuspyserver.params import TusUploadParams
+
+# version marker of the stored metadata an entry was read from or written to,
+# see `TusStorage.info_stamp`
+CacheStamp = Hashable
+
+
+class TusUploadCache:
+    """
+    Bounded LRU cache of upload params, keyed by upload id.
+
+    Entries are validated against the stamp of the stored metadata, so
+    writes from other processes are picked up on the next read.
+    """
+
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self._entries: OrderedDict[str, Tuple[CacheStamp, TusUploadParams]] = (
+            OrderedDict()
+        )
+        self._lock = threading.Lock()
+
+    def get(self, uid: str, stamp: CacheStamp) -> Optional[TusUploadParams]:
+        with self._lock:
+            entry = self._entries.get(uid)
+            if entry is None:
+                return None
+            if entry[0] != stamp:
+                # stale, the .info file changed behind our back
+                del self._entries[uid]
+                return None
+            self._entries.move_to_end(uid)
+            # hand out copies so callers can mutate params freely
+            return entry[1].model_copy()
+
+    def put(self, uid: str, stamp: CacheStamp, params: TusUploadParams) -> None:
+        with self._lock:
+            self._entries[uid] = (stamp, params.model_copy())
+            self._entries.move_to_end(uid)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, uid: str) -> None:
+        with self._lock:
+            self._entries.pop(uid, None)
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,129 @@
+from __future__ import annotations
+
+import base64
+import hashlib
+import threading
+import typing
+import zlib
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+if typing.TYPE_CHECKING:
+    from tuspyserver.file import TusUploadFile
+    from tuspyserver.params import TusUploadParams
+
+# algorithms accepted in `Upload-Checksum` and for whole-upload digests
+SUPPORTED_ALGORITHMS = ("crc32", "md5", "sha1", "sha256", "sha512")
+# algorithms whose digests are trusted to identify the content of uploads
+CONTENT_ALGORITHMS = ("sha256", "sha512")
+
+
+class Crc32:
+    """
+    hashlib-style crc32, whose state can be persisted with the upload params.
+    """
+
+    name = "crc32"
+
+    def __init__(self, value: int = 0):
+        self.value = value
+
+    def update(self, data: bytes) -> None:
+        self.value = zlib.crc32(data, self.value)
+
+    def digest(self) -> bytes:
+        return self.value.to_bytes(4, "big")
+
+    def hexdigest(self) -> str:
+        return self.digest().hex()
+
+    def copy(self) -> Crc32:
+        return Crc32(self.value)
+
+
+def new_hasher(algorithm: str):
+    if algorithm == "crc32":
+        return Crc32()
+    return hashlib.new(algorithm)
+
+
+def parse_upload_checksum(header: str) -> Tuple[str, bytes]:
+    """
+    Parse an `Upload-Checksum` header into the algorithm and expected digest.
+    Raises `ValueError` if the header is malformed or the algorithm isn't
+    supported.
+    """
+    algorithm, _, encoded = header.strip().partition(" ")
+    algorithm = algorithm.lower()
+    if algorithm not in SUPPORTED_ALGORITHMS:
+        raise ValueError(f"Unsupported checksum algorithm: {algorithm}")
+    try:
+        return algorithm, base64.b64decode(encoded.strip(), validate=True)
+    except ValueError:
+        raise ValueError("Invalid Upload-Checksum")
+
+
+def format_checksum(algorithm: str, digest: bytes) -> str:
+    # same format as the Upload-Checksum header
+    return f"{algorithm} {base64.b64encode(digest).decode('ascii')}"
+
+
+def content_key(checksum: str) -> str:
+    """
+    Name of the content with the whole-upload digest `checksum`, in the
+    format of the upload params, e.g. `sha256-9f86d081...`.
+    """
+    algorithm, digest = parse_upload_checksum(checksum)
+    return f"{algorithm}-{digest.hex()}"
+
+
+class TusChecksumRegistry:
+    """
+    Running whole-upload digests of the uploads in progress, by upload id.
+
+    Only crc32 state fits in the upload params. For the other algorithms the
+    hash objects are kept in process between requests, and rebuilt from the
+    stored data when an upload is resumed elsewhere or after a restart.
+    """
+
+    def __init__(self, algorithm: str, maxsize: int = 1024):
+        if algorithm not in SUPPORTED_ALGORITHMS:
+            raise ValueError(f"Unsupported checksum algorithm: {algorithm}")
+        self.algorithm = algorithm
+        self.maxsize = maxsize
+        self._hashers: OrderedDict[str, Tuple[int, object]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def resume(self, file: TusUploadFile, params: TusUploadParams):
+        offset = params.offset
+        # persisted state, for crc32
+        if (
+            self.algorithm == "crc32"
+            and params.checksum_state is not None
+            and params.checksum_offset == offset
+        ):
+            return Crc32(params.checksum_state)
+        with self._lock:
+            entry = self._hashers.pop(file.uid, None)
+        if entry is not None and entry[0] == offset:
+            return entry[1]
+        # rebuild from the data stored so far
+        hasher = new_hasher(self.algorithm)
+        if offset > 0:
+            for block in file.storage.read(file.uid, 0, offset):
+                hasher.update(block)
+        return hasher
+
+    def suspend(self, uid: str, offset: int, hasher) -> Optional[int]:
+        """
+        Keep the hasher for the next request, and return the state to persist.
+        """
+        with self._lock:
+            self._hashers[uid] = (offset, hasher)
+            while len(self._hashers) > self.maxsize:
+                self._hashers.popitem(last=False)
+        return hasher.value if isinstance(hasher, Crc32) else None
+
+    def discard(self, uid: str) -> None:
+        with self._lock:
+            self._hashers.pop(uid, None)
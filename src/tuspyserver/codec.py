@@ -0,0 +1,147 @@
+from __future__ import annotations
+
+import lzma
+import zlib
+from abc import ABC, abstractmethod
+from typing import Dict, Optional, Sequence
+
+# types that are compressed already, stored as they are by default
+INCOMPRESSIBLE_TYPES = (
+    "image/",
+    "video/",
+    "audio/",
+    "application/zip",
+    "application/gzip",
+    "application/x-gzip",
+    "application/x-bzip2",
+    "application/x-xz",
+    "application/x-7z-compressed",
+    "application/x-rar-compressed",
+    "application/zstd",
+    "application/pdf",
+)
+
+
+def _check(data: bytes, eof: bool, length: int) -> bytes:
+    # blocks decode to their length exactly, anything else is corrupt
+    if not eof or len(data) != length:
+        raise ValueError(f"Block doesn't decode to {length} bytes")
+    return data
+
+
+class TusCodec(ABC):
+    """
+    Compresses the blocks of data that are written to storage. Each block
+    is compressed on its own, so the codec has no state between blocks.
+
+    Third-party codecs subclass this with a unique `name`, which is stored
+    with the data, e.g. for `zstandard`:
+
+        class ZstdCodec(TusCodec):
+            name = "zstd"
+
+            def encode(self, data):
+                return zstandard.ZstdCompressor().compress(data)
+
+            def decode(self, data, length):
+                return zstandard.ZstdDecompressor().decompress(
+                    data, max_output_size=length
+                )
+
+    `decode` is given the length of the data that was encoded, and doesn't
+    decompress more than that.
+    """
+
+    name: str
+
+    @abstractmethod
+    def encode(self, data: bytes) -> bytes: ...
+
+    @abstractmethod
+    def decode(self, data: bytes, length: int) -> bytes: ...
+
+
+class ZlibCodec(TusCodec):
+    name = "zlib"
+
+    def __init__(self, level: int = 6):
+        self.level = level
+
+    def encode(self, data: bytes) -> bytes:
+        return zlib.compress(data, self.level)
+
+    def decode(self, data: bytes, length: int) -> bytes:
+        decoder = zlib.decompressobj()
+        data = decoder.decompress(data, length)
+        if not decoder.eof and len(data) == length:
+            # the end of the stream, after data of the expected length
+            data += decoder.decompress(decoder.unconsumed_tail, 1)
+        return _check(data, decoder.eof, length)
+
+
+class LzmaCodec(TusCodec):
+    name = "lzma"
+
+    def __init__(self, preset: int = 6):
+        self.preset = preset
+
+    def encode(self, data: bytes) -> bytes:
+        return lzma.compress(data, format=lzma.FORMAT_XZ, preset=self.preset)
+
+    def decode(self, data: bytes, length: int) -> bytes:
+        decoder = lzma.LZMADecompressor(format=lzma.FORMAT_XZ)
+        data = decoder.decompress(data, max_length=length)
+        if not decoder.eof and len(data) == length:
+            # the end of the stream, after data of the expected length
+            data += decoder.decompress(b"", max_length=1)
+        return _check(data, decoder.eof, length)
+
+
+class TusCompression:
+    """
+    Chooses the codec of each upload when its first data is written.
+
+    Clients pick a codec by name in the `compression` metadata of an upload,
+    or turn compression off with `none`. Otherwise, uploads whose `filetype`
+    starts with one of `incompressible_types` are stored as they are, and
+    the others are compressed with the `default` codec.
+
+    Blocks that don't shrink to `min_ratio` of their size are stored as they
+    are. After `probe` of them in a row, the next `reprobe` blocks are
+    stored without trying, so incompressible uploads cost next to nothing.
+    """
+
+    def __init__(
+        self,
+        codecs: Optional[Sequence[TusCodec]] = None,
+        default: Optional[str] = "zlib",
+        incompressible_types: Sequence[str] = INCOMPRESSIBLE_TYPES,
+        min_ratio: float = 0.9,
+        probe: int = 2,
+        reprobe: int = 16,
+    ):
+        self.codecs: Dict[str, TusCodec] = {
+            codec.name: codec for codec in (codecs or (ZlibCodec(), LzmaCodec()))
+        }
+        if default is not None and default not in self.codecs:
+            raise ValueError(f"Unknown default codec: {default}")
+        self.default = default
+        self.incompressible_types = tuple(incompressible_types)
+        self.min_ratio = min_ratio
+        self.probe = probe
+        self.reprobe = reprobe
+
+    def select(self, metadata: dict) -> Optional[TusCodec]:
+        name = metadata.get("compression")
+        if name is not None:
+            return self.codecs.get(name)
+        filetype = metadata.get("filetype") or metadata.get("type") or ""
+        if filetype.startswith(self.incompressible_types):
+            return None
+        return self.codecs.get(self.default) if self.default is not None else None
+
+    def codec(self, name: str) -> TusCodec:
+        try:
+            return self.codecs[name]
+        except KeyError:
+            raise ValueError(f"Unknown codec: {name}")
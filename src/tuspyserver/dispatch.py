@@ -0,0 +1,350 @@
+from __future__ import annotations
+
+import asyncio
+import inspect
+import io
+import json
+import logging
+import os
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Set
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - not available on windows
+    fcntl = None
+
+from starlette.concurrency import run_in_threadpool
+
+from tuspyserver.hooks import accepts_argument
+from tuspyserver.metrics import COMPLETION_HOOK, TusMetrics
+from tuspyserver.params import TusUploadParams
+from tuspyserver.reader import TusUploadReader
+from tuspyserver.storage import TusStorage
+
+logger = logging.getLogger(__name__)
+
+EXECUTORS = ("thread", "process", "async")
+
+
+def _call_hook(hook: Callable, file_path: str, metadata: dict, kwargs: dict) -> None:
+    # runs in a worker thread or process, which has no event loop of its own
+    result = hook(file_path, metadata, **kwargs)
+    if inspect.isawaitable(result):
+
+        async def wait():
+            await result
+
+        asyncio.run(wait())
+
+
+class TusCompletionDispatcher:
+    """
+    Runs the completion hook of finished uploads in the background, so the
+    response to the last request of an upload doesn't wait for it.
+
+    Hooks run on `workers` threads or processes of their own, or on the event
+    loop with `executor="async"`, at most `workers` at a time. Hooks used
+    with the process executor must be picklable. A failed hook is retried
+    after `retry_backoff` seconds, doubling up to `max_backoff`, until it has
+    run `max_attempts` times.
+
+    With a `queue_dir`, queued completions are written there as JSON files
+    before the upload is reported complete, and picked up again on start.
+    Completions that ran out of attempts are kept as `<uid>.failed`. Each
+    process holds a lock on `<uid>.lock` while a completion is queued or
+    running there, so processes that share a `queue_dir` only pick up the
+    completions of processes that are gone.
+    """
+
+    def __init__(
+        self,
+        hook: Callable,
+        workers: int = 4,
+        executor: str = "thread",
+        max_attempts: int = 5,
+        retry_backoff: float = 1.0,
+        max_backoff: float = 300.0,
+        queue_dir: Optional[str] = None,
+        metrics: Optional[TusMetrics] = None,
+        storage: Optional[TusStorage] = None,
+    ):
+        if executor not in EXECUTORS:
+            raise ValueError(
+                f"Unsupported completion executor: {executor}, "
+                f"use one of {', '.join(EXECUTORS)}"
+            )
+        self.hook = hook
+        self.workers = max(workers, 1)
+        self.executor = executor
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self.max_backoff = max_backoff
+        self.queue_dir = queue_dir
+        self.metrics = metrics
+        self.storage = storage
+        # counters
+        self.completed = 0
+        self.failed = 0
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._pending: Set[str] = set()
+        self._pool: Optional[Executor] = None
+        self._tasks: List[asyncio.Task] = []
+        self._retries: Set[asyncio.TimerHandle] = set()
+        # lock file descriptors of the completions claimed by this process
+        self._claims: Dict[str, int] = {}
+
+    @property
+    def pending(self) -> int:
+        """
+        Number of completions that are queued, running or waiting for a retry.
+        """
+        return len(self._pending)
+
+    async def submit(self, uid: str, file_path: str, info: TusUploadParams) -> None:
+        job = {
+            "uid": uid,
+            "file_path": file_path,
+            "metadata": info.metadata,
+            "checksum": info.checksum,
+            "taps": info.tap_results,
+            "size": info.offset,
+            "attempts": 0,
+        }
+        if self.queue_dir is not None:
+            if not await run_in_threadpool(self._claim, uid):
+                # another process runs the completion of this upload
+                return
+            await run_in_threadpool(self._save, job)
+        self._enqueue(job)
+
+    def start(self) -> None:
+        if self._tasks:
+            return
+        if self.executor == "thread":
+            self._pool = ThreadPoolExecutor(
+                max_workers=self.workers, thread_name_prefix="tus-complete"
+            )
+        elif self.executor == "process":
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        self._tasks = [
+            asyncio.create_task(self._work()) for _ in range(self.workers)
+        ]
+        if self.queue_dir is not None:
+            self._tasks.append(asyncio.create_task(self._restore()))
+
+    async def stop(self) -> None:
+        # queued completions stay in `queue_dir` for the next start
+        for handle in self._retries:
+            handle.cancel()
+        self._retries.clear()
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+        # unfinished completions can be picked up by other processes now
+        for fd in self._claims.values():
+            os.close(fd)
+        self._claims.clear()
+
+    def _enqueue(self, job: Dict) -> None:
+        self._pending.add(job["uid"])
+        self._queue.put_nowait(job)
+
+    async def _restore(self) -> None:
+        try:
+            jobs = await run_in_threadpool(self._load)
+        except Exception:
+            logger.exception("Failed to load queued upload completions")
+            return
+        for job in jobs:
+            if job["uid"] not in self._pending:
+                self._enqueue(job)
+
+    async def _work(self) -> None:
+        while True:
+            job = await self._queue.get()
+            started = time.perf_counter()
+            try:
+                await self._run(job)
+            except Exception:
+                job["attempts"] += 1
+                if job["attempts"] >= self.max_attempts:
+                    logger.exception(
+                        "Completion hook for upload %s failed, giving up after "
+                        "%d attempts",
+                        job["uid"],
+                        job["attempts"],
+                    )
+                    self.failed += 1
+                    self._pending.discard(job["uid"])
+                    await self._finish(job, failed=True)
+                    continue
+                delay = min(
+                    self.retry_backoff * 2 ** (job["attempts"] - 1), self.max_backoff
+                )
+                logger.warning(
+                    "Completion hook for upload %s failed, retrying in %.1fs",
+                    job["uid"],
+                    delay,
+                    exc_info=True,
+                )
+                if self.queue_dir is not None:
+                    await run_in_threadpool(self._save, job)
+                self._retry_later(job, delay)
+            else:
+                if self.metrics is not None:
+                    self.metrics.phase(COMPLETION_HOOK, time.perf_counter() - started)
+                self.completed += 1
+                self._pending.discard(job["uid"])
+                await self._finish(job, failed=False)
+
+    async def _run(self, job: Dict) -> None:
+        # the upload digest and tap results are only passed to hooks that
+        # ask for them
+        kwargs = {}
+        for name in ("checksum", "taps"):
+            if job.get(name) is not None and accepts_argument(self.hook, name):
+                kwargs[name] = job[name]
+        # streams can't be handed to other processes
+        stream = None
+        if (
+            self.storage is not None
+            and self.executor != "process"
+            and accepts_argument(self.hook, "stream")
+        ):
+            stream = kwargs["stream"] = await run_in_threadpool(self._open, job)
+        # hooks without a stream get a local file, e.g. a decompressed copy
+        file_path = job["file_path"]
+        local = None
+        if stream is None and self.storage is not None:
+            local = self.storage.local_path(job["uid"])
+            file_path = await run_in_threadpool(local.__enter__)
+        try:
+            if self._pool is None:
+                result = self.hook(file_path, job["metadata"], **kwargs)
+                if inspect.isawaitable(result):
+                    await result
+                return
+            await asyncio.get_running_loop().run_in_executor(
+                self._pool,
+                _call_hook,
+                self.hook,
+                file_path,
+                job["metadata"],
+                kwargs,
+            )
+        finally:
+            if stream is not None:
+                stream.close()
+            if local is not None:
+                await run_in_threadpool(local.__exit__, None, None, None)
+
+    def _open(self, job: Dict) -> io.BufferedReader:
+        size = job.get("size")
+        if size is None:
+            size = self.storage.stat(job["uid"]) or 0
+        raw = TusUploadReader(self.storage.open_read(job["uid"]), size)
+        return io.BufferedReader(raw)
+
+    def _retry_later(self, job: Dict, delay: float) -> None:
+        def retry():
+            self._retries.discard(handle)
+            self._queue.put_nowait(job)
+
+        handle = asyncio.get_running_loop().call_later(delay, retry)
+        self._retries.add(handle)
+
+    async def _finish(self, job: Dict, failed: bool) -> None:
+        if self.queue_dir is None:
+            return
+        try:
+            await run_in_threadpool(self._remove, job["uid"], failed)
+        except Exception:
+            logger.exception("Failed to dequeue completion of upload %s", job["uid"])
+
+    # queue files
+
+    def _job_path(self, uid: str, suffix: str = ".json") -> str:
+        return os.path.join(self.queue_dir, f"{uid}{suffix}")
+
+    def _claim(self, uid: str) -> bool:
+        """
+        Lock the completion of `uid` for this process, returns `False` if
+        another process holds it. Locks go away with their process.
+        """
+        if uid in self._claims:
+            return True
+        os.makedirs(self.queue_dir, exist_ok=True)
+        fd = os.open(self._job_path(uid, ".lock"), os.O_RDWR | os.O_CREAT, 0o644)
+        if fcntl is not None:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(fd)
+                return False
+            except BaseException:
+                os.close(fd)
+                raise
+        self._claims[uid] = fd
+        return True
+
+    def _release(self, uid: str) -> None:
+        fd = self._claims.pop(uid, None)
+        if fd is None:
+            return
+        # the job file is gone already, so whoever opens the lock file next
+        # finds nothing to run
+        try:
+            os.remove(self._job_path(uid, ".lock"))
+        except FileNotFoundError:
+            pass
+        os.close(fd)
+
+    def _save(self, job: Dict) -> None:
+        os.makedirs(self.queue_dir, exist_ok=True)
+        path = self._job_path(job["uid"])
+        # write and rename, so a crash never leaves a partial job behind
+        with open(f"{path}.tmp", "w") as f:
+            json.dump(job, f)
+        os.replace(f"{path}.tmp", path)
+
+    def _remove(self, uid: str, failed: bool) -> None:
+        path = self._job_path(uid)
+        if os.path.exists(path):
+            if failed:
+                os.replace(path, self._job_path(uid, ".failed"))
+            else:
+                os.remove(path)
+        self._release(uid)
+
+    def _load(self) -> List[Dict]:
+        try:
+            names = sorted(os.listdir(self.queue_dir))
+        except FileNotFoundError:
+            return []
+        jobs = []
+        for name in names:
+            if not name.endswith(".json"):
+                continue
+            uid = name[: -len(".json")]
+            if uid in self._pending or not self._claim(uid):
+                continue
+            try:
+                with open(os.path.join(self.queue_dir, name)) as f:
+                    jobs.append(json.load(f))
+            except FileNotFoundError:
+                # finished by its process while listing
+                self._release(uid)
+            except (OSError, ValueError):
+                logger.exception("Skipping unreadable queued completion %s", name)
+                self._release(uid)
+        return jobs
@@ -0,0 +1,152 @@
+from __future__ import annotations
+
+import asyncio
+import ctypes
+import ctypes.util
+import os
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+from tuspyserver.storage.base import TusStorageWriter
+
+NONE = "none"
+ON_PATCH_END = "on-patch-end"
+EVERY_N_BYTES = "every-n-bytes"
+GROUP_COMMIT = "group-commit"
+DURABILITY_MODES = (NONE, ON_PATCH_END, EVERY_N_BYTES, GROUP_COMMIT)
+
+
+def _load_syncfs():
+    # syncfs(2) flushes a whole filesystem in one call, linux only
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        syncfs = libc.syncfs
+    except (OSError, AttributeError, TypeError):
+        return None
+    syncfs.argtypes = [ctypes.c_int]
+    syncfs.restype = ctypes.c_int
+    return syncfs
+
+
+_syncfs = _load_syncfs()
+
+
+def sync_writers(writers: List[TusStorageWriter]) -> None:
+    """
+    Make the data of all `writers` durable. Files that live on the same
+    filesystem are synced with a single `syncfs` where available, which
+    also flushes whatever else is dirty on that filesystem.
+    """
+    by_device: Dict[Optional[int], List[Tuple[TusStorageWriter, int]]] = (
+        defaultdict(list)
+    )
+    for writer in writers:
+        fd = writer.fileno() if _syncfs is not None else None
+        device = os.fstat(fd).st_dev if fd is not None else None
+        by_device[device].append((writer, fd))
+    for device, group in by_device.items():
+        if device is None or len(group) == 1:
+            for writer, _ in group:
+                writer.sync()
+            continue
+        for writer, _ in group:
+            writer.flush()
+        if _syncfs(group[0][1]) != 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+
+
+class TusGroupCommit:
+    """
+    Collects the syncs requested by concurrent uploads for `window` seconds,
+    and runs them as one batch: each writer syncs its own data, in worker
+    threads at the same time. With `syncfs`, the batch is synced with one
+    `syncfs` per filesystem instead, see `sync_writers`.
+    """
+
+    def __init__(self, window: float = 0.005, syncfs: bool = False):
+        self.window = window
+        self.syncfs = syncfs
+        self._pending: List[Tuple[TusStorageWriter, asyncio.Future]] = []
+        self._task: Optional[asyncio.Task] = None
+
+    async def sync(self, writer: TusStorageWriter) -> None:
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((writer, future))
+        if self._task is None:
+            self._task = asyncio.create_task(self._commit())
+        await future
+
+    async def _commit(self) -> None:
+        await asyncio.sleep(self.window)
+        batch, self._pending = self._pending, []
+        self._task = None
+        # an upload may have asked twice within the window
+        writers = list({id(w): w for w, _ in batch}.values())
+        if self.syncfs:
+            try:
+                await run_in_threadpool(sync_writers, writers)
+            except Exception as e:
+                errors = {id(w): e for w in writers}
+            else:
+                errors = {}
+        else:
+            results = await asyncio.gather(
+                *(run_in_threadpool(w.sync) for w in writers),
+                return_exceptions=True,
+            )
+            errors = {
+                id(w): result
+                for w, result in zip(writers, results)
+                if isinstance(result, Exception)
+            }
+        for writer, future in batch:
+            if future.done():
+                continue
+            if id(writer) in errors:
+                future.set_exception(errors[id(writer)])
+            else:
+                future.set_result(None)
+
+
+class TusDurability:
+    """
+    When upload data is synced to stable storage. Data is always synced
+    before an offset that covers it is persisted, so a resumed upload never
+    continues from an offset beyond what survived a crash.
+
+    * `on-patch-end`: offsets are only persisted, and data synced, at the end
+      of each PATCH request
+    * `every-n-bytes`: offsets are persisted, and data synced, every
+      `sync_bytes` bytes of a request and at its end
+    * `group-commit`: offsets are persisted at the usual checkpoints, and the
+      syncs of concurrent uploads are batched within `window` seconds, see
+      `TusGroupCommit`
+
+    Offsets reported by `HEAD` are the persisted ones, so they only cover
+    synced data as well.
+    """
+
+    def __init__(
+        self,
+        mode: str = ON_PATCH_END,
+        sync_bytes: int = 64 * 1024 * 1024,
+        window: float = 0.005,
+        syncfs: bool = False,
+    ):
+        if mode not in DURABILITY_MODES or mode == NONE:
+            raise ValueError(
+                f"Unsupported durability mode: {mode}, "
+                f"use one of {', '.join(DURABILITY_MODES)}"
+            )
+        self.mode = mode
+        self.sync_bytes = sync_bytes
+        self._group = TusGroupCommit(window, syncfs) if mode == GROUP_COMMIT else None
+
+    async def sync(self, writer: TusStorageWriter) -> None:
+        if self._group is not None:
+            await self._group.sync(writer)
+        else:
+            await run_in_threadpool(writer.sync)
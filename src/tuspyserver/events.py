@@ -0,0 +1,138 @@
+from __future__ import annotations
+
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Set
+
+# event types, events are dicts with a "type" and the "id" of the upload
+CREATED = "created"
+OFFSET = "offset"
+COMPLETE = "complete"
+ERROR = "error"
+EXPIRED = "expired"
+DELETED = "deleted"
+
+
+class TusEventSubscription:
+    """
+    Events of the uploads in `ids`, or of all uploads, as seen by a single
+    subscriber. Offset events of an upload are coalesced, and batches of
+    events are handed out at most every `interval` seconds.
+    """
+
+    def __init__(
+        self,
+        bus: TusEventBus,
+        ids: Optional[Iterable[str]] = None,
+        interval: float = 0.0,
+    ):
+        self.bus = bus
+        self.ids: Optional[Set[str]] = set(ids) if ids is not None else None
+        self.interval = interval
+        self._loop = asyncio.get_running_loop()
+        self._offsets: OrderedDict[str, dict] = OrderedDict()
+        self._events: List[dict] = []
+        self._ready = asyncio.Event()
+        self._sent = 0.0
+
+    def matches(self, event: dict) -> bool:
+        return self.ids is None or event["id"] in self.ids
+
+    def push(self, event: dict) -> None:
+        # called on the subscriber's loop
+        if event["type"] == OFFSET:
+            self._offsets[event["id"]] = event
+        else:
+            # an upload's offset comes before its other events
+            offset = self._offsets.pop(event["id"], None)
+            if offset is not None:
+                self._events.append(offset)
+            self._events.append(event)
+        self._ready.set()
+
+    async def get(self) -> List[dict]:
+        """
+        Wait for the next batch of events.
+        """
+        await self._ready.wait()
+        delay = self._sent + self.interval - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        events, self._events = self._events, []
+        events += self._offsets.values()
+        self._offsets = OrderedDict()
+        self._ready.clear()
+        self._sent = time.monotonic()
+        return events
+
+    def close(self) -> None:
+        self.bus.unsubscribe(self)
+
+
+class TusEventBus:
+    """
+    Fan-out of upload events to subscribers.
+
+    Events are handed to `publish`, from the event loop or from worker
+    threads, and reach the subscriptions of this process through `deliver`.
+    The base class delivers them in process. Deployments with several worker
+    processes can override `publish` to send events to a broker, e.g. Redis
+    pub/sub, and call `deliver` for the events received from it in a task
+    run between `start` and `stop`.
+
+    Uploads in progress publish their offset at most every `offset_interval`
+    seconds, and once at the end of each request.
+    """
+
+    def __init__(self, offset_interval: float = 0.1):
+        self.offset_interval = offset_interval
+        self._subscriptions: Set[TusEventSubscription] = set()
+        self._lock = threading.Lock()
+
+    @property
+    def active(self) -> bool:
+        return bool(self._subscriptions)
+
+    def publish(self, event: dict) -> None:
+        self.deliver(event)
+
+    def deliver(self, event: dict) -> None:
+        with self._lock:
+            subscriptions = [s for s in self._subscriptions if s.matches(event)]
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        for subscription in subscriptions:
+            if subscription._loop is loop:
+                subscription.push(event)
+            elif not subscription._loop.is_closed():
+                subscription._loop.call_soon_threadsafe(subscription.push, event)
+
+    def subscribe(
+        self, ids: Optional[Iterable[str]] = None, interval: float = 0.0
+    ) -> TusEventSubscription:
+        subscription = TusEventSubscription(self, ids, interval)
+        with self._lock:
+            self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: TusEventSubscription) -> None:
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    async def start(self) -> None: ...
+
+    async def stop(self) -> None: ...
+
+
+class MemoryEventBus(TusEventBus):
+    """
+    Delivers events to the subscribers of this process only.
+    """
+
+
+def upload_event(type: str, uid: str, **fields) -> Dict:
+    return {"type": type, "id": uid, **fields}
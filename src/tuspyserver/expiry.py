@@ -0,0 +1,159 @@
+from __future__ import annotations
+
+import asyncio
+import datetime
+import heapq
+import logging
+import typing
+from typing import List, Optional, Set, Tuple, Union
+
+if typing.TYPE_CHECKING:
+    from tuspyserver.router import TusRouterOptions
+
+from starlette.concurrency import run_in_threadpool
+
+from tuspyserver.file import delete_expired
+
+logger = logging.getLogger(__name__)
+
+
+def _timestamp(expires: Union[float, str]) -> float:
+    if isinstance(expires, str):
+        return datetime.datetime.fromisoformat(expires).timestamp()
+    return float(expires)
+
+
+class TusExpiryScheduler:
+    """
+    Deletes expired uploads in the background.
+
+    Uploads that expire within the next `horizon` seconds are kept in a
+    priority queue, and the scheduler sleeps until the first one is due.
+    The queue is refilled from the metadata store once per horizon, which is
+    an indexed query for stores that override `TusMetadataStore.expired`.
+    Due uploads are deleted in batches of `batch_size` in a worker thread,
+    with `batch_interval` seconds between batches.
+    """
+
+    def __init__(
+        self,
+        options: TusRouterOptions,
+        horizon: float = 3600,
+        batch_size: int = 100,
+        batch_interval: float = 1.0,
+    ):
+        self.options = options
+        self.horizon = horizon
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        # counters
+        self.files_reclaimed = 0
+        self.bytes_reclaimed = 0
+        self._queue: List[Tuple[float, str]] = []
+        self._queued: Set[str] = set()
+        self._horizon_end = 0.0
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def schedule(self, uid: str, expires: Optional[Union[float, str]]) -> None:
+        """
+        Queue an upload that was created or given an expiry date after the
+        last refill, if it expires before the next one.
+        """
+        if not expires or uid in self._queued:
+            return
+        at = _timestamp(expires)
+        if at >= self._horizon_end:
+            # picked up by the next refill
+            return
+        heapq.heappush(self._queue, (at, uid))
+        self._queued.add(uid)
+        if self._wakeup is not None and self._queue[0][1] == uid:
+            self._wakeup.set()
+
+    def start(self) -> None:
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def run(self) -> None:
+        while True:
+            now = datetime.datetime.now().timestamp()
+            if now >= self._horizon_end:
+                await self._refill(now)
+                continue
+            if self._queue and self._queue[0][0] <= now:
+                await self._delete_batch(now)
+                await asyncio.sleep(self.batch_interval)
+                continue
+            # sleep until the next upload is due, a new one is queued in front
+            # of it, or the queue has to be refilled
+            until = self._queue[0][0] if self._queue else self._horizon_end
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(
+                    self._wakeup.wait(), timeout=min(until, self._horizon_end) - now
+                )
+            except asyncio.TimeoutError:
+                pass
+
+    async def _refill(self, now: float) -> None:
+        horizon_end = now + self.horizon
+        before = datetime.datetime.fromtimestamp(horizon_end)
+        try:
+            due = await run_in_threadpool(self._expiring, before)
+        except Exception:
+            logger.exception("Failed to list expiring uploads")
+            due = []
+        self._horizon_end = horizon_end
+        self._queue = []
+        self._queued = set()
+        for at, uid in due:
+            heapq.heappush(self._queue, (at, uid))
+            self._queued.add(uid)
+
+    def _expiring(self, before: datetime.datetime) -> List[Tuple[float, str]]:
+        return [
+            (_timestamp(expires), uid)
+            for uid, expires in self.options.metadata_store.expiring(before)
+        ]
+
+    async def _delete_batch(self, now: float) -> None:
+        batch = []
+        while (
+            self._queue and self._queue[0][0] <= now and len(batch) < self.batch_size
+        ):
+            _, uid = heapq.heappop(self._queue)
+            self._queued.discard(uid)
+            batch.append(uid)
+        try:
+            files, size = await run_in_threadpool(self._delete, batch)
+        except Exception:
+            logger.exception("Failed to delete expired uploads")
+            return
+        self.files_reclaimed += files
+        self.bytes_reclaimed += size
+        if self.options.metrics is not None and files:
+            self.options.metrics.uploads_expired(files, size)
+
+    def _delete(self, uids: List[str]) -> Tuple[int, int]:
+        files = size = 0
+        now = datetime.datetime.now()
+        for uid in uids:
+            # uploads in use are left to the next refill
+            deleted = delete_expired(self.options, uid, now)
+            if deleted is not None:
+                files += 1
+                size += deleted
+        if files:
+            self.options.storage.compact()
+        return files, size
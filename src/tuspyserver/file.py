@@ -4,13 +4,23 @@ import typing
 
 if typing.TYPE_CHECKING:
     from tuspyserver.router import TusRouterOptions
+    from tuspyserver.storage import TusMetadataStore, TusStorage
 
 import datetime
-import os
+import io
+import mmap
+from contextlib import contextmanager
+from typing import AsyncIterator, Iterator, List, Optional
 from uuid import uuid4
 
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
+
+from tuspyserver.checksum import content_key
+from tuspyserver.events import EXPIRED, upload_event
 from tuspyserver.info import TusUploadInfo
 from tuspyserver.params import TusUploadParams
+from tuspyserver.reader import TusUploadReader
+from tuspyserver.storage.base import expires_before
 
 
 class TusUploadFile:
@@ -23,30 +33,36 @@ class TusUploadFile:
         options: TusRouterOptions,
         uid: str | None = None,
         params: TusUploadParams | None = None,
+        data: bytes | None = None,
     ):
         self._options = options
         # init
         if uid is None:
             # creating new file
             self.uid = str(uuid4().hex)
-            self.create()
+            self.create(params, data)
         else:
             # reading existing file
             self.uid = uid
-        # create the files dir if necessary
-        if not os.path.exists(self._options.files_dir):
-            os.makedirs(self._options.files_dir)
         # instantiate upload info
         self._info = TusUploadInfo(file=self, params=params)
 
     @property
     def path(self) -> str:
-        return os.path.join(self._options.files_dir, f"{self.uid}")
+        return self.storage.path(self.uid)
 
     @property
     def options(self) -> TusRouterOptions:
         return self._options
 
+    @property
+    def storage(self) -> TusStorage:
+        return self._options.storage
+
+    @property
+    def metadata_store(self) -> TusMetadataStore:
+        return self._options.metadata_store
+
     @property
     def info(self) -> TusUploadParams | None:
         return self._info.params
@@ -57,44 +73,185 @@ class TusUploadFile:
 
     @property
     def exists(self) -> bool:
-        return os.path.exists(self.path)
+        return self.storage.stat(self.uid) is not None
 
-    def create(self) -> None:
-        open(self.path, "a").close()
+    def create(
+        self, params: TusUploadParams | None = None, data: bytes | None = None
+    ) -> None:
+        if data is not None:
+            # complete uploads are stored in one go, with their metadata if
+            # the storage keeps it
+            params.offset = len(data)
+            self.storage.put(
+                self.uid,
+                data,
+                params.model_dump() if self.metadata_store is self.storage else None,
+            )
+            return
+        if params is not None:
+            _select_codec(self.options, params)
+        preallocated = self.storage.create(
+            self.uid, params.size if params is not None else None
+        )
+        if params is not None:
+            params.preallocated = preallocated
 
     def read(self) -> bytes | None:
         if self.exists:
-            with open(self.path, "rb") as f:
-                return f.read()
+            return b"".join(self.storage.read(self.uid))
         return None
 
-    def delete(self, uid: str) -> None:
-        if os.path.exists(self.path):
-            os.remove(self.path)
+    # streaming reads, limited to the bytes received so far
+
+    def received(self) -> int:
+        info = self.info
+        return info.offset if info is not None else len(self)
+
+    def iter_blocks(
+        self,
+        block_size: int = 1024 * 1024,
+        start: int = 0,
+        end: Optional[int] = None,
+    ) -> Iterator[bytes]:
+        received = self.received()
+        end = received if end is None else min(end, received)
+        return self.storage.read(self.uid, start, end, block_size)
+
+    async def aiter_blocks(
+        self,
+        block_size: int = 1024 * 1024,
+        start: int = 0,
+        end: Optional[int] = None,
+    ) -> AsyncIterator[bytes]:
+        blocks = await run_in_threadpool(self.iter_blocks, block_size, start, end)
+        async for block in iterate_in_threadpool(blocks):
+            yield block
+
+    def open(self, buffer_size: int = 1024 * 1024) -> io.BufferedReader:
+        """
+        Open the upload as a seekable, read-only binary file.
+        """
+        raw = TusUploadReader(self.storage.open_read(self.uid), self.received())
+        return io.BufferedReader(raw, buffer_size=buffer_size)
+
+    @contextmanager
+    def mmap(self) -> Iterator[memoryview]:
+        """
+        Read-only view of the upload data, memory-mapped for backends that
+        store uploads as files, and read into memory otherwise.
+        """
+        received = self.received()
+        with self.storage.open_read(self.uid) as raw:
+            try:
+                fd = raw.fileno()
+            except (OSError, io.UnsupportedOperation):
+                fd = None
+            if fd is None or received == 0:
+                raw.seek(0)
+                yield memoryview(raw.read(received) or b"")
+                return
+            with mmap.mmap(fd, received, access=mmap.ACCESS_READ) as mapped:
+                view = memoryview(mapped)
+                try:
+                    yield view
+                finally:
+                    view.release()
+
+    def complete(self) -> None:
+        self.storage.complete(self.uid)
+        # completed uploads of the same content share their data
+        info = self.info
+        if self.options.dedup and info is not None and info.checksum is not None:
+            self.storage.dedup(self.uid, content_key(info.checksum), info.size)
 
-        # Only try to delete info file if info exists
-        if self.info is not None and hasattr(self._info, "path"):
-            if os.path.exists(self._info.path):
-                os.remove(self._info.path)
+    def delete(self, uid: str) -> None:
+        # the content the upload may share, read before its metadata is gone
+        info = self.info if self.options.dedup else None
+        self.storage.delete(self.uid)
+        if self.metadata_store is not self.storage:
+            self.metadata_store.delete_info(self.uid)
+        self._info.invalidate()
+        if info is not None and info.checksum is not None:
+            self.storage.release(content_key(info.checksum))
 
     def __len__(self) -> int:
-        if self.exists:
-            return os.path.getsize(self.path)
-        return 0
+        return self.storage.stat(self.uid) or 0
+
+
+def _select_codec(options: TusRouterOptions, params: TusUploadParams) -> None:
+    # the codec is recorded with the upload, and only uploads that have one
+    # are read as compressed
+    if options.compression is not None:
+        codec = options.compression.select(params.metadata)
+        params.codec = codec.name if codec is not None else None
+
+
+def create_files(
+    options: TusRouterOptions, params: List[TusUploadParams]
+) -> List[TusUploadFile]:
+    """
+    Create an upload for each of `params`, with one bulk operation for the
+    data and one for the metadata.
+    """
+    uids = [str(uuid4().hex) for _ in params]
+    preallocated = options.storage.create_many(
+        [(uid, p.size) for uid, p in zip(uids, params)]
+    )
+    for p, reserved in zip(params, preallocated):
+        p.preallocated = reserved
+        _select_codec(options, p)
+    options.metadata_store.put_many(
+        [(uid, p.model_dump()) for uid, p in zip(uids, params)]
+    )
+    return [TusUploadFile(uid=uid, options=options) for uid in uids]
+
+
+def iter_files(options: TusRouterOptions) -> Iterator[str]:
+    return options.metadata_store.list()
 
 
 def list_files(options: TusRouterOptions) -> list[str]:
-    return [f for f in os.listdir(options.files_dir) if len(f) == 32]
+    return list(iter_files(options))
 
 
-def gc_files(options: TusRouterOptions):
-    for uid in list_files(options):
+def delete_expired(
+    options: TusRouterOptions, uid: str, now: datetime.datetime
+) -> Optional[int]:
+    """
+    Delete the upload if it is still expired at `now` and no request holds
+    its lock. Returns the number of bytes it held, or `None` if it was kept.
+    """
+    try:
+        lock = options.locks.acquire(uid)
+    except FileNotFoundError:
+        return None
+    if lock is None:
+        return None
+    try:
         file = TusUploadFile(uid=uid, options=options)
-        if (
-            file.info is not None
-            and file.info.expires
-            and isinstance(file.info.expires, str)
-            and datetime.datetime.fromisoformat(file.info.expires)
-            < datetime.datetime.now()
-        ):
-            file.delete(uid)
+        info = file.info
+        # the upload may have been deleted or extended in the meantime
+        if info is None or not expires_before(info.expires, now):
+            return None
+        size = len(file)
+        file.delete(uid)
+    finally:
+        lock.release()
+    if options.events is not None:
+        options.events.publish(upload_event(EXPIRED, uid))
+    return size
+
+
+def gc_files(options: TusRouterOptions):
+    # materialize first, stores may not like deletes while iterating
+    files = size = 0
+    now = datetime.datetime.now()
+    for uid in list(options.metadata_store.expired(now)):
+        deleted = delete_expired(options, uid, now)
+        if deleted is not None:
+            files += 1
+            size += deleted
+    if files:
+        options.storage.compact()
+    if options.metrics is not None and files:
+        options.metrics.uploads_expired(files, size)
@@ -0,0 +1,89 @@
+from __future__ import annotations
+
+import inspect
+import time
+import typing
+from functools import partial
+from typing import BinaryIO, Callable, ContextManager, Optional
+
+if typing.TYPE_CHECKING:
+    from tuspyserver.file import TusUploadFile
+    from tuspyserver.router import TusRouterOptions
+
+from starlette.concurrency import run_in_threadpool
+
+from tuspyserver.metrics import COMPLETION_HOOK
+from tuspyserver.params import TusUploadParams
+
+
+def accepts_argument(hook: Callable, name: str) -> bool:
+    try:
+        parameters = inspect.signature(hook).parameters.values()
+    except (TypeError, ValueError):
+        return False
+    return any(
+        p.name == name or p.kind == inspect.Parameter.VAR_KEYWORD for p in parameters
+    )
+
+
+async def run_completion_hook(
+    hook: Callable,
+    file_path: str,
+    info: TusUploadParams,
+    open_stream: Optional[Callable[[], BinaryIO]] = None,
+    local_path: Optional[Callable[[], ContextManager[str]]] = None,
+) -> None:
+    # the upload digest and the results of the chunk processors are only
+    # passed to hooks that ask for them, so the `(file_path, metadata)`
+    # signature keeps working
+    kwargs = {}
+    if info.checksum is not None and accepts_argument(hook, "checksum"):
+        kwargs["checksum"] = info.checksum
+    if info.tap_results is not None and accepts_argument(hook, "taps"):
+        kwargs["taps"] = info.tap_results
+    # a readable stream, for uploads whose locator isn't a file path.
+    # Hooks without one get a local file, e.g. a decompressed copy.
+    local = None
+    if open_stream is not None and accepts_argument(hook, "stream"):
+        kwargs["stream"] = await run_in_threadpool(open_stream)
+    elif local_path is not None:
+        local = local_path()
+        file_path = await run_in_threadpool(local.__enter__)
+    try:
+        result = hook(file_path, info.metadata, **kwargs)
+        # if the callback returned a coroutine, await it
+        if inspect.isawaitable(result):
+            await result
+    finally:
+        if "stream" in kwargs:
+            kwargs["stream"].close()
+        if local is not None:
+            await run_in_threadpool(local.__exit__, None, None, None)
+
+
+async def complete_upload(
+    options: TusRouterOptions,
+    on_complete: Optional[Callable],
+    file: TusUploadFile,
+    info: TusUploadParams,
+) -> None:
+    # `on_upload_complete` takes precedence over the dependency, and is
+    # handed to the dispatcher if there is one. Hooks from the dependency
+    # may depend on the request, so they always run inline.
+    if options.on_upload_complete is not None and options.completions is not None:
+        await options.completions.submit(file.uid, file.path, info)
+        return
+    hook = options.on_upload_complete or on_complete
+    if hook is None:
+        return
+    if options.metrics is not None:
+        started = time.perf_counter()
+    await run_completion_hook(
+        hook,
+        file.path,
+        info,
+        file.open,
+        partial(file.storage.local_path, file.uid),
+    )
+    if options.metrics is not None:
+        options.metrics.phase(COMPLETION_HOOK, time.perf_counter() - started)
@@ -3,11 +3,9 @@ from __future__ import annotations
 import typing
 
 if typing.TYPE_CHECKING:
+    from tuspyserver.cache import TusUploadCache
     from tuspyserver.file import TusUploadFile
 
-import json
-import os
-
 from tuspyserver.params import TusUploadParams
 
 
@@ -18,6 +16,8 @@ class TusUploadInfo:
     def __init__(self, file: TusUploadFile, params: TusUploadParams | None = None):
         self.file = file
         self._params = params
+        # what this instance last wrote to the store
+        self._stored: dict | None = None
         # create if doesn't exist
         if params and not self.exists:
             self.serialize()
@@ -33,36 +33,75 @@ class TusUploadInfo:
         self.serialize()
 
     @property
-    def path(self) -> str:
-        return os.path.join(self.file.options.files_dir, f"{self.file.uid}.info")
+    def exists(self) -> bool:
+        return self.file.metadata_store.info_stamp(self.file.uid) is not None
 
     @property
-    def exists(self) -> bool:
-        return os.path.exists(self.path)
+    def cache(self) -> TusUploadCache | None:
+        return self.file.options.upload_cache
 
     def serialize(self) -> None:
-        with open(self.path, "w") as f:
-            json_string = json.dumps(
-                self._params, indent=4, default=lambda k: k.__dict__
-            )
-            f.write(json_string)
+        store = self.file.metadata_store
+        uid = self.file.uid
+        info = self._params.model_dump() if self._params is not None else {}
+        if self._stored and info:
+            # let the store update just what changed since our last write
+            changed = {k for k, v in info.items() if self._stored.get(k) != v}
+            store.update_info(uid, info, changed)
+        else:
+            store.put_info(uid, info)
+        self._stored = info
+        # keep the cache in sync with what we just wrote
+        if self.cache is not None:
+            if self._params is None:
+                self.cache.invalidate(uid)
+            else:
+                self.cache.put(uid, store.info_stamp(uid), self._params)
 
     def deserialize(self) -> TusUploadParams | None:
-        if self.exists:
+        store = self.file.metadata_store
+        uid = self.file.uid
+        stamp = store.info_stamp(uid)
+
+        if stamp is None:
+            self._params = None
+            if self.cache is not None:
+                self.cache.invalidate(uid)
+            return None
+
+        cached = self.cache.get(uid, stamp) if self.cache else None
+
+        if cached is not None:
+            self._params = cached
+        else:
             try:
-                with open(self.path, "r") as f:
-                    content = f.read().strip()
-                    if not content:  # Handle empty files
-                        return None
-                    json_dict = json.loads(content)
-                    if json_dict:  # Only create params if we have valid data
-                        self._params = TusUploadParams(**json_dict)
-                    else:
-                        self._params = None
-            except (json.JSONDecodeError, FileNotFoundError, KeyError, TypeError):
+                json_dict = store.get_info(uid)
+                if json_dict:  # Only create params if we have valid data
+                    self._params = TusUploadParams(**json_dict)
+                else:
+                    self._params = None
+            except (ValueError, FileNotFoundError, KeyError, TypeError):
                 # Handle corrupted JSON or missing required fields
                 self._params = None
-        else:
-            self._params = None
+            if self.cache is not None and self._params is not None:
+                self.cache.put(uid, stamp, self._params)
+
+        # offsets are only checkpointed periodically while streaming, so the
+        # stored size of the data is the source of truth after a restart,
+        # unless the upload was preallocated to its full size. With
+        # durability, saved offsets only cover synced data, so they are kept.
+        if (
+            self._params is not None
+            and not self._params.preallocated
+            and self.file.options.durability is None
+        ):
+            stored = self.file.storage.stat(uid)
+            if stored is not None:
+                self._params.offset = stored
 
         return self._params
+
+    def invalidate(self) -> None:
+        self._stored = None
+        if self.cache is not None:
+            self.cache.invalidate(self.file.uid)
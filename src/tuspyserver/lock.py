@@ -0,0 +1,152 @@
+from __future__ import annotations
+
+import os
+import threading
+import typing
+from abc import ABC, abstractmethod
+from typing import Callable, Optional, Set
+
+if typing.TYPE_CHECKING:
+    from tuspyserver.router import TusRouterOptions
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - not available on windows
+    fcntl = None
+
+from fastapi import HTTPException, Path
+from starlette.concurrency import run_in_threadpool
+
+
+class TusLock(ABC):
+    """
+    Exclusive lock on a single upload, held for the duration of a request.
+    """
+
+    @abstractmethod
+    def release(self) -> None: ...
+
+
+class TusLockProvider(ABC):
+    """
+    Hands out exclusive per-upload locks. Locks are never waited for, a
+    request that can't get the lock is turned away right away.
+
+    Deployments that run the router in several processes without a shared
+    filesystem should provide their own implementation, e.g. on top of Redis
+    or the database that holds the upload metadata.
+    """
+
+    @abstractmethod
+    def acquire(self, uid: str) -> Optional[TusLock]:
+        """
+        Try to lock the upload, returns `None` if it is locked already.
+        """
+
+
+class _MemoryLock(TusLock):
+    def __init__(self, provider: MemoryLockProvider, uid: str):
+        self.provider = provider
+        self.uid = uid
+
+    def release(self) -> None:
+        with self.provider._mutex:
+            self.provider._held.discard(self.uid)
+
+
+class MemoryLockProvider(TusLockProvider):
+    """
+    Locks that only exclude requests served by the same process.
+    """
+
+    def __init__(self):
+        self._mutex = threading.Lock()
+        self._held: Set[str] = set()
+
+    def acquire(self, uid: str) -> Optional[TusLock]:
+        with self._mutex:
+            if uid in self._held:
+                return None
+            self._held.add(uid)
+        return _MemoryLock(self, uid)
+
+
+class _FileLock(TusLock):
+    def __init__(self, fd: int):
+        self.fd = fd
+
+    def release(self) -> None:
+        # closing the descriptor drops the lock
+        os.close(self.fd)
+
+
+class FileLockProvider(TusLockProvider):
+    """
+    `flock` advisory locks on a file of the upload, which exclude requests
+    across all processes on the host, and on hosts sharing an NFS mount.
+
+    `flock` locks belong to an open file, so requests served by different
+    threads of the same process exclude each other too.
+
+    With `exists`, the path of a file that exists as long as the upload
+    does, lock files are created on demand.
+    """
+
+    def __init__(
+        self,
+        lock_path: Callable[[str], str],
+        exists: Optional[Callable[[str], str]] = None,
+    ):
+        if fcntl is None:
+            raise RuntimeError("File locks are not supported on this platform")
+        self.lock_path = lock_path
+        self.exists = exists
+
+    def acquire(self, uid: str) -> Optional[TusLock]:
+        # raises FileNotFoundError for unknown uploads
+        if self.exists is None:
+            fd = os.open(self.lock_path(uid), os.O_RDONLY)
+        else:
+            fd = self._open(uid)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return None
+        except BaseException:
+            os.close(fd)
+            raise
+        return _FileLock(fd)
+
+    def _open(self, uid: str) -> int:
+        if not os.path.exists(self.exists(uid)):
+            raise FileNotFoundError(uid)
+        path = self.lock_path(uid)
+        fd = os.open(path, os.O_RDONLY | os.O_CREAT, 0o644)
+        # deleted in the meantime, don't leave the lock file behind
+        if not os.path.exists(self.exists(uid)):
+            os.close(fd)
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            raise FileNotFoundError(uid)
+        return fd
+
+
+def make_upload_lock_dep(options: TusRouterOptions):
+    async def upload_lock_dep(uuid: str = Path(...)):
+        try:
+            lock = await run_in_threadpool(options.locks.acquire, uuid)
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail="Upload not found")
+        if lock is None:
+            raise HTTPException(
+                status_code=423, detail="Upload is locked by another request"
+            )
+        try:
+            yield
+        finally:
+            lock.release()
+
+    return upload_lock_dep
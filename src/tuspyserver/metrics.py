@@ -0,0 +1,261 @@
+from __future__ import annotations
+
+import asyncio
+import bisect
+import logging
+import threading
+from typing import Callable, Dict, List, Optional, Sequence
+
+from starlette.concurrency import run_in_threadpool
+
+logger = logging.getLogger(__name__)
+
+# phases of the upload routes that are timed
+METADATA_READ = "metadata_read"
+DATA_WRITE = "data_write"
+METADATA_PERSIST = "metadata_persist"
+COMPLETION_HOOK = "completion_hook"
+
+CHUNK_SIZE_BUCKETS = tuple(1024 * 4**i for i in range(9))  # 1 KiB to 64 MiB
+LATENCY_BUCKETS = (
+    0.0001,
+    0.0005,
+    0.001,
+    0.005,
+    0.01,
+    0.05,
+    0.1,
+    0.5,
+    1.0,
+    5.0,
+    10.0,
+)
+
+
+class TusMetrics:
+    """
+    Sink for router metrics. Every method is a no-op, so custom sinks only
+    override what they are interested in.
+
+    Methods may be called from the event loop as well as from i/o threads.
+    """
+
+    def chunk_received(self, size: int) -> None:
+        """
+        A chunk of `size` bytes of an upload was received.
+        """
+
+    def phase(self, name: str, seconds: float) -> None:
+        """
+        A phase of a request took `seconds`, see the `METADATA_READ`,
+        `DATA_WRITE`, `METADATA_PERSIST` and `COMPLETION_HOOK` constants.
+        """
+
+    def stream_started(self) -> None:
+        """
+        A request started streaming data into an upload.
+        """
+
+    def stream_finished(self) -> None:
+        """
+        A request stopped streaming data into an upload.
+        """
+
+    def throttled(self, seconds: float) -> None:
+        """
+        A request was paused for `seconds` to keep within its bandwidth.
+        """
+
+    def upload_rejected(self, reason: str) -> None:
+        """
+        A request was turned away by admission control, see the reasons in
+        `tuspyserver.admission`.
+        """
+
+    def upload_created(self) -> None: ...
+
+    def upload_completed(self) -> None: ...
+
+    def uploads_expired(self, count: int, size: int) -> None:
+        """
+        `count` expired uploads holding `size` bytes were deleted.
+        """
+
+    def start(self, stored_bytes: Callable[[], int]) -> None:
+        """
+        Called when the app starts, with a function that sums up the bytes
+        received by all stored uploads. It may be slow, and blocks.
+        """
+
+    async def stop(self) -> None: ...
+
+
+class _Histogram:
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def render(self, name: str, labels: str = "") -> List[str]:
+        sep = "," if labels else ""
+        lines = []
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            lines.append(f'{name}_bucket{{{labels}{sep}le="{bound}"}} {total}')
+        total += self.counts[-1]
+        lines.append(f'{name}_bucket{{{labels}{sep}le="+Inf"}} {total}')
+        suffix = f"{{{labels}}}" if labels else ""
+        lines.append(f"{name}_sum{suffix} {self.sum}")
+        lines.append(f"{name}_count{suffix} {total}")
+        return lines
+
+
+class PrometheusMetrics(TusMetrics):
+    """
+    Collects router metrics in memory and renders them in the Prometheus
+    text format, see `render`. The router serves them on `GET /metrics`.
+
+    Bytes received per second are `rate(tus_received_bytes_total[1m])`.
+    The bytes stored are summed up every `storage_interval` seconds in a
+    background task, between `start` and `stop`, so rendering them doesn't
+    touch the storage.
+    """
+
+    def __init__(self, storage_interval: float = 60.0):
+        self.storage_interval = storage_interval
+        self._lock = threading.Lock()
+        self._received_bytes = 0
+        self._chunk_sizes = _Histogram(CHUNK_SIZE_BUCKETS)
+        self._phases: Dict[str, _Histogram] = {}
+        self._active = 0
+        self._created = 0
+        self._completed = 0
+        self._expired = 0
+        self._expired_bytes = 0
+        self._throttled = 0.0
+        self._rejected: Dict[str, int] = {}
+        self._stored_bytes: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def chunk_received(self, size: int) -> None:
+        with self._lock:
+            self._received_bytes += size
+            self._chunk_sizes.observe(size)
+
+    def phase(self, name: str, seconds: float) -> None:
+        with self._lock:
+            histogram = self._phases.get(name)
+            if histogram is None:
+                histogram = self._phases[name] = _Histogram(LATENCY_BUCKETS)
+            histogram.observe(seconds)
+
+    def stream_started(self) -> None:
+        with self._lock:
+            self._active += 1
+
+    def stream_finished(self) -> None:
+        with self._lock:
+            self._active -= 1
+
+    def throttled(self, seconds: float) -> None:
+        with self._lock:
+            self._throttled += seconds
+
+    def upload_rejected(self, reason: str) -> None:
+        with self._lock:
+            self._rejected[reason] = self._rejected.get(reason, 0) + 1
+
+    def upload_created(self) -> None:
+        with self._lock:
+            self._created += 1
+
+    def upload_completed(self) -> None:
+        with self._lock:
+            self._completed += 1
+
+    def uploads_expired(self, count: int, size: int) -> None:
+        with self._lock:
+            self._expired += count
+            self._expired_bytes += size
+
+    def start(self, stored_bytes: Callable[[], int]) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._sum_stored(stored_bytes))
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _sum_stored(self, stored_bytes: Callable[[], int]) -> None:
+        while True:
+            try:
+                stored = await run_in_threadpool(stored_bytes)
+            except Exception:
+                logger.exception("Failed to sum up the stored bytes")
+            else:
+                with self._lock:
+                    self._stored_bytes = stored
+            await asyncio.sleep(self.storage_interval)
+
+    def render(self) -> str:
+        """
+        Render all metrics.
+        """
+        with self._lock:
+            lines = [
+                "# HELP tus_received_bytes_total Bytes of upload data received.",
+                "# TYPE tus_received_bytes_total counter",
+                f"tus_received_bytes_total {self._received_bytes}",
+                "# HELP tus_chunk_size_bytes Size of the received chunks.",
+                "# TYPE tus_chunk_size_bytes histogram",
+                *self._chunk_sizes.render("tus_chunk_size_bytes"),
+                "# HELP tus_phase_seconds Latency of the phases of upload requests.",
+                "# TYPE tus_phase_seconds histogram",
+            ]
+            for name, histogram in sorted(self._phases.items()):
+                lines += histogram.render("tus_phase_seconds", f'phase="{name}"')
+            lines += [
+                "# HELP tus_active_uploads Requests streaming data into an upload.",
+                "# TYPE tus_active_uploads gauge",
+                f"tus_active_uploads {self._active}",
+                "# HELP tus_uploads_created_total Uploads created.",
+                "# TYPE tus_uploads_created_total counter",
+                f"tus_uploads_created_total {self._created}",
+                "# HELP tus_uploads_completed_total Uploads that received all bytes.",
+                "# TYPE tus_uploads_completed_total counter",
+                f"tus_uploads_completed_total {self._completed}",
+                "# HELP tus_uploads_expired_total Expired uploads deleted.",
+                "# TYPE tus_uploads_expired_total counter",
+                f"tus_uploads_expired_total {self._expired}",
+                "# HELP tus_expired_bytes_total Bytes of expired uploads deleted.",
+                "# TYPE tus_expired_bytes_total counter",
+                f"tus_expired_bytes_total {self._expired_bytes}",
+                "# HELP tus_throttled_seconds_total Time requests were paused "
+                "by bandwidth limits.",
+                "# TYPE tus_throttled_seconds_total counter",
+                f"tus_throttled_seconds_total {self._throttled}",
+                "# HELP tus_rejected_uploads_total Requests turned away by "
+                "admission control.",
+                "# TYPE tus_rejected_uploads_total counter",
+            ]
+            for reason, count in sorted(self._rejected.items()):
+                lines.append(
+                    f'tus_rejected_uploads_total{{reason="{reason}"}} {count}'
+                )
+            if self._stored_bytes is not None:
+                lines += [
+                    "# HELP tus_stored_bytes Bytes received by all stored uploads.",
+                    "# TYPE tus_stored_bytes gauge",
+                    f"tus_stored_bytes {self._stored_bytes}",
+                ]
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,67 @@
+"""
+Migrate the uploads in a files dir, either into another directory layout:
+
+    python -m tuspyserver.migrate layout /tmp/files --shard-depth 2
+
+or by importing their `.info` files into a SQLite metadata store:
+
+    python -m tuspyserver.migrate sqlite /tmp/files /tmp/uploads.db
+
+Layout migrations can run while the server is up, if its `FileSystemStorage`
+uses `fallback_to_flat=True` until the migration is done.
+"""
+
+import argparse
+
+from tuspyserver.storage.filesystem import FileSystemStorage, migrate_layout
+from tuspyserver.storage.sqlite import SQLiteMetadataStore, import_info_files
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(
+        prog="python -m tuspyserver.migrate",
+        description="Migrate the uploads in a files dir.",
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    layout = commands.add_parser("layout", help="move uploads into another layout")
+    layout.add_argument("files_dir", help="directory the uploads are stored in")
+    layout.add_argument(
+        "--shard-depth",
+        type=int,
+        default=2,
+        help="levels of shard directories, 0 for the flat layout (default: 2)",
+    )
+    layout.add_argument(
+        "--shard-width",
+        type=int,
+        default=2,
+        help="characters of the upload id per shard level (default: 2)",
+    )
+
+    sqlite = commands.add_parser("sqlite", help="import .info files into SQLite")
+    sqlite.add_argument("files_dir", help="directory the uploads are stored in")
+    sqlite.add_argument("database", help="path of the SQLite database")
+    sqlite.add_argument(
+        "--shard-depth",
+        type=int,
+        default=0,
+        help="levels of shard directories the files dir uses (default: 0)",
+    )
+
+    args = parser.parse_args(argv)
+
+    if args.command == "layout":
+        moved = migrate_layout(args.files_dir, args.shard_depth, args.shard_width)
+        count = sum(1 for _ in moved)
+        print(f"moved {count} uploads")
+    else:
+        count = import_info_files(
+            SQLiteMetadataStore(args.database),
+            FileSystemStorage(args.files_dir, shard_depth=args.shard_depth),
+        )
+        print(f"imported {count} uploads")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,4 @@
-from typing import Hashable, Optional, Union
+from typing import Hashable, List, Optional, Union
 
 from pydantic import BaseModel
 
@@ -13,3 +13,14 @@ class TusUploadParams(BaseModel):
     upload_chunk_size: int = 0
     expires: Optional[Union[float, str]]
     error: Optional[str] = None
+    preallocated: bool = False
+    is_partial: bool = False
+    is_final: bool = False
+    partial_uploads: Optional[List[str]] = None
+    checksum: Optional[str] = None
+    checksum_offset: int = 0
+    checksum_state: Optional[int] = None
+    tap_offset: int = 0
+    tap_state: Optional[dict] = None
+    tap_results: Optional[dict] = None
+    codec: Optional[str] = None
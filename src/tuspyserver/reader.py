@@ -0,0 +1,57 @@
+from __future__ import annotations
+
+import io
+from typing import BinaryIO
+
+
+class TusUploadReader(io.RawIOBase):
+    """
+    Seekable, read-only raw stream of the first `length` bytes of an upload,
+    on top of a reader from `TusStorage.open_read`. Preallocated files and
+    uploads in progress may hold more bytes than have been received.
+    """
+
+    def __init__(self, raw: BinaryIO, length: int):
+        self._raw = raw
+        self._length = length
+        self._pos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            pos = offset
+        elif whence == io.SEEK_CUR:
+            pos = self._pos + offset
+        elif whence == io.SEEK_END:
+            pos = self._length + offset
+        else:
+            raise ValueError(f"Invalid whence: {whence}")
+        if pos < 0:
+            raise ValueError(f"Negative seek position: {pos}")
+        self._pos = pos
+        return pos
+
+    def tell(self) -> int:
+        return self._pos
+
+    def readinto(self, b) -> int:
+        size = min(len(b), self._length - self._pos)
+        if size <= 0:
+            return 0
+        self._raw.seek(self._pos)
+        n = self._raw.readinto(memoryview(b).cast("B")[:size]) or 0
+        self._pos += n
+        return n
+
+    def fileno(self) -> int:
+        return self._raw.fileno()
+
+    def close(self) -> None:
+        if not self.closed:
+            self._raw.close()
+        super().close()
@@ -1,4 +1,6 @@
 from __future__ import annotations
+import asyncio
+import time
 import typing
 
 if typing.TYPE_CHECKING:
@@ -6,75 +8,353 @@ if typing.TYPE_CHECKING:
 
 
 from fastapi import (
+    Depends,
     HTTPException,
     Path,
     Request,
 )
 
+from starlette.concurrency import run_in_threadpool
 from starlette.requests import ClientDisconnect
 
+from tuspyserver.admission import make_admission_dep
+from tuspyserver.checksum import format_checksum, new_hasher, parse_upload_checksum
+from tuspyserver.durability import EVERY_N_BYTES, ON_PATCH_END
+from tuspyserver.events import ERROR, OFFSET, upload_event
 from tuspyserver.file import TusUploadFile
+from tuspyserver.lock import make_upload_lock_dep
+from tuspyserver.metrics import DATA_WRITE, METADATA_PERSIST, METADATA_READ
+from tuspyserver.params import TusUploadParams
+from tuspyserver.tap import TusUploadRejected
+from tuspyserver.writer import TusUploadWriter
 
 
 def make_request_chunks_dep(options: TusRouterOptions):
+    # held until the response is sent, concurrent writers are turned away
+    upload_lock_dep = make_upload_lock_dep(options)
+    # over-limit requests are turned away before the lock is taken
+    admission_dep = make_admission_dep(options)
+
     async def request_chunks_dep(
         request: Request,
         uuid: str = Path(...),
         post_request: bool = False,
+        admission=Depends(admission_dep),
+        _lock=Depends(upload_lock_dep),
     ) -> bool | None:
+        metrics = options.metrics
+        durability = options.durability
+        events = options.events
         # init file handle
         file = TusUploadFile(uid=uuid, options=options)
 
         # check if valid file
+        if metrics is not None:
+            started = time.perf_counter()
         if not file.exists or not file.info:
             raise HTTPException(status_code=404, detail="Upload not found")
+        if metrics is not None:
+            metrics.phase(METADATA_READ, time.perf_counter() - started)
+
+        # final uploads are assembled on the server and can't be patched
+        if file.info.is_final:
+            raise HTTPException(status_code=403, detail="Final uploads are read-only")
 
         # init variables
         has_chunks = False
         new_params = file.info
-
-        # process chunk stream
-        with open(f"{options.files_dir}/{uuid}", "ab") as f:
+        start_offset = new_params.offset
+        # https://tus.io/protocols/resumable-upload#checksum
+        request_hasher = None
+        checksum_mismatch = False
+        upload_checksum = request.headers.get("upload-checksum")
+        if upload_checksum is not None:
+            # the data of mismatching requests couldn't be dropped
+            if not file.storage.can_truncate:
+                raise HTTPException(
+                    status_code=400, detail="Upload-Checksum isn't supported"
+                )
             try:
-                async for chunk in request.stream():
-                    has_chunks = True
-                    # skip empty chunks but continue processing
-                    if len(chunk) == 0:
-                        continue
-                    # Check if upload would exceed declared size
-                    if (
-                        new_params.size is not None
-                        and new_params.offset + len(chunk) > new_params.size
-                    ):
-                        raise HTTPException(
-                            status_code=400,
-                            detail="Upload would exceed declared Upload-Length",
+                algorithm, expected_digest = parse_upload_checksum(upload_checksum)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+            request_hasher = new_hasher(algorithm)
+        # running digest of the whole upload, if enabled
+        hasher = None
+        if options.checksums is not None:
+            hasher = await run_in_threadpool(options.checksums.resume, file, new_params)
+            start_hasher = hasher.copy()
+        hashers = [h for h in (hasher, request_hasher) if h is not None]
+        # states of the chunk processors, which see the data as it is written
+        taps = options.taps
+        tap_states = None
+        if taps is not None:
+            tap_states = await taps.resume(file, new_params)
+        rejected = None
+        failure = None
+        # offset events are published at most every `offset_interval`
+        last_event = time.monotonic()
+        # checkpoint state: offsets are persisted every `checkpoint_bytes`
+        # or `checkpoint_interval_ms`, and always when the stream ends
+        unsaved_bytes = 0
+        last_checkpoint = time.monotonic()
+        checkpoint_interval = options.checkpoint_interval_ms / 1000
+        # blocking storage i/o goes through the writer, off the event loop
+        # if an i/o thread pool is configured
+        writer = TusUploadWriter(options.io_executor, options.io_queue_depth)
+        # incoming chunks are coalesced into buffers of `write_buffer_size`
+        # bytes, `written` is the offset of the data handed to the writer
+        buffer = bytearray()
+        written = new_params.offset
+
+        # process chunk stream, through a storage writer at the current offset
+        f = await writer.run(file.storage.open, uuid, written)
+
+        def write(data: bytes) -> None:
+            if metrics is not None:
+                started = time.perf_counter()
+            f.write(data)
+            if metrics is not None:
+                metrics.phase(DATA_WRITE, time.perf_counter() - started)
+            for h in hashers:
+                h.update(data)
+
+        def save(params: TusUploadParams) -> None:
+            if metrics is not None:
+                started = time.perf_counter()
+            # runs in order with the writes, so the digest matches the offset
+            if hasher is not None:
+                params.checksum_offset = params.offset
+                params.checksum_state = options.checksums.suspend(
+                    uuid, params.offset, hasher
+                )
+            file.info = params
+            if metrics is not None:
+                metrics.phase(METADATA_PERSIST, time.perf_counter() - started)
+
+        def persist(params: TusUploadParams) -> None:
+            f.flush()
+            save(params)
+
+        async def persist_durable(params: TusUploadParams) -> None:
+            # the data must be durable before an offset covering it is
+            await writer.run(f.flush)
+            await durability.sync(f)
+            await writer.run(save, params)
+
+        def checkpoint_due() -> bool:
+            if durability is None or durability.mode not in (
+                ON_PATCH_END,
+                EVERY_N_BYTES,
+            ):
+                return (
+                    unsaved_bytes >= options.checkpoint_bytes
+                    or time.monotonic() - last_checkpoint >= checkpoint_interval
+                )
+            if durability.mode == EVERY_N_BYTES:
+                return unsaved_bytes >= durability.sync_bytes
+            # on-patch-end
+            return False
+
+        async def flush(final: bool = False) -> None:
+            nonlocal buffer, written, tap_states
+            if final or options.write_buffer_size <= 0:
+                size = len(buffer)
+            else:
+                # end the write on a buffer-size boundary of the file
+                end = written + len(buffer)
+                size = end - end % options.write_buffer_size - written
+            if size <= 0:
+                return
+            # hand the filled buffer over and keep the remainder
+            out, buffer = buffer, buffer[size:]
+            del out[size:]
+            if tap_states is not None:
+                try:
+                    await taps.process(uuid, tap_states, out)
+                except BaseException:
+                    # the states are ahead of the data now
+                    tap_states = None
+                    raise
+            await writer.submit(write, out)
+            written += size
+
+        async def checkpoint() -> None:
+            nonlocal unsaved_bytes, last_checkpoint
+            # snapshot params, the stream keeps updating them meanwhile,
+            # and only record what has actually been handed to the writer
+            params = new_params.model_copy()
+            params.offset = written
+            if tap_states is not None:
+                params.tap_offset = written
+                params.tap_state = taps.snapshot(tap_states)
+            await writer.submit(
+                persist if durability is None else persist_durable, params
+            )
+            unsaved_bytes = 0
+            last_checkpoint = time.monotonic()
+
+        if metrics is not None:
+            metrics.stream_started()
+        try:
+            async for chunk in request.stream():
+                has_chunks = True
+                # skip empty chunks but continue processing
+                if len(chunk) == 0:
+                    continue
+                if metrics is not None:
+                    metrics.chunk_received(len(chunk))
+                # shape bandwidth by pausing reads from the socket
+                if admission is not None:
+                    delay = admission.take(len(chunk))
+                    if delay > 0:
+                        if metrics is not None:
+                            metrics.throttled(delay)
+                        await asyncio.sleep(delay)
+                # Check if upload would exceed declared size
+                if (
+                    new_params.size is not None
+                    and new_params.offset + len(chunk) > new_params.size
+                ):
+                    raise HTTPException(
+                        status_code=400,
+                        detail="Upload would exceed declared Upload-Length",
+                    )
+                # throw if max size exceeded
+                if new_params.offset + len(chunk) > options.max_size:
+                    raise HTTPException(
+                        status_code=413,
+                        detail="Upload exceeds maximum allowed size",
+                    )
+                # buffer chunk otherwise, and write once the buffer is full
+                buffer += chunk
+                if len(buffer) >= options.write_buffer_size:
+                    await flush()
+                # update upload params
+                new_params.offset += len(chunk)
+                new_params.upload_chunk_size = len(chunk)
+                new_params.upload_part += 1
+                unsaved_bytes += len(chunk)
+                # save updated params once a checkpoint is due
+                if checkpoint_due():
+                    await checkpoint()
+                if (
+                    events is not None
+                    and time.monotonic() - last_event >= events.offset_interval
+                ):
+                    events.publish(
+                        upload_event(
+                            OFFSET,
+                            uuid,
+                            offset=new_params.offset,
+                            size=new_params.size,
                         )
-                    # throw if max size exceeded
-                    if new_params.offset + len(chunk) > options.max_size:
-                        raise HTTPException(
-                            status_code=413,
-                            detail="Upload exceeds maximum allowed size",
+                    )
+                    last_event = time.monotonic()
+            # write what is left and wait for pending writes to hit storage
+            await flush(final=True)
+            await writer.drain()
+            # the data of a request that doesn't match its checksum is dropped
+            if request_hasher is not None:
+                checksum_mismatch = request_hasher.digest() != expected_digest
+        except ClientDisconnect:
+            return False
+        except TusUploadRejected as e:
+            rejected = e
+        except Exception as e:
+            # save the error
+            new_params.error = failure = str(e)
+
+            return False
+        finally:
+            if metrics is not None:
+                metrics.stream_finished()
+            # buffered and pending writes are still valid data, keep them
+            if writer.error is None and rejected is None:
+                try:
+                    await flush(final=True)
+                except Exception:
+                    pass
+            await writer.close()
+            error = writer.error
+            if durability is not None and error is None and not checksum_mismatch:
+                try:
+                    await durability.sync(f)
+                except Exception as e:
+                    error = e
+            await writer.run(f.close)
+            if checksum_mismatch:
+                await writer.run(file.storage.truncate, uuid, start_offset)
+                written = start_offset
+                hasher = start_hasher if hasher is not None else None
+            # always persist the final offset of this request
+            if error is None:
+                new_params.offset = written
+            else:
+                # fall back to the last offset that made it to storage
+                new_params.error = failure = str(error)
+                new_params.offset = file.info.offset
+                hasher = None
+            if hasher is not None and new_params.offset == new_params.size:
+                # the upload is complete, keep its final digest
+                new_params.checksum = format_checksum(
+                    options.checksums.algorithm, hasher.digest()
+                )
+                new_params.checksum_offset = new_params.offset
+                new_params.checksum_state = None
+                options.checksums.discard(uuid)
+                hasher = None
+            if tap_states is not None:
+                if error is not None or checksum_mismatch:
+                    # rebuilt from the stored data on resume
+                    taps.discard(uuid)
+                elif new_params.offset == new_params.size:
+                    try:
+                        new_params.tap_results = await taps.finish(uuid, tap_states)
+                    except TusUploadRejected as e:
+                        rejected = e
+                    new_params.tap_state = None
+                else:
+                    new_params.tap_offset = new_params.offset
+                    new_params.tap_state = taps.snapshot(tap_states)
+                    taps.suspend(uuid, new_params.offset, tap_states)
+            if rejected is not None:
+                # rejected uploads are deleted along with their data
+                if taps is not None:
+                    taps.discard(uuid)
+                if options.checksums is not None:
+                    options.checksums.discard(uuid)
+                await writer.run(file.delete, uuid)
+            else:
+                await writer.run(save, new_params)
+                if durability is not None:
+                    await run_in_threadpool(file.metadata_store.sync_info, uuid)
+            if events is not None:
+                if rejected is not None or failure is not None:
+                    events.publish(
+                        upload_event(
+                            ERROR,
+                            uuid,
+                            offset=new_params.offset,
+                            size=new_params.size,
+                            error=rejected.detail if rejected is not None else failure,
+                        )
+                    )
+                else:
+                    events.publish(
+                        upload_event(
+                            OFFSET,
+                            uuid,
+                            offset=new_params.offset,
+                            size=new_params.size,
                         )
-                    # write chunk otherwise
-                    f.write(chunk)
-                    # update upload params
-                    new_params.offset += len(chunk)
-                    new_params.upload_chunk_size = len(chunk)
-                    new_params.upload_part += 1
-                    # save updated params
-                    file.info = new_params
-            except ClientDisconnect:
-                return False
-            except Exception as e:
-                # save the error
-                new_params.error = str(e)
-                # save updated params
-                file.info = new_params
-
-                return False
-            finally:
-                f.close()
+                    )
+
+        if rejected is not None:
+            raise rejected
+
+        if checksum_mismatch:
+            raise HTTPException(status_code=460, detail="Checksum Mismatch")
 
         # For empty files in a POST request, we still want to return True
         # to ensure the file gets created properly
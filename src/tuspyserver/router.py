@@ -1,14 +1,42 @@
-from typing import Callable, Optional
+import os
+from contextlib import asynccontextmanager
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Callable, Optional, Sequence, Union
 
 from fastapi import APIRouter
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict
 
+from tuspyserver.admission import TusAdmission
+from tuspyserver.cache import TusUploadCache
+from tuspyserver.checksum import CONTENT_ALGORITHMS, TusChecksumRegistry
+from tuspyserver.codec import TusCompression
+from tuspyserver.dispatch import TusCompletionDispatcher
+from tuspyserver.durability import NONE, TusDurability
+from tuspyserver.events import MemoryEventBus, TusEventBus
+from tuspyserver.expiry import TusExpiryScheduler
+from tuspyserver.file import gc_files
+from tuspyserver.lock import TusLockProvider
+from tuspyserver.metrics import PrometheusMetrics, TusMetrics
+from tuspyserver.routes.batch import batch_creation_routes
 from tuspyserver.routes.core import core_routes
 from tuspyserver.routes.creation import creation_extension_routes
+from tuspyserver.routes.download import download_routes
+from tuspyserver.routes.events import event_routes
+from tuspyserver.routes.metrics import metrics_routes
 from tuspyserver.routes.termination import termination_extension_routes
+from tuspyserver.storage import (
+    CompressedStorage,
+    FileSystemStorage,
+    PackedStorage,
+    TusMetadataStore,
+    TusStorage,
+)
+from tuspyserver.tap import TusChunkProcessor, TusChunkTaps
 
 
 class TusRouterOptions(BaseModel):
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
     prefix: str
     files_dir: str
     max_size: int
@@ -17,6 +45,30 @@ class TusRouterOptions(BaseModel):
     on_upload_complete: Optional[Callable[[str, dict], None]]
     upload_complete_dep: Optional[Callable[..., Callable[[str, dict], None]]]
     tags: Optional[list[str]]
+    checkpoint_bytes: int
+    checkpoint_interval_ms: int
+    upload_cache: Optional[TusUploadCache]
+    io_executor: Optional[Executor]
+    io_queue_depth: int
+    write_buffer_size: int
+    pack_threshold: int
+    dedup: bool
+    dedup_shortcut: bool
+    compression: Optional[TusCompression]
+    durability: Optional[TusDurability]
+    storage: TusStorage
+    metadata_store: TusMetadataStore
+    checksums: Optional[TusChecksumRegistry]
+    taps: Optional[TusChunkTaps]
+    locks: TusLockProvider
+    expiry: Optional[TusExpiryScheduler] = None
+    completions: Optional[TusCompletionDispatcher] = None
+    metrics: Optional[TusMetrics]
+    admission: Optional[TusAdmission]
+    events: Optional[TusEventBus]
+    events_firehose: bool
+    download_incomplete: bool
+    max_batch_size: int
     tus_version: str
     tus_extension: str
 
@@ -34,12 +86,81 @@ def create_tus_router(
     on_upload_complete: Optional[Callable[[str, dict], None]] = None,
     upload_complete_dep: Optional[Callable[..., Callable[[str, dict], None]]] = None,
     tags: Optional[list[str]] = None,
+    checkpoint_bytes: int = 8 * 1024 * 1024,
+    checkpoint_interval_ms: int = 1000,
+    cache_size: int = 1024,
+    io_workers: int = 0,
+    io_queue_depth: int = 4,
+    write_buffer_size: int = 4 * 1024 * 1024,
+    durability: str = NONE,
+    durability_bytes: int = 64 * 1024 * 1024,
+    group_commit_window_ms: int = 5,
+    group_commit_syncfs: bool = False,
+    preallocate: bool = False,
+    shard_depth: int = 0,
+    info_format: str = "json",
+    pack_threshold: int = 0,
+    dedup: bool = False,
+    dedup_shortcut: bool = False,
+    compression: Optional[TusCompression] = None,
+    storage: Optional[TusStorage] = None,
+    metadata_store: Optional[TusMetadataStore] = None,
+    checksum_algorithm: Optional[str] = None,
+    chunk_processors: Optional[Sequence[Union[TusChunkProcessor, Callable]]] = None,
+    expire_uploads: bool = False,
+    lock_provider: Optional[TusLockProvider] = None,
+    completion_workers: int = 0,
+    completion_executor: str = "thread",
+    completion_attempts: int = 5,
+    completion_queue_dir: Optional[str] = None,
+    metrics: Optional[TusMetrics] = None,
+    admission: Optional[TusAdmission] = None,
+    events: bool = False,
+    event_bus: Optional[TusEventBus] = None,
+    events_firehose: bool = False,
+    download: bool = False,
+    download_incomplete: bool = False,
+    batch_create: bool = False,
+    max_batch_size: int = 1000,
 ):
-    async def _fallback_on_complete_dep() -> Callable[[str, dict], None]:
-        return on_upload_complete or (lambda *_: None)
+    async def _fallback_on_complete_dep() -> Optional[Callable[[str, dict], None]]:
+        # without a hook, completed uploads aren't looked at
+        return on_upload_complete
 
     upload_complete_dep = upload_complete_dep or _fallback_on_complete_dep
 
+    # uploads are identified by the digest of their content
+    if dedup:
+        checksum_algorithm = checksum_algorithm or "sha256"
+        if checksum_algorithm not in CONTENT_ALGORITHMS:
+            raise ValueError(
+                f"Deduplication needs one of {CONTENT_ALGORITHMS} as checksum algorithm"
+            )
+
+    storage = storage or FileSystemStorage(
+        files_dir,
+        preallocate=preallocate,
+        shard_depth=shard_depth,
+        info_format=info_format,
+        dedup_dir=os.path.join(files_dir, ".dedup") if dedup else None,
+    )
+    if compression is not None:
+        storage = CompressedStorage(storage, compression, metadata_store=metadata_store)
+    if pack_threshold > 0:
+        storage = PackedStorage(
+            storage,
+            os.path.join(files_dir, ".pack", "uploads.pack"),
+            threshold=pack_threshold,
+            sync=durability != NONE,
+        )
+
+    # only crc32 state is kept with the upload, other digests are rebuilt
+    # from the data stored so far when an upload is resumed
+    if checksum_algorithm not in (None, "crc32") and not storage.can_read_incomplete:
+        raise ValueError(
+            "Storage can't read uploads in progress, use crc32 as checksum algorithm"
+        )
+
     options = TusRouterOptions(
         prefix=prefix[1:] if prefix and prefix[0] == "/" else prefix,
         files_dir=files_dir,
@@ -50,33 +171,118 @@ def create_tus_router(
         upload_complete_dep=upload_complete_dep
         or (lambda _: on_upload_complete or (lambda *_: None)),
         tags=tags,
+        checkpoint_bytes=checkpoint_bytes,
+        checkpoint_interval_ms=checkpoint_interval_ms,
+        upload_cache=TusUploadCache(maxsize=cache_size) if cache_size > 0 else None,
+        io_executor=ThreadPoolExecutor(
+            max_workers=io_workers, thread_name_prefix="tus-io"
+        )
+        if io_workers > 0
+        else None,
+        io_queue_depth=io_queue_depth,
+        write_buffer_size=write_buffer_size,
+        pack_threshold=pack_threshold,
+        dedup=dedup,
+        dedup_shortcut=dedup and dedup_shortcut,
+        compression=compression,
+        durability=TusDurability(
+            durability,
+            sync_bytes=durability_bytes,
+            window=group_commit_window_ms / 1000,
+            syncfs=group_commit_syncfs,
+        )
+        if durability != NONE
+        else None,
+        storage=storage,
+        metadata_store=metadata_store or storage,
+        checksums=TusChecksumRegistry(checksum_algorithm)
+        if checksum_algorithm
+        else None,
+        taps=TusChunkTaps(chunk_processors) if chunk_processors else None,
+        locks=lock_provider or storage.lock_provider(),
+        metrics=metrics,
+        admission=admission,
+        events=(event_bus or MemoryEventBus()) if events else None,
+        events_firehose=events_firehose,
+        download_incomplete=download_incomplete,
+        max_batch_size=max_batch_size,
         tus_version="1.0.0",
         tus_extension=",".join(
             [
                 "creation",
                 "creation-defer-length",
                 "creation-with-upload",
+                "concatenation",
+                *(["checksum"] if storage.can_truncate else []),
                 "expiration",
                 "termination",
             ]
         ),
     )
 
+    if expire_uploads:
+        options.expiry = TusExpiryScheduler(options)
+
+    if on_upload_complete is not None and completion_workers > 0:
+        options.completions = TusCompletionDispatcher(
+            on_upload_complete,
+            workers=completion_workers,
+            executor=completion_executor,
+            max_attempts=completion_attempts,
+            queue_dir=completion_queue_dir or os.path.join(files_dir, ".completions"),
+            metrics=metrics,
+            storage=storage,
+        )
+
+    @asynccontextmanager
+    async def lifespan(_app):
+        # background tasks run for as long as the app does
+        if options.events is not None:
+            await options.events.start()
+        if options.expiry is not None:
+            options.expiry.start()
+        if options.completions is not None:
+            options.completions.start()
+        if options.metrics is not None:
+            options.metrics.start(options.metadata_store.bytes_received)
+        try:
+            yield
+        finally:
+            if options.metrics is not None:
+                await options.metrics.stop()
+            if options.completions is not None:
+                await options.completions.stop()
+            if options.expiry is not None:
+                await options.expiry.stop()
+            if options.events is not None:
+                await options.events.stop()
+
     clean_prefix = prefix.lstrip("/").rstrip("/")
     router = APIRouter(
         prefix=f"/{clean_prefix}" if clean_prefix else "",
         redirect_slashes=True,
         tags=options.tags or ["Tus"],
+        lifespan=lifespan,
     )
 
     modules = [
+        # before the upload routes, so "metrics" isn't taken for an upload id
+        *([metrics_routes] if isinstance(metrics, PrometheusMetrics) else []),
+        # likewise "events"
+        *([event_routes] if events else []),
         core_routes,
         # extensions
         creation_extension_routes,
         termination_extension_routes,
+        *([batch_creation_routes] if batch_create else []),
+        *([download_routes] if download else []),
     ]
 
     for mod in modules:
         router = mod(router, options)
 
+    # full scan, for scheduling expiry with an external scheduler instead
+    router.remove_expired_files = lambda: gc_files(options)
+    router.expiry = options.expiry
+
     return router
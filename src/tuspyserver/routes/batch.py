@@ -0,0 +1,102 @@
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional
+
+from fastapi import Depends, HTTPException, Request, Response, status
+from pydantic import BaseModel, Field
+from starlette.concurrency import run_in_threadpool
+
+from tuspyserver.events import COMPLETE, CREATED, upload_event
+from tuspyserver.file import TusUploadParams, create_files
+from tuspyserver.hooks import complete_upload
+from tuspyserver.request import get_request_headers
+
+
+class TusBatchUpload(BaseModel):
+    # `None` defers the length, like `Upload-Defer-Length: 1`
+    length: Optional[int] = Field(None, ge=0)
+    metadata: Dict[str, str] = {}
+
+
+class TusBatchRequest(BaseModel):
+    uploads: List[TusBatchUpload]
+
+
+def batch_creation_routes(router, options):
+    """
+    Not part of the tus protocol, creates many uploads in one request. Their
+    data is sent with the usual `PATCH` requests.
+    """
+
+    @router.post("/batch", status_code=status.HTTP_201_CREATED)
+    async def batch_creation_route(
+        request: Request,
+        response: Response,
+        batch: TusBatchRequest,
+        _=Depends(options.auth),
+        on_complete: Callable[[str, dict], None] = Depends(options.upload_complete_dep),
+    ) -> dict:
+        if len(batch.uploads) > options.max_batch_size:
+            raise HTTPException(
+                status_code=413,
+                detail=f"At most {options.max_batch_size} uploads per batch",
+            )
+        if any(
+            upload.length is not None and upload.length > options.max_size
+            for upload in batch.uploads
+        ):
+            raise HTTPException(
+                status_code=413, detail="Upload exceeds maximum allowed size"
+            )
+
+        now = datetime.now()
+        expires = str((now + timedelta(days=options.days_to_keep)).isoformat())
+        params = [
+            TusUploadParams(
+                metadata=upload.metadata,
+                size=upload.length,
+                offset=0,
+                upload_part=0,
+                created_at=str(now),
+                defer_length=upload.length is None,
+                expires=expires,
+            )
+            for upload in batch.uploads
+        ]
+        files = await run_in_threadpool(create_files, options, params)
+
+        for file, info in zip(files, params):
+            if options.expiry is not None:
+                options.expiry.schedule(file.uid, expires)
+            if options.metrics is not None:
+                options.metrics.upload_created()
+            if options.events is not None:
+                options.events.publish(
+                    upload_event(CREATED, file.uid, offset=0, size=info.size)
+                )
+        # empty uploads are complete right away
+        for file, info in zip(files, params):
+            if info.size == 0:
+                await run_in_threadpool(file.complete)
+                if options.metrics is not None:
+                    options.metrics.upload_completed()
+                if options.events is not None:
+                    options.events.publish(
+                        upload_event(COMPLETE, file.uid, offset=0, size=0)
+                    )
+                await complete_upload(options, on_complete, file, info)
+
+        response.headers["Tus-Resumable"] = options.tus_version
+        response.status_code = status.HTTP_201_CREATED
+        return {
+            "uploads": [
+                {
+                    "id": file.uid,
+                    "location": get_request_headers(
+                        request=request, uuid=file.uid, prefix=options.prefix
+                    )["location"],
+                }
+                for file in files
+            ]
+        }
+
+    return router
@@ -1,12 +1,16 @@
 import base64
-import inspect
-import os
+import time
 from datetime import datetime, timedelta
 from typing import Callable
 
 from fastapi import Depends, Header, HTTPException, Response, status
+from starlette.concurrency import run_in_threadpool
 
+from tuspyserver.checksum import SUPPORTED_ALGORITHMS
+from tuspyserver.events import COMPLETE, upload_event
 from tuspyserver.file import TusUploadFile
+from tuspyserver.hooks import complete_upload
+from tuspyserver.metrics import METADATA_READ
 from tuspyserver.request import make_request_chunks_dep
 
 
@@ -22,22 +26,27 @@ def core_routes(router, options):
         response: Response, uuid: str, _=Depends(options.auth)
     ) -> Response:
         # validate file
+        if options.metrics is not None:
+            started = time.perf_counter()
         file = TusUploadFile(uid=uuid, options=options)
+        info = file.info
 
         # Check if file exists and has valid info
-        if not file.exists or file.info is None:
+        if not file.exists or info is None:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+        if options.metrics is not None:
+            options.metrics.phase(METADATA_READ, time.perf_counter() - started)
 
-        # encode metadata
-        filename = file.info.metadata.get("filename") or file.info.metadata.get("name")
-        if filename is None:
+        # encode metadata, partial uploads usually don't carry any
+        filename = info.metadata.get("filename") or info.metadata.get("name")
+        if filename is None and not info.is_partial:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Upload-file.metadata missing required field: filename",
             )
 
-        filetype = file.info.metadata.get("filetype") or file.info.metadata.get("type")
-        if filetype is None:
+        filetype = info.metadata.get("filetype") or info.metadata.get("type")
+        if filetype is None and not info.is_partial:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Upload-Metadata missing required field: filetype",
@@ -48,12 +57,19 @@ def core_routes(router, options):
 
         # construct response
         response.headers["Tus-Resumable"] = file.options.tus_version
-        response.headers["Upload-Metadata"] = (
-            f"filename {b64(filename)}, filetype {b64(filetype)}"
-        )
-        response.headers["Upload-Length"] = str(file.info.size)
-        response.headers["Upload-Offset"] = str(file.info.offset)
-        response.headers["Content-Length"] = str(file.info.size)
+        if filename is not None and filetype is not None:
+            response.headers["Upload-Metadata"] = (
+                f"filename {b64(filename)}, filetype {b64(filetype)}"
+            )
+        if info.is_partial:
+            response.headers["Upload-Concat"] = "partial"
+        elif info.is_final:
+            response.headers["Upload-Concat"] = "final;" + " ".join(
+                f"/{options.prefix}/{uid}" for uid in info.partial_uploads or []
+            )
+        response.headers["Upload-Length"] = str(info.size)
+        response.headers["Upload-Offset"] = str(info.offset)
+        response.headers["Content-Length"] = str(info.size)
         response.headers["Cache-Control"] = "no-store"
 
         response.status_code = status.HTTP_200_OK
@@ -71,53 +87,57 @@ def core_routes(router, options):
         on_complete: Callable[[str, dict], None] = Depends(options.upload_complete_dep),
     ) -> Response:
         file = TusUploadFile(uid=uuid, options=options)
+        info = file.info
 
         # check if the upload ID is valid and file exists with valid info
-        if not file.exists or file.info is None or uuid != file.uid:
+        if not file.exists or info is None or uuid != file.uid:
             raise HTTPException(status_code=404)
 
         # check if the Upload Offset with Content-Length header is correct
-        if file.info.offset != upload_offset + content_length:
+        if info.offset != upload_offset + content_length:
             raise HTTPException(status_code=409)
 
-        # init copy of params to update
-        new_params = file.info
+        # update params if necessary
+        changed = False
 
-        if file.info.defer_length:
-            new_params.size = upload_offset
+        if info.defer_length:
+            info.size = upload_offset
+            changed = True
 
-        if not file.info.expires:
+        if not info.expires:
             date_expiry = datetime.now() + timedelta(days=options.days_to_keep)
-            new_params.expires = str(date_expiry.isoformat())
+            info.expires = str(date_expiry.isoformat())
+            changed = True
+            if options.expiry is not None:
+                options.expiry.schedule(uuid, info.expires)
 
         # save param changes
-        file.info = new_params
-
-        if file.info.size == file.info.offset:
+        if changed:
+            file.info = info
+
+        if info.size == info.offset:
+            # let the storage finalize the upload before running hooks
+            await run_in_threadpool(file.complete)
+            if options.metrics is not None:
+                options.metrics.upload_completed()
+            if options.events is not None:
+                options.events.publish(
+                    upload_event(COMPLETE, uuid, offset=info.offset, size=info.size)
+                )
             response.headers["Tus-Resumable"] = options.tus_version
             response.headers["Upload-Offset"] = str(
-                str(file.info.offset) if file.info.offset > 0 else str(content_length)
+                str(info.offset) if info.offset > 0 else str(content_length)
             )
-            response.headers["Upload-Expires"] = str(file.info.expires)
+            response.headers["Upload-Expires"] = str(info.expires)
             response.status_code = status.HTTP_204_NO_CONTENT
-            if options.on_upload_complete:
-                options.on_upload_complete(
-                    os.path.join(options.files_dir, f"{uuid}"),
-                    file.info.metadata,
-                )
         else:
             response.headers["Tus-Resumable"] = options.tus_version
-            response.headers["Upload-Offset"] = str(file.info.offset)
-            response.headers["Upload-Expires"] = str(file.info.expires)
+            response.headers["Upload-Offset"] = str(info.offset)
+            response.headers["Upload-Expires"] = str(info.expires)
             response.status_code = status.HTTP_204_NO_CONTENT
 
-        if file.info and file.info.size == file.info.offset:
-            file_path = os.path.join(options.files_dir, uuid)
-            if options.on_upload_complete is None:
-                result = on_complete(file_path, file.info.metadata)
-                # if the callback returned a coroutine, await it
-                if inspect.isawaitable(result):
-                    await result
+        if info.size == info.offset and not info.is_partial:
+            await complete_upload(options, on_complete, file, info)
 
         return response
 
@@ -128,6 +148,10 @@ def core_routes(router, options):
         response.headers["Tus-Resumable"] = options.tus_version
         response.headers["Tus-Extension"] = options.tus_extension
         response.headers["Tus-Max-Size"] = str(options.max_size)
+        if "checksum" in options.tus_extension.split(","):
+            response.headers["Tus-Checksum-Algorithm"] = ",".join(
+                SUPPORTED_ALGORITHMS
+            )
         response.headers["Content-Length"] = str(0)
         response.status_code = status.HTTP_204_NO_CONTENT
 
@@ -1,20 +1,35 @@
+import asyncio
 import base64
-import inspect
-import os
 from datetime import datetime, timedelta
-from typing import Callable
+from typing import Callable, List, Optional
 
 from fastapi import Depends, Header, HTTPException, Request, Response, status
+from starlette.concurrency import run_in_threadpool
 
+from tuspyserver.admission import make_admission_dep
+from tuspyserver.checksum import (
+    content_key,
+    format_checksum,
+    new_hasher,
+    parse_upload_checksum,
+)
 from tuspyserver.file import TusUploadFile, TusUploadParams
-from tuspyserver.request import get_request_headers
+from tuspyserver.events import COMPLETE, CREATED, upload_event
+from tuspyserver.hooks import complete_upload
+from tuspyserver.request import get_request_headers, make_request_chunks_dep
+from tuspyserver.tap import TusUploadRejected
 
 
 def creation_extension_routes(router, options):
     """
     https://tus.io/protocols/resumable-upload#creation
+    https://tus.io/protocols/resumable-upload#concatenation
+    https://tus.io/protocols/resumable-upload#creation-with-upload
     """
 
+    request_chunks_dep = make_request_chunks_dep(options)
+    admission_dep = make_admission_dep(options)
+
     @router.post("", status_code=status.HTTP_201_CREATED)
     @router.post("/", status_code=status.HTTP_201_CREATED)
     async def extension_creation_route(
@@ -23,8 +38,12 @@ def creation_extension_routes(router, options):
         upload_metadata: str = Header(None),
         upload_length: int = Header(None),
         upload_defer_length: int = Header(None),
+        upload_concat: str = Header(None),
+        content_type: str = Header(None),
+        content_length: int = Header(None),
         _=Depends(options.auth),
         on_complete: Callable[[str, dict], None] = Depends(options.upload_complete_dep),
+        admission=Depends(admission_dep),
     ) -> Response:
         # validate upload defer length
         if upload_defer_length is not None and upload_defer_length != 1:
@@ -49,24 +68,198 @@ def creation_extension_routes(router, options):
             defer_length=upload_defer_length is not None,
             expires=str(date_expiry.isoformat()),
         )
+        # https://tus.io/protocols/resumable-upload#concatenation
+        parts = None
+        if upload_concat is not None:
+            if upload_concat == "partial":
+                params.is_partial = True
+            elif upload_concat.startswith("final;"):
+                parts = get_partial_uploads(options, upload_concat)
+                params.is_final = True
+                params.partial_uploads = [part.uid for part in parts]
+                params.size = sum(part.info.size for part in parts)
+                params.defer_length = False
+            else:
+                raise HTTPException(status_code=400, detail="Invalid Upload-Concat")
+        with_upload = (
+            content_type == "application/offset+octet-stream"
+            and content_length is not None
+            and content_length > 0
+        )
+        # uploads of content that is stored already complete without their
+        # data, if the client declares its digest
+        key = None
+        if (
+            options.dedup_shortcut
+            and parts is None
+            and upload_length is not None
+            and options.taps is None
+        ):
+            key = await run_in_threadpool(declared_content, options, params)
+        if key is not None:
+            # the data of the request isn't needed
+            with_upload = False
+        # small uploads that arrive complete are stored in one go
+        data = None
+        if (
+            with_upload
+            and parts is None
+            and options.pack_threshold > 0
+            and upload_length is not None
+            and content_length == upload_length <= options.pack_threshold
+        ):
+            data = await request.body()
+            if len(data) != upload_length:
+                raise HTTPException(status_code=400, detail="Incomplete upload")
+            check_small_upload(options, request, params, data)
+            if options.metrics is not None:
+                options.metrics.chunk_received(len(data))
+            if admission is not None:
+                delay = admission.take(len(data))
+                if delay > 0:
+                    if options.metrics is not None:
+                        options.metrics.throttled(delay)
+                    await asyncio.sleep(delay)
         # create the file
-        file = TusUploadFile(options=options, params=params)
+        file = TusUploadFile(options=options, params=params, data=data)
+        if options.events is not None:
+            options.events.publish(
+                upload_event(CREATED, file.uid, offset=0, size=params.size)
+            )
+        if data is not None and options.taps is not None:
+            # the chunk processors see the whole upload at once
+            try:
+                states = options.taps.start(file.uid, params)
+                await options.taps.process(file.uid, states, data)
+                params.tap_results = await options.taps.finish(file.uid, states)
+            except TusUploadRejected:
+                await run_in_threadpool(file.delete, file.uid)
+                raise
+            file.info = params
+        elif key is not None:
+            linked = await run_in_threadpool(
+                file.storage.link, file.uid, key, params.size
+            )
+            if linked:
+                params.offset = params.size
+                params.checksum = params.metadata["checksum"]
+                params.checksum_offset = params.size
+                file.info = params
+        elif data is None and with_upload and parts is None:
+            # stream the data like a PATCH, nobody else knows the upload yet
+            stored = await request_chunks_dep(
+                request,
+                uuid=file.uid,
+                post_request=True,
+                admission=admission,
+                _lock=None,
+            )
+            # the upload exists, and is resumed from the offset that was saved
+            if not stored:
+                raise HTTPException(status_code=500, detail="Upload failed")
+        # assemble final uploads from their partial uploads on the server
+        if parts is not None:
+            await run_in_threadpool(
+                file.storage.concat, file.uid, params.partial_uploads
+            )
+            params.offset = params.size
+            file.info = params
+        if options.expiry is not None:
+            options.expiry.schedule(file.uid, params.expires)
+        if options.metrics is not None:
+            options.metrics.upload_created()
         # update request headers
         response.headers["Location"] = get_request_headers(
             request=request, uuid=file.uid, prefix=options.prefix
         )["location"]
         response.headers["Tus-Resumable"] = options.tus_version
         response.headers["Content-Length"] = str(0)
+        info = file.info
+        if (with_upload or key is not None) and info is not None:
+            response.headers["Upload-Offset"] = str(info.offset)
         # set status code
         response.status_code = status.HTTP_201_CREATED
-        # run completion hooks
-        if file.info is not None and file.info.size == 0:
-            file_path = os.path.join(options.files_dir, file.uid)
-            result = on_complete(file_path, file.info.metadata)
-            # if the callback returned a coroutine, await it
-            if inspect.isawaitable(result):
-                await result
+        # run completion hooks, final uploads are complete once assembled
+        if info is not None and info.size == info.offset:
+            await run_in_threadpool(file.complete)
+            if options.metrics is not None:
+                options.metrics.upload_completed()
+            if options.events is not None:
+                options.events.publish(
+                    upload_event(
+                        COMPLETE, file.uid, offset=info.offset, size=info.size
+                    )
+                )
+            if not info.is_partial:
+                await complete_upload(options, on_complete, file, info)
 
         return response
 
     return router
+
+
+def check_small_upload(
+    options, request: Request, params: TusUploadParams, data: bytes
+) -> None:
+    """
+    Verify the `Upload-Checksum` of a small upload that arrived in one go,
+    and record its digest if whole-upload digests are enabled.
+    """
+    upload_checksum = request.headers.get("upload-checksum")
+    if upload_checksum is not None:
+        try:
+            algorithm, expected_digest = parse_upload_checksum(upload_checksum)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        hasher = new_hasher(algorithm)
+        hasher.update(data)
+        if hasher.digest() != expected_digest:
+            raise HTTPException(status_code=460, detail="Checksum Mismatch")
+    if options.checksums is not None:
+        hasher = new_hasher(options.checksums.algorithm)
+        hasher.update(data)
+        params.checksum = format_checksum(options.checksums.algorithm, hasher.digest())
+        params.checksum_offset = len(data)
+
+
+def declared_content(options, params: TusUploadParams) -> Optional[str]:
+    """
+    Key of the content whose digest is declared in the `checksum` metadata
+    of a new upload, in the format of `Upload-Checksum`, if it is stored
+    already with the length of the upload.
+    """
+    declared = params.metadata.get("checksum")
+    if declared is None:
+        return None
+    try:
+        algorithm, _ = parse_upload_checksum(declared)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if algorithm != options.checksums.algorithm:
+        return None
+    key = content_key(declared)
+    if options.storage.content_size(key) != params.size:
+        return None
+    return key
+
+
+def get_partial_uploads(options, upload_concat: str) -> List[TusUploadFile]:
+    parts = []
+    # partial uploads are listed as urls or paths, the uid is the last segment
+    for url in upload_concat[len("final;") :].split():
+        part = TusUploadFile(uid=url.rstrip("/").rsplit("/", 1)[-1], options=options)
+        info = part.info
+        if not part.exists or info is None:
+            raise HTTPException(status_code=404, detail=f"Upload not found: {url}")
+        if not info.is_partial:
+            raise HTTPException(
+                status_code=400, detail=f"Upload is not a partial upload: {url}"
+            )
+        if info.size is None or info.offset != info.size:
+            raise HTTPException(
+                status_code=400, detail=f"Partial upload is not complete: {url}"
+            )
+        parts.append(part)
+    if not parts:
+        raise HTTPException(status_code=400, detail="Invalid Upload-Concat")
+    return parts
@@ -0,0 +1,203 @@
+from __future__ import annotations
+
+import os
+from typing import Optional, Tuple
+from urllib.parse import quote
+
+from fastapi import Depends, Header, HTTPException, Response, status
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
+from starlette.responses import StreamingResponse
+from starlette.types import Receive, Scope, Send
+
+from tuspyserver.file import TusUploadFile
+from tuspyserver.storage import TusStorage
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def download_routes(router, options):
+    """
+    Not part of the tus protocol, serves the data of uploads.
+    """
+
+    @router.get("/{uuid}", status_code=status.HTTP_200_OK)
+    def download_route(
+        uuid: str,
+        range: Optional[str] = Header(None),
+        if_range: Optional[str] = Header(None),
+        _=Depends(options.auth),
+    ) -> Response:
+        file = TusUploadFile(uid=uuid, options=options)
+        info = file.info
+        if info is None:
+            raise HTTPException(status_code=404, detail="Upload not found")
+
+        complete = info.size is not None and info.offset == info.size
+        if not complete and not options.download_incomplete:
+            raise HTTPException(status_code=409, detail="Upload is not complete")
+
+        # the data of complete uploads never changes, incomplete uploads only
+        # grow, but may be rolled back if they fail their checksum
+        length = info.offset
+        etag = f'"{uuid}-{length}"' if complete else f'W/"{uuid}-{length}"'
+
+        headers = {
+            "Accept-Ranges": "bytes",
+            "ETag": etag,
+            "Content-Type": info.metadata.get("filetype")
+            or info.metadata.get("type")
+            or "application/octet-stream",
+            "Cache-Control": "private" if complete else "no-store",
+            # the type comes from the client, so browsers must neither
+            # render the data inline nor guess another type for it
+            "Content-Disposition": "attachment",
+            "X-Content-Type-Options": "nosniff",
+        }
+        filename = info.metadata.get("filename") or info.metadata.get("name")
+        if filename:
+            headers["Content-Disposition"] = (
+                f"attachment; filename*=utf-8''{quote(filename)}"
+            )
+
+        start, end = 0, length
+        status_code = status.HTTP_200_OK
+        # ranges are only served if the client's copy is still current, which
+        # needs a strong validator
+        if range is not None and (
+            if_range is None or (complete and if_range == etag)
+        ):
+            try:
+                byte_range = parse_range(range, length)
+            except RangeNotSatisfiable:
+                return Response(
+                    status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+                    headers={"Content-Range": f"bytes */{length}"},
+                )
+            if byte_range is not None:
+                start, end = byte_range
+                status_code = status.HTTP_206_PARTIAL_CONTENT
+                headers["Content-Range"] = f"bytes {start}-{end - 1}/{length}"
+        headers["Content-Length"] = str(end - start)
+
+        return TusDownloadResponse(
+            file.storage, uuid, start, end, status_code=status_code, headers=headers
+        )
+
+    return router
+
+
+def parse_range(header: str, length: int) -> Optional[Tuple[int, int]]:
+    """
+    Parse a `Range` header into a `[start, end)` byte range. Returns `None`
+    for headers that should be ignored, which includes multiple ranges.
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, _, last = spec.strip().partition("-")
+    try:
+        if first == "":
+            # suffix range, the last `last` bytes
+            suffix = int(last)
+            if suffix <= 0:
+                raise RangeNotSatisfiable()
+            start, end = max(length - suffix, 0), length
+        else:
+            start = int(first)
+            end = int(last) + 1 if last else max(length, start + 1)
+            if end <= start:
+                return None
+    except ValueError:
+        return None
+    if start >= length:
+        raise RangeNotSatisfiable()
+    return start, min(end, length)
+
+
+class TusDownloadResponse(Response):
+    """
+    Sends `[start, end)` of an upload.
+
+    Uploads held in local files, see `TusStorage.data_file`, are handed to
+    the server for a zero-copy send if it supports the
+    `http.response.zerocopysend` or, for whole files, the
+    `http.response.pathsend` ASGI extension. Everything else is streamed
+    from `TusStorage.read` in blocks of `block_size`.
+    """
+
+    def __init__(
+        self,
+        storage: TusStorage,
+        uid: str,
+        start: int,
+        end: int,
+        status_code: int = 200,
+        headers: Optional[dict] = None,
+        block_size: int = 1024 * 1024,
+    ):
+        self.storage = storage
+        self.uid = uid
+        self.start = start
+        self.end = end
+        self.block_size = block_size
+        self.status_code = status_code
+        self.background = None
+        self.init_headers(headers)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        extensions = scope.get("extensions") or {}
+        data_file = None
+        if self.end > self.start and (
+            "http.response.zerocopysend" in extensions
+            or "http.response.pathsend" in extensions
+        ):
+            data_file = await run_in_threadpool(self.storage.data_file, self.uid)
+        if data_file is not None:
+            path, position = data_file
+            if "http.response.zerocopysend" in extensions:
+                return await self._zerocopysend(path, position, send)
+            if (
+                "http.response.pathsend" in extensions
+                and self.start == 0
+                and position == 0
+            ):
+                size = await run_in_threadpool(os.path.getsize, path)
+                if size == self.end:
+                    await send(self._start_message())
+                    await send({"type": "http.response.pathsend", "path": path})
+                    return
+
+        blocks = (
+            self.storage.read(self.uid, self.start, self.end, self.block_size)
+            if self.end > self.start
+            else iter(())
+        )
+        response = StreamingResponse(
+            iterate_in_threadpool(blocks), status_code=self.status_code
+        )
+        response.raw_headers = self.raw_headers
+        await response(scope, receive, send)
+
+    async def _zerocopysend(self, path: str, position: int, send: Send) -> None:
+        f = await run_in_threadpool(open, path, "rb")
+        try:
+            await send(self._start_message())
+            await send(
+                {
+                    "type": "http.response.zerocopysend",
+                    "file": f,
+                    "offset": position + self.start,
+                    "count": self.end - self.start,
+                }
+            )
+        finally:
+            f.close()
+
+    def _start_message(self) -> dict:
+        return {
+            "type": "http.response.start",
+            "status": self.status_code,
+            "headers": self.raw_headers,
+        }
@@ -0,0 +1,108 @@
+import asyncio
+import json
+from typing import AsyncIterator, List, Optional
+
+from fastapi import Depends, HTTPException, Query
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import StreamingResponse
+
+from tuspyserver.events import (
+    COMPLETE,
+    DELETED,
+    EXPIRED,
+    OFFSET,
+    TusEventSubscription,
+    upload_event,
+)
+from tuspyserver.file import TusUploadFile
+
+# a comment line every `KEEPALIVE` seconds keeps idle connections open
+KEEPALIVE = 15.0
+
+
+def _format(event: dict) -> str:
+    return f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+
+
+def event_routes(router, options):
+    """
+    Not part of the tus protocol, pushes the events of uploads to clients as
+    https://html.spec.whatwg.org/multipage/server-sent-events.html, instead
+    of having them poll with `HEAD` requests.
+    """
+
+    def current_events(uids: List[str]) -> List[dict]:
+        # the state of the uploads when the stream starts
+        events = []
+        for uid in uids:
+            info = TusUploadFile(uid=uid, options=options).info
+            if info is None:
+                continue
+            complete = info.size is not None and info.offset == info.size
+            events.append(
+                upload_event(
+                    COMPLETE if complete else OFFSET,
+                    uid,
+                    offset=info.offset,
+                    size=info.size,
+                )
+            )
+        return events
+
+    async def stream(
+        subscription: TusEventSubscription,
+        events: List[dict],
+        single: bool,
+    ) -> AsyncIterator[str]:
+        try:
+            while True:
+                for event in events:
+                    yield _format(event)
+                    # the stream of one upload ends with the upload
+                    if single and event["type"] in (COMPLETE, EXPIRED, DELETED):
+                        return
+                try:
+                    events = await asyncio.wait_for(
+                        subscription.get(), timeout=KEEPALIVE
+                    )
+                except asyncio.TimeoutError:
+                    events = []
+                    yield ": keepalive\n\n"
+        finally:
+            subscription.close()
+
+    def response(subscription, events, single) -> StreamingResponse:
+        return StreamingResponse(
+            stream(subscription, events, single),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-store", "X-Accel-Buffering": "no"},
+        )
+
+    @router.get("/events", include_in_schema=False)
+    async def events_route(
+        id: Optional[List[str]] = Query(None),
+        interval: float = Query(0.0, ge=0),
+        _=Depends(options.auth),
+    ) -> StreamingResponse:
+        # the events of all uploads, of every client, are opt-in
+        if not id and not options.events_firehose:
+            raise HTTPException(status_code=400, detail="Missing upload id")
+        # subscribe first, so nothing is missed while reading the uploads
+        subscription = options.events.subscribe(id, interval)
+        events = await run_in_threadpool(current_events, id or [])
+        return response(subscription, events, single=False)
+
+    @router.get("/{uuid}/events", include_in_schema=False)
+    async def upload_events_route(
+        uuid: str,
+        interval: float = Query(0.0, ge=0),
+        _=Depends(options.auth),
+    ) -> StreamingResponse:
+        subscription = options.events.subscribe([uuid], interval)
+        events = await run_in_threadpool(current_events, [uuid])
+        if not events:
+            subscription.close()
+            raise HTTPException(status_code=404, detail="Upload not found")
+        return response(subscription, events, single=True)
+
+    return router
@@ -0,0 +1,17 @@
+from fastapi import Depends
+from fastapi.responses import PlainTextResponse
+
+
+def metrics_routes(router, options):
+    """
+    https://prometheus.io/docs/instrumenting/exposition_formats/#text-based-format
+    """
+
+    @router.get("/metrics", include_in_schema=False)
+    async def metrics_route(_=Depends(options.auth)) -> PlainTextResponse:
+        # the stored bytes are summed up in the background, see `start`
+        return PlainTextResponse(
+            options.metrics.render(), media_type="text/plain; version=0.0.4"
+        )
+
+    return router
@@ -1,6 +1,8 @@
 from fastapi import Depends, HTTPException, Response, status
 
+from tuspyserver.events import DELETED, upload_event
 from tuspyserver.file import TusUploadFile
+from tuspyserver.lock import make_upload_lock_dep
 
 
 def termination_extension_routes(router, options):
@@ -8,9 +10,14 @@ def termination_extension_routes(router, options):
     https://tus.io/protocols/resumable-upload#termination
     """
 
+    upload_lock_dep = make_upload_lock_dep(options)
+
     @router.delete("/{uuid}", status_code=status.HTTP_204_NO_CONTENT)
     def extension_termination_route(
-        uuid: str, response: Response, _=Depends(options.auth)
+        uuid: str,
+        response: Response,
+        _=Depends(options.auth),
+        __=Depends(upload_lock_dep),
     ) -> Response:
         file = TusUploadFile(uid=uuid, options=options)
 
@@ -20,6 +27,8 @@ def termination_extension_routes(router, options):
 
         # Delete the file and metadata for the upload from the mapping
         file.delete(uuid)
+        if options.events is not None:
+            options.events.publish(upload_event(DELETED, uuid))
 
         # Return a 204 No Content response
         response.headers["Tus-Resumable"] = options.tus_version
@@ -0,0 +1,19 @@
+from tuspyserver.storage.base import TusMetadataStore, TusStorage, TusStorageWriter
+from tuspyserver.storage.compressed import CompressedStorage
+from tuspyserver.storage.filesystem import FileSystemStorage
+from tuspyserver.storage.memory import MemoryStorage
+from tuspyserver.storage.pack import PackedStorage
+from tuspyserver.storage.s3 import S3Storage
+from tuspyserver.storage.sqlite import SQLiteMetadataStore
+
+__all__ = [
+    "CompressedStorage",
+    "FileSystemStorage",
+    "MemoryStorage",
+    "PackedStorage",
+    "S3Storage",
+    "SQLiteMetadataStore",
+    "TusMetadataStore",
+    "TusStorage",
+    "TusStorageWriter",
+]
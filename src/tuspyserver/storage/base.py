@@ -0,0 +1,371 @@
+from __future__ import annotations
+
+import datetime
+import io
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import (
+    BinaryIO,
+    Hashable,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
+
+from tuspyserver.lock import MemoryLockProvider, TusLockProvider
+
+
+def expires_before(
+    expires: Optional[Union[float, str]], before: datetime.datetime
+) -> bool:
+    if not expires:
+        return False
+    if isinstance(expires, str):
+        return datetime.datetime.fromisoformat(expires) < before
+    return datetime.datetime.fromtimestamp(expires) < before
+
+
+class TusStorageWriter(ABC):
+    """
+    Sequential writer for the data of a single upload, opened at an offset.
+    """
+
+    @abstractmethod
+    def write(self, data: bytes) -> None: ...
+
+    def flush(self) -> None:
+        """
+        Make the data written so far visible to `TusStorage.stat`, if the
+        backend is able to do so cheaply.
+        """
+
+    def sync(self) -> None:
+        """
+        Make the data written so far durable, so it survives a crash of the
+        host. Defaults to `flush` for backends without a separate step.
+        """
+        self.flush()
+
+    def fileno(self) -> Optional[int]:
+        """
+        File descriptor of the data, for backends that store uploads as
+        files. Used to sync several uploads in one call.
+        """
+        return None
+
+    @abstractmethod
+    def close(self) -> None: ...
+
+
+class _RangeReader(io.RawIOBase):
+    """
+    Seekable raw reader that issues a `TusStorage.read` per call.
+    """
+
+    def __init__(self, storage: TusStorage, uid: str):
+        self._storage = storage
+        self._uid = uid
+        self._pos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            self._pos = offset
+        elif whence == io.SEEK_CUR:
+            self._pos += offset
+        else:
+            self._pos = (self._storage.stat(self._uid) or 0) + offset
+        return self._pos
+
+    def tell(self) -> int:
+        return self._pos
+
+    def readinto(self, b) -> int:
+        view = memoryview(b).cast("B")
+        n = 0
+        for block in self._storage.read(
+            self._uid, self._pos, self._pos + len(view), len(view)
+        ):
+            view[n : n + len(block)] = block
+            n += len(block)
+        self._pos += n
+        return n
+
+
+class TusMetadataStore(ABC):
+    """
+    Store for upload metadata, handed over as JSON-compatible dicts.
+    """
+
+    @abstractmethod
+    def get_info(self, uid: str) -> Optional[dict]: ...
+
+    @abstractmethod
+    def put_info(self, uid: str, info: dict) -> None: ...
+
+    def put_many(self, items: Iterable[Tuple[str, dict]]) -> None:
+        """
+        Store the metadata of many uploads. Stores that can write in bulk
+        should override this.
+        """
+        for uid, info in items:
+            self.put_info(uid, info)
+
+    def update_info(self, uid: str, info: dict, changed: Set[str]) -> None:
+        """
+        Store `info`, of which only the `changed` keys differ from what was
+        last stored. Stores that can update single fields in place should
+        override this.
+        """
+        self.put_info(uid, info)
+
+    def sync_info(self, uid: str) -> None:
+        """
+        Make the stored metadata of the upload durable, if the store doesn't
+        do so on every write.
+        """
+
+    @abstractmethod
+    def delete_info(self, uid: str) -> None: ...
+
+    @abstractmethod
+    def info_stamp(self, uid: str) -> Optional[Hashable]:
+        """
+        Cheap version marker of the stored metadata, used to validate cached
+        upload state. `None` if there is no metadata for the upload.
+        """
+
+    @abstractmethod
+    def list(self) -> Iterator[str]:
+        """
+        Iterate over the ids of all stored uploads.
+        """
+
+    def expired(self, before: datetime.datetime) -> Iterator[str]:
+        """
+        Iterate over the ids of the uploads that expire before `before`.
+        """
+        for uid, _ in self.expiring(before):
+            yield uid
+
+    def expiring(
+        self, before: datetime.datetime
+    ) -> Iterator[Tuple[str, Union[float, str]]]:
+        """
+        Iterate over the ids and expiry dates of the uploads that expire
+        before `before`. Stores with an index on the expiry date should
+        override this scan.
+        """
+        for uid in self.list():
+            info = self.get_info(uid)
+            if info is not None and expires_before(info.get("expires"), before):
+                yield uid, info["expires"]
+
+    def bytes_received(self, completed: Optional[bool] = None) -> int:
+        """
+        Sum of the offsets of the stored uploads, optionally only of those
+        that are (not) complete. Stores that can aggregate should override
+        this scan.
+        """
+        total = 0
+        for uid in self.list():
+            info = self.get_info(uid)
+            if info is None:
+                continue
+            offset = info.get("offset") or 0
+            if completed is not None and (offset == info.get("size")) != completed:
+                continue
+            total += offset
+        return total
+
+
+class TusStorage(TusMetadataStore):
+    """
+    Storage backend for upload data and upload metadata.
+
+    Backends are free to choose how they persist metadata. A separate
+    `TusMetadataStore` can take over the metadata part.
+    """
+
+    # data
+
+    @abstractmethod
+    def create(self, uid: str, size: Optional[int] = None) -> bool:
+        """
+        Create an empty upload. Returns whether `size` bytes were reserved up
+        front, in which case the stored size no longer reflects the offset.
+        """
+
+    def create_many(self, items: Iterable[Tuple[str, Optional[int]]]) -> List[bool]:
+        """
+        Create many empty uploads from `(uid, size)` pairs, see `create`.
+        """
+        return [self.create(uid, size) for uid, size in items]
+
+    @abstractmethod
+    def open(self, uid: str, offset: int) -> TusStorageWriter:
+        """
+        Open a writer that appends to the upload, starting at `offset`.
+        """
+
+    def put(self, uid: str, data: bytes, info: Optional[dict] = None) -> None:
+        """
+        Store a complete upload in one go, and its metadata unless `info` is
+        `None`. Used for small uploads that arrive with their creation.
+        """
+        self.create(uid, len(data))
+        writer = self.open(uid, 0)
+        try:
+            writer.write(data)
+        finally:
+            writer.close()
+        if info is not None:
+            self.put_info(uid, info)
+
+    def truncate(self, uid: str, size: int) -> None:
+        """
+        Drop the data of the upload beyond `size`, used to roll back requests
+        that failed their checksum.
+        """
+        raise NotImplementedError(f"{type(self).__name__} can't truncate uploads")
+
+    @property
+    def can_truncate(self) -> bool:
+        """
+        Whether `truncate` works for any upload in progress. The checksum
+        extension is only offered if it does.
+        """
+        return False
+
+    @abstractmethod
+    def stat(self, uid: str) -> Optional[int]:
+        """
+        Number of bytes stored for the upload, or `None` if it doesn't exist.
+        """
+
+    @abstractmethod
+    def read(
+        self,
+        uid: str,
+        start: int = 0,
+        end: Optional[int] = None,
+        block_size: int = 1024 * 1024,
+    ) -> Iterator[bytes]:
+        """
+        Stream the bytes in `[start, end)` of the upload in blocks.
+        """
+
+    @property
+    def can_read_incomplete(self) -> bool:
+        """
+        Whether `read` works for uploads in progress, e.g. to rebuild their
+        running digest.
+        """
+        return True
+
+    def open_read(self, uid: str) -> BinaryIO:
+        """
+        Open a seekable, unbuffered reader of the upload data. The default
+        issues a `read` per call, backends that have file handles should
+        override this.
+        """
+        return _RangeReader(self, uid)
+
+    def data_file(self, uid: str) -> Optional[Tuple[str, int]]:
+        """
+        Path of a local file that holds the upload data, and the position of
+        the data in it, for zero-copy sends. `None` for remote backends.
+        """
+        return None
+
+    @abstractmethod
+    def delete(self, uid: str) -> None:
+        """
+        Remove the data and the metadata of the upload.
+        """
+
+    def dedup(self, uid: str, key: str, size: int) -> bool:
+        """
+        Share the data of the completed upload, `size` bytes whose digest
+        is `key`, with the other uploads of that content, so it is stored
+        once. Returns whether the data is shared, backends that can't share
+        data return `False`.
+        """
+        return False
+
+    def link(self, uid: str, key: str, size: int) -> bool:
+        """
+        Replace the data of the empty upload `uid` with the stored content
+        `key`, if it is stored with `size` bytes. Returns `False` otherwise,
+        without storing anything under `key`.
+        """
+        return False
+
+    def content_size(self, key: str) -> Optional[int]:
+        """
+        Size of the stored content `key`, or `None` if no upload shares it.
+        """
+        return None
+
+    def release(self, key: str) -> None:
+        """
+        Called after an upload of the content `key` was deleted, to remove
+        the stored content once no upload shares it anymore.
+        """
+
+    def compact(self) -> None:
+        """
+        Reclaim the space of deleted uploads, called after expired uploads
+        were removed.
+        """
+
+    def complete(self, uid: str) -> None:
+        """
+        Called once all bytes of an upload have been received.
+        """
+
+    def concat(self, uid: str, parts: List[str]) -> None:
+        """
+        Fill the empty upload `uid` with the data of the `parts`, in order.
+
+        Backends should override this with a server-side copy, the default
+        streams the parts through a writer.
+        """
+        writer = self.open(uid, 0)
+        try:
+            for part in parts:
+                for block in self.read(part):
+                    writer.write(block)
+        finally:
+            writer.close()
+
+    def lock_provider(self) -> TusLockProvider:
+        """
+        Default provider of per-upload locks for the backend. The locks only
+        exclude requests within one process, unless a backend overrides this.
+        """
+        return MemoryLockProvider()
+
+    @abstractmethod
+    def path(self, uid: str) -> str:
+        """
+        Locator of the upload data that is passed to completion hooks.
+        """
+
+    @contextmanager
+    def local_path(self, uid: str) -> Iterator[str]:
+        """
+        Path of a local file with the upload data, for completion hooks that
+        don't read the `stream` argument, valid until the context exits.
+        The default is the locator from `path`.
+        """
+        yield self.path(uid)
@@ -0,0 +1,471 @@
+"""
+Compressed data files, see `CompressedStorage`.
+
+A compressed upload starts with a file header, followed by frames:
+
+    magic b"\\x89TUSZ\\r\\n\\x1a" | codec name length u8 | codec name
+    flag u8 | data length u32 | stored length u32 | stored data
+
+Each frame holds the data of one write, compressed on its own, or as it is
+if the flag is `RAW`. Only uploads that were created with a codec, which is
+recorded in their `codec` info, are read as frames, so the header of
+uploads stored as they are is never looked for in their data.
+
+Offsets of the upload fall on frame boundaries, so writes resume at any
+of them without codec state, and a torn last frame is dropped when the
+upload is written to again.
+"""
+
+from __future__ import annotations
+
+import bisect
+import datetime
+import os
+import struct
+import tempfile
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import (
+    BinaryIO,
+    Hashable,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
+
+from tuspyserver.codec import TusCodec, TusCompression
+from tuspyserver.lock import TusLockProvider
+from tuspyserver.storage.base import (
+    TusMetadataStore,
+    TusStorage,
+    TusStorageWriter,
+    _RangeReader,
+)
+
+MAGIC = b"\x89TUSZ\r\n\x1a"
+RAW = 0
+ENCODED = 1
+
+_FRAME = struct.Struct("<BII")
+# no cached index
+_UNKNOWN = object()
+
+
+def _file_header(name: str) -> bytes:
+    encoded = name.encode("ascii")
+    return MAGIC + bytes([len(encoded)]) + encoded
+
+
+def _read_exact(f: BinaryIO, size: int) -> bytes:
+    data = b""
+    while len(data) < size:
+        block = f.read(size - len(data))
+        if not block:
+            break
+        data += block
+    return data
+
+
+class _Index:
+    """
+    Frames of a compressed upload, as `(offset, position, length, stored
+    length, flag)`, up to the stored position `end`, which is 0 until the
+    file header is written.
+    """
+
+    __slots__ = ("codec", "frames", "offsets", "size", "end", "stored_size")
+
+    def __init__(self, codec: str, end: int, stored_size: int):
+        self.codec = codec
+        self.frames: List[Tuple[int, int, int, int, int]] = []
+        self.offsets: List[int] = []
+        self.size = 0
+        self.end = end
+        self.stored_size = stored_size
+
+    def copy(self) -> _Index:
+        index = _Index(self.codec, self.end, self.stored_size)
+        index.frames = list(self.frames)
+        index.offsets = list(self.offsets)
+        index.size = self.size
+        return index
+
+    def position(self, offset: int) -> Tuple[int, int]:
+        """
+        Stored position of the frame that starts at `offset`, and its index.
+        """
+        if offset == self.size:
+            return self.end, len(self.frames)
+        i = bisect.bisect_left(self.offsets, offset)
+        if i == len(self.offsets) or self.offsets[i] != offset:
+            raise ValueError(f"Offset {offset} is not on a frame boundary")
+        return self.frames[i][1], i
+
+
+class _FrameWriter(TusStorageWriter):
+    def __init__(
+        self,
+        writer: TusStorageWriter,
+        codec: TusCodec,
+        compression: TusCompression,
+        incompressible: int = 0,
+    ):
+        self._writer = writer
+        self._codec = codec
+        self._compression = compression
+        # blocks in a row that didn't compress, and blocks since skipped
+        self._incompressible = incompressible
+        self._skipped = 0
+
+    def _encode(self, data: bytes) -> Tuple[int, bytes]:
+        compression = self._compression
+        if (
+            self._incompressible >= compression.probe
+            and self._skipped < compression.reprobe
+        ):
+            self._skipped += 1
+            return RAW, data
+        self._skipped = 0
+        encoded = self._codec.encode(data)
+        if len(encoded) > len(data) * compression.min_ratio:
+            self._incompressible += 1
+            return RAW, data
+        self._incompressible = 0
+        return ENCODED, encoded
+
+    def write(self, data: bytes) -> None:
+        flag, stored = self._encode(data)
+        self._writer.write(_FRAME.pack(flag, len(data), len(stored)))
+        self._writer.write(stored)
+
+    def flush(self) -> None:
+        self._writer.flush()
+
+    def sync(self) -> None:
+        self._writer.sync()
+
+    def fileno(self) -> Optional[int]:
+        return self._writer.fileno()
+
+    def close(self) -> None:
+        self._writer.close()
+
+
+class CompressedStorage(TusStorage):
+    """
+    Compresses the data of uploads that are stored by `storage`, with the
+    codec that `compression` chose from the metadata of each upload when it
+    was created, as recorded in its `codec` info. Offsets, reads and
+    everything else are in uncompressed bytes, and uploads stored without
+    a codec are handed to `storage` as they are.
+
+    The metadata is read from `metadata_store`, which defaults to this
+    storage. The frame indexes of recently used uploads are cached, up to
+    `maxsize`. Uploads aren't preallocated, since the stored size of the
+    data is only known once it is written.
+    """
+
+    def __init__(
+        self,
+        storage: TusStorage,
+        compression: TusCompression,
+        metadata_store: Optional[TusMetadataStore] = None,
+        maxsize: int = 1024,
+    ):
+        self.storage = storage
+        self.compression = compression
+        self.metadata_store = metadata_store or self
+        self.maxsize = maxsize
+        self._indexes: OrderedDict[str, Optional[_Index]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _codec(self, uid: str, info: Optional[dict] = None) -> Optional[str]:
+        if info is None:
+            info = self.metadata_store.get_info(uid)
+        return (info or {}).get("codec")
+
+    def _index(self, uid: str) -> Optional[_Index]:
+        """
+        Frame index of an upload created with a codec, `None` for others.
+        """
+        with self._lock:
+            cached = self._indexes.get(uid, _UNKNOWN)
+            if cached is not _UNKNOWN:
+                self._indexes.move_to_end(uid)
+        if cached is None:
+            return None
+        if cached is _UNKNOWN:
+            info = self.metadata_store.get_info(uid)
+            if info is None:
+                # not created yet, nothing to cache
+                return None
+            name = self._codec(uid, info)
+        else:
+            name = cached.codec
+        if name is None:
+            index = None
+        else:
+            stored_size = self.storage.stat(uid)
+            if stored_size is None:
+                return None
+            if cached is not _UNKNOWN and cached.stored_size == stored_size:
+                return cached
+            if cached is _UNKNOWN or not cached.end or stored_size < cached.end:
+                index = self._open_index(uid, name, stored_size)
+            else:
+                # scan the frames written since
+                index = cached.copy()
+            if index.end:
+                self._scan(uid, index, stored_size)
+        with self._lock:
+            self._indexes[uid] = index
+            while len(self._indexes) > self.maxsize:
+                self._indexes.popitem(last=False)
+        return index
+
+    def _open_index(self, uid: str, name: str, stored_size: int) -> _Index:
+        header = _file_header(name)
+        if stored_size < len(header):
+            # no data yet, or a torn header
+            return _Index(name, 0, stored_size)
+        with self.storage.open_read(uid) as f:
+            if _read_exact(f, len(header)) != header:
+                raise ValueError(f"Upload {uid} isn't stored with codec {name}")
+        return _Index(name, len(header), stored_size)
+
+    def _scan(self, uid: str, index: _Index, stored_size: int) -> None:
+        with self.storage.open_read(uid) as f:
+            pos = index.end
+            while pos + _FRAME.size <= stored_size:
+                f.seek(pos)
+                header = _read_exact(f, _FRAME.size)
+                if len(header) < _FRAME.size:
+                    break
+                flag, length, stored = _FRAME.unpack(header)
+                end = pos + _FRAME.size + stored
+                # torn, or not written yet
+                if flag not in (RAW, ENCODED) or length == 0 or end > stored_size:
+                    break
+                index.frames.append((index.size, pos, length, stored, flag))
+                index.offsets.append(index.size)
+                index.size += length
+                pos = end
+        index.end = pos
+        index.stored_size = stored_size
+
+    def _forget(self, uid: str) -> None:
+        with self._lock:
+            self._indexes.pop(uid, None)
+
+    def _start(self, uid: str, codec: TusCodec) -> _FrameWriter:
+        writer = self.storage.open(uid, 0)
+        writer.write(_file_header(codec.name))
+        self._forget(uid)
+        return _FrameWriter(writer, codec, self.compression)
+
+    # data
+
+    def put(self, uid: str, data: bytes, info: Optional[dict] = None) -> None:
+        # uploads stored in one go aren't created with a codec
+        self._forget(uid)
+        self.storage.put(uid, data, info)
+
+    def create(self, uid: str, size: Optional[int] = None) -> bool:
+        return self.storage.create(uid)
+
+    def create_many(self, items: Iterable[Tuple[str, Optional[int]]]) -> List[bool]:
+        return self.storage.create_many([(uid, None) for uid, _ in items])
+
+    def open(self, uid: str, offset: int) -> TusStorageWriter:
+        index = self._index(uid)
+        if index is None:
+            return self.storage.open(uid, offset)
+        pos, i = index.position(offset)
+        if not index.end:
+            # the first data of the upload
+            if index.stored_size:
+                self.storage.truncate(uid, 0)
+            return self._start(uid, self.compression.codec(index.codec))
+        if index.stored_size > pos:
+            # drop what follows, e.g. a torn frame
+            self.storage.truncate(uid, pos)
+            self._forget(uid)
+        # whether the upload was compressible so far
+        incompressible = 0
+        for frame in reversed(index.frames[:i]):
+            if frame[4] != RAW or incompressible >= self.compression.probe:
+                break
+            incompressible += 1
+        return _FrameWriter(
+            self.storage.open(uid, pos),
+            self.compression.codec(index.codec),
+            self.compression,
+            incompressible,
+        )
+
+    def truncate(self, uid: str, size: int) -> None:
+        index = self._index(uid)
+        if index is None:
+            return self.storage.truncate(uid, size)
+        self.storage.truncate(uid, index.position(size)[0])
+        self._forget(uid)
+
+    @property
+    def can_truncate(self) -> bool:
+        return self.storage.can_truncate
+
+    @property
+    def can_read_incomplete(self) -> bool:
+        return self.storage.can_read_incomplete
+
+    def stat(self, uid: str) -> Optional[int]:
+        index = self._index(uid)
+        if index is None:
+            return self.storage.stat(uid)
+        return index.size
+
+    def read(
+        self,
+        uid: str,
+        start: int = 0,
+        end: Optional[int] = None,
+        block_size: int = 1024 * 1024,
+    ) -> Iterator[bytes]:
+        index = self._index(uid)
+        if index is None:
+            yield from self.storage.read(uid, start, end, block_size)
+            return
+        codec = self.compression.codec(index.codec)
+        end = index.size if end is None else min(end, index.size)
+        i = max(bisect.bisect_right(index.offsets, start) - 1, 0)
+        for offset, pos, length, stored, flag in index.frames[i:]:
+            if offset >= end:
+                break
+            lo = max(start - offset, 0)
+            hi = min(end - offset, length)
+            data_pos = pos + _FRAME.size
+            if flag == RAW:
+                yield from self.storage.read(
+                    uid, data_pos + lo, data_pos + hi, block_size
+                )
+                continue
+            data = codec.decode(
+                b"".join(self.storage.read(uid, data_pos, data_pos + stored)),
+                length,
+            )
+            view = memoryview(data)
+            for p in range(lo, hi, block_size):
+                yield bytes(view[p : min(p + block_size, hi)])
+
+    def open_read(self, uid: str) -> BinaryIO:
+        if self._index(uid) is None:
+            return self.storage.open_read(uid)
+        return _RangeReader(self, uid)
+
+    def data_file(self, uid: str) -> Optional[Tuple[str, int]]:
+        if self._index(uid) is not None:
+            return None
+        return self.storage.data_file(uid)
+
+    def delete(self, uid: str) -> None:
+        self._forget(uid)
+        self.storage.delete(uid)
+
+    def complete(self, uid: str) -> None:
+        self.storage.complete(uid)
+
+    def concat(self, uid: str, parts: List[str]) -> None:
+        if self._index(uid) is None and all(
+            self._index(part) is None for part in parts
+        ):
+            return self.storage.concat(uid, parts)
+        # stream the parts through a writer
+        super().concat(uid, parts)
+
+    def dedup(self, uid: str, key: str, size: int) -> bool:
+        # uploads are shared as stored, compressed or not, so only those
+        # stored the same way end up sharing data
+        if self.stat(uid) != size:
+            return False
+        shared = self.storage.dedup(uid, key, self.storage.stat(uid))
+        self._forget(uid)
+        return shared
+
+    def link(self, uid: str, key: str, size: int) -> bool:
+        # the stored size of the content doesn't tell its uncompressed size
+        return False
+
+    def content_size(self, key: str) -> Optional[int]:
+        return None
+
+    def release(self, key: str) -> None:
+        self.storage.release(key)
+
+    def compact(self) -> None:
+        self.storage.compact()
+
+    def lock_provider(self) -> TusLockProvider:
+        return self.storage.lock_provider()
+
+    def path(self, uid: str) -> str:
+        if self._index(uid) is not None:
+            return f"compressed://{uid}"
+        return self.storage.path(uid)
+
+    @contextmanager
+    def local_path(self, uid: str) -> Iterator[str]:
+        if self._index(uid) is None:
+            with self.storage.local_path(uid) as path:
+                yield path
+            return
+        # a decompressed copy, removed once the hook is done with it
+        fd, path = tempfile.mkstemp(prefix=f"tus-{uid}-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for block in self.read(uid):
+                    f.write(block)
+            yield path
+        finally:
+            os.remove(path)
+
+    def list(self) -> Iterator[str]:
+        return self.storage.list()
+
+    # metadata
+
+    def get_info(self, uid: str) -> Optional[dict]:
+        return self.storage.get_info(uid)
+
+    def put_info(self, uid: str, info: dict) -> None:
+        self.storage.put_info(uid, info)
+
+    def put_many(self, items: Iterable[Tuple[str, dict]]) -> None:
+        self.storage.put_many(items)
+
+    def update_info(self, uid: str, info: dict, changed: Set[str]) -> None:
+        self.storage.update_info(uid, info, changed)
+
+    def sync_info(self, uid: str) -> None:
+        self.storage.sync_info(uid)
+
+    def delete_info(self, uid: str) -> None:
+        self.storage.delete_info(uid)
+
+    def info_stamp(self, uid: str) -> Optional[Hashable]:
+        return self.storage.info_stamp(uid)
+
+    def expired(self, before: datetime.datetime) -> Iterator[str]:
+        return self.storage.expired(before)
+
+    def expiring(
+        self, before: datetime.datetime
+    ) -> Iterator[Tuple[str, Union[float, str]]]:
+        return self.storage.expiring(before)
+
+    def bytes_received(self, completed: Optional[bool] = None) -> int:
+        return self.storage.bytes_received(completed)
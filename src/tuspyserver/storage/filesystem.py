@@ -0,0 +1,473 @@
+from __future__ import annotations
+
+import json
+import os
+import shutil
+import string
+from typing import BinaryIO, Hashable, Iterable, Iterator, List, Optional, Set, Tuple
+
+from tuspyserver.lock import FileLockProvider, TusLockProvider, fcntl
+from tuspyserver.storage import sidecar
+from tuspyserver.storage.base import TusStorage, TusStorageWriter
+
+
+class FileSystemWriter(TusStorageWriter):
+    def __init__(self, path: str, offset: int):
+        self._f = open(path, "r+b")
+        # preallocated files are already full size, so write at the offset
+        self._f.seek(offset)
+
+    def write(self, data: bytes) -> None:
+        self._f.write(data)
+
+    def flush(self) -> None:
+        self._f.flush()
+
+    def sync(self) -> None:
+        self._f.flush()
+        _fdatasync(self._f.fileno())
+
+    def fileno(self) -> Optional[int]:
+        return self._f.fileno()
+
+    def close(self) -> None:
+        self._f.close()
+
+
+class FileSystemStorage(TusStorage):
+    """
+    Stores each upload as a data file and a `.info` JSON sidecar in
+    `files_dir`.
+
+    With `shard_depth > 0`, files are nested in `shard_depth` levels of
+    directories named after `shard_width` characters of the upload id, e.g.
+    `ab/cd/abcd...` for a depth of 2. `fallback_to_flat` also finds files
+    that are still in the flat layout, while `migrate_layout` moves them.
+
+    With `info_format="binary"`, `.info` files are written in the format of
+    `tuspyserver.storage.sidecar`, whose offset counters are updated in
+    place. JSON `.info` files are read in either case.
+
+    With a `dedup_dir`, completed uploads of the same content share one
+    data file: the first one is hard-linked into `dedup_dir` under its
+    content key, and the data files of later ones are replaced by links to
+    it. The link count of the stored copy is its reference count, it is
+    removed along with the last upload that links to it.
+    """
+
+    def __init__(
+        self,
+        files_dir: str,
+        preallocate: bool = False,
+        shard_depth: int = 0,
+        shard_width: int = 2,
+        fallback_to_flat: bool = False,
+        info_format: str = "json",
+        dedup_dir: Optional[str] = None,
+    ):
+        if info_format not in ("json", "binary"):
+            raise ValueError(f"Unsupported info format: {info_format}")
+        self.files_dir = files_dir
+        self.preallocate = preallocate
+        self.shard_depth = shard_depth
+        self.shard_width = shard_width
+        self.fallback_to_flat = fallback_to_flat and shard_depth > 0
+        self.info_format = info_format
+        self.dedup_dir = dedup_dir
+
+    def shard_dir(self, uid: str) -> str:
+        return os.path.join(
+            self.files_dir,
+            *shard_names(uid, self.shard_depth, self.shard_width),
+        )
+
+    def _resolve(self, uid: str, name: str) -> str:
+        path = os.path.join(self.shard_dir(uid), name)
+        if self.fallback_to_flat and not os.path.exists(path):
+            flat = os.path.join(self.files_dir, name)
+            if os.path.exists(flat):
+                return flat
+        return path
+
+    def data_path(self, uid: str) -> str:
+        return self._resolve(uid, f"{uid}")
+
+    def info_path(self, uid: str) -> str:
+        return self._resolve(uid, f"{uid}.info")
+
+    # data
+
+    def create(self, uid: str, size: Optional[int] = None) -> bool:
+        path = os.path.join(self.shard_dir(uid), f"{uid}")
+        try:
+            f = open(path, "a")
+        except FileNotFoundError:
+            # create the files dir and the shard dirs if necessary
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            f = open(path, "a")
+        with f:
+            # reserve the full upload length up front when it is known
+            if self.preallocate and size and hasattr(os, "posix_fallocate"):
+                try:
+                    os.posix_fallocate(f.fileno(), 0, size)
+                    return True
+                except OSError:
+                    # not supported by the filesystem, grow on append instead
+                    pass
+        return False
+
+    def create_many(self, items: Iterable[Tuple[str, Optional[int]]]) -> List[bool]:
+        # check each directory once, not once per upload
+        dirs = set()
+        preallocated = []
+        for uid, size in items:
+            shard_dir = self.shard_dir(uid)
+            if shard_dir not in dirs:
+                os.makedirs(shard_dir, exist_ok=True)
+                dirs.add(shard_dir)
+            preallocated.append(self.create(uid, size))
+        return preallocated
+
+    def open(self, uid: str, offset: int) -> FileSystemWriter:
+        return FileSystemWriter(self.data_path(uid), offset)
+
+    def truncate(self, uid: str, size: int) -> None:
+        os.truncate(self.data_path(uid), size)
+
+    @property
+    def can_truncate(self) -> bool:
+        return True
+
+    def stat(self, uid: str) -> Optional[int]:
+        try:
+            return os.path.getsize(self.data_path(uid))
+        except OSError:
+            return None
+
+    def read(
+        self,
+        uid: str,
+        start: int = 0,
+        end: Optional[int] = None,
+        block_size: int = 1024 * 1024,
+    ) -> Iterator[bytes]:
+        with open(self.data_path(uid), "rb") as f:
+            f.seek(start)
+            remaining = None if end is None else end - start
+            while remaining is None or remaining > 0:
+                size = block_size if remaining is None else min(block_size, remaining)
+                block = f.read(size)
+                if not block:
+                    break
+                if remaining is not None:
+                    remaining -= len(block)
+                yield block
+
+    def open_read(self, uid: str) -> BinaryIO:
+        return open(self.data_path(uid), "rb", buffering=0)
+
+    def data_file(self, uid: str) -> Optional[Tuple[str, int]]:
+        return os.path.abspath(self.data_path(uid)), 0
+
+    def delete(self, uid: str) -> None:
+        for path in (self.data_path(uid), self.info_path(uid), self.lock_path(uid)):
+            if os.path.exists(path):
+                os.remove(path)
+
+    # content-addressed data
+
+    def blob_path(self, key: str) -> str:
+        digest = key.partition("-")[2]
+        return os.path.join(self.dedup_dir, digest[:2], key)
+
+    def dedup(self, uid: str, key: str, size: int) -> bool:
+        if self.dedup_dir is None:
+            return False
+        path = self.data_path(uid)
+        blob = self.blob_path(key)
+        # only complete data becomes the stored copy
+        try:
+            if os.path.getsize(path) != size:
+                return False
+            if os.path.samefile(path, blob):
+                return True
+        except FileNotFoundError:
+            if not os.path.exists(path):
+                return False
+        if self.link(uid, key, size):
+            return True
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        try:
+            # the first upload of the content becomes the stored copy
+            os.link(path, blob)
+            return True
+        except FileExistsError:
+            # stored by another upload in the meantime
+            return self.link(uid, key, size)
+        except OSError:
+            # hard links aren't supported
+            return False
+
+    def link(self, uid: str, key: str, size: int) -> bool:
+        if self.dedup_dir is None:
+            return False
+        path = self.data_path(uid)
+        # link the stored copy next to the data file, then swap them
+        tmp = f"{path}.dedup"
+        try:
+            os.link(self.blob_path(key), tmp)
+        except OSError:
+            # not stored, removed in the meantime, or no hard links
+            return False
+        # the link keeps the stored copy, check what it holds
+        if os.path.getsize(tmp) != size:
+            os.remove(tmp)
+            return False
+        os.replace(tmp, path)
+        return True
+
+    def content_size(self, key: str) -> Optional[int]:
+        if self.dedup_dir is None:
+            return None
+        try:
+            return os.path.getsize(self.blob_path(key))
+        except OSError:
+            return None
+
+    def release(self, key: str) -> None:
+        if self.dedup_dir is not None:
+            _remove_unreferenced(self.blob_path(key))
+
+    def compact(self) -> None:
+        # stored copies that weren't released, e.g. after a crash
+        if self.dedup_dir is None:
+            return
+        for root, _, names in os.walk(self.dedup_dir):
+            for name in names:
+                _remove_unreferenced(os.path.join(root, name))
+
+    def concat(self, uid: str, parts: List[str]) -> None:
+        with open(self.data_path(uid), "r+b") as dst:
+            offset = 0
+            for part in parts:
+                with open(self.data_path(part), "rb") as src:
+                    size = os.fstat(src.fileno()).st_size
+                    _copy_range(src, dst, size, offset)
+                    offset += size
+
+    def lock_path(self, uid: str) -> str:
+        return self._resolve(uid, f"{uid}.lock")
+
+    def lock_provider(self) -> TusLockProvider:
+        if fcntl is None:
+            return super().lock_provider()
+        if self.dedup_dir is not None:
+            # data files may be links to the same file, so lock a file of
+            # each upload's own
+            return FileLockProvider(self.lock_path, exists=self.data_path)
+        # lock the data file itself, it lives as long as the upload
+        return FileLockProvider(self.data_path)
+
+    def path(self, uid: str) -> str:
+        return self.data_path(uid)
+
+    def list(self) -> Iterator[str]:
+        return iter_layout(self.files_dir, self.shard_depth, self.shard_width)
+
+    # metadata
+
+    def get_info(self, uid: str) -> Optional[dict]:
+        try:
+            with open(self.info_path(uid), "rb") as f:
+                content = f.read()
+        except FileNotFoundError:
+            return None
+        if not content.strip():  # Handle empty files
+            return None
+        return sidecar.decode_info(content)
+
+    def put_info(self, uid: str, info: dict) -> None:
+        path = self.info_path(uid)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._write_info(path, info)
+
+    def put_many(self, items: Iterable[Tuple[str, dict]]) -> None:
+        # new uploads, whose directories were made by `create_many`
+        for uid, info in items:
+            path = os.path.join(self.shard_dir(uid), f"{uid}.info")
+            try:
+                self._write_info(path, info)
+            except FileNotFoundError:
+                self.put_info(uid, info)
+
+    def _write_info(self, path: str, info: dict) -> None:
+        if self.info_format == "binary":
+            with open(path, "wb") as f:
+                f.write(sidecar.encode_info(info) if info else b"")
+        else:
+            with open(path, "w") as f:
+                f.write(json.dumps(info, indent=4))
+
+    def update_info(self, uid: str, info: dict, changed: Set[str]) -> None:
+        if (
+            self.info_format != "binary"
+            or not changed.issubset(sidecar.COUNTER_FIELDS)
+            or not hasattr(os, "pwrite")
+        ):
+            return self.put_info(uid, info)
+        try:
+            fd = os.open(self.info_path(uid), os.O_RDWR)
+        except FileNotFoundError:
+            return self.put_info(uid, info)
+        try:
+            # legacy JSON files are converted by the full rewrite
+            current = sidecar.is_current(os.pread(fd, sidecar.PREFIX_SIZE, 0))
+            if current:
+                os.pwrite(fd, sidecar.encode_counters(info), sidecar.COUNTERS_OFFSET)
+        finally:
+            os.close(fd)
+        if not current:
+            self.put_info(uid, info)
+
+    def sync_info(self, uid: str) -> None:
+        try:
+            fd = os.open(self.info_path(uid), os.O_RDONLY)
+        except FileNotFoundError:
+            return
+        try:
+            _fdatasync(fd)
+        finally:
+            os.close(fd)
+
+    def delete_info(self, uid: str) -> None:
+        path = self.info_path(uid)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def info_stamp(self, uid: str) -> Optional[Hashable]:
+        try:
+            st = os.stat(self.info_path(uid))
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+
+def _fdatasync(fd: int) -> None:
+    # fdatasync skips the timestamps, not available on macOS and windows
+    if hasattr(os, "fdatasync"):
+        os.fdatasync(fd)
+    else:
+        os.fsync(fd)
+
+
+def _remove_unreferenced(blob: str) -> None:
+    try:
+        if os.stat(blob).st_nlink == 1:
+            os.remove(blob)
+    except FileNotFoundError:
+        pass
+
+
+def shard_names(uid: str, depth: int, width: int) -> List[str]:
+    return [uid[i * width : (i + 1) * width] for i in range(depth)]
+
+
+def _is_upload_id(name: str) -> bool:
+    return len(name) == 32 and "." not in name
+
+
+def iter_layout(files_dir: str, depth: int, width: int = 2) -> Iterator[str]:
+    """
+    Lazily yield the ids of the uploads in `files_dir`, one shard at a time.
+    With `depth > 0`, uploads left in the flat layout are yielded as well.
+    """
+    try:
+        entries = os.scandir(files_dir)
+    except FileNotFoundError:
+        return
+    with entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                if depth > 0 and len(entry.name) == width:
+                    yield from iter_layout(entry.path, depth - 1, width)
+            elif _is_upload_id(entry.name):
+                yield entry.name
+
+
+def migrate_layout(
+    files_dir: str, shard_depth: int, shard_width: int = 2
+) -> Iterator[str]:
+    """
+    Move the uploads in `files_dir` into the layout for `shard_depth`, from
+    whichever layout they're currently in, and yield the ids of the moved
+    uploads. Files are renamed one at a time, so this can run while a server
+    that uses `fallback_to_flat` is serving uploads.
+    """
+    target = FileSystemStorage(
+        files_dir, shard_depth=shard_depth, shard_width=shard_width
+    )
+    for root, dirs, files in os.walk(files_dir, topdown=False):
+        moved = set()
+        for name in files:
+            uid = name[: -len(".info")] if name.endswith(".info") else name
+            if not _is_upload_id(uid):
+                continue
+            destination = os.path.join(target.shard_dir(uid), name)
+            source = os.path.join(root, name)
+            if os.path.abspath(source) == os.path.abspath(destination):
+                continue
+            os.makedirs(os.path.dirname(destination), exist_ok=True)
+            os.replace(source, destination)
+            if uid not in moved:
+                moved.add(uid)
+                yield uid
+        # remove shard dirs that were emptied
+        if os.path.abspath(root) != os.path.abspath(files_dir) and all(
+            c in string.hexdigits for c in os.path.basename(root)
+        ):
+            try:
+                os.rmdir(root)
+            except OSError:
+                pass
+
+
+def _copy_range(src, dst, size: int, offset: int) -> None:
+    """
+    Copy `size` bytes from the start of `src` to `offset` in `dst`, without
+    pulling them through Python memory where the platform allows it.
+    """
+    copied = 0
+    # copy_file_range shares extents (reflinks) on filesystems that support
+    # it, and copies within the kernel otherwise
+    if hasattr(os, "copy_file_range"):
+        try:
+            while copied < size:
+                n = os.copy_file_range(
+                    src.fileno(),
+                    dst.fileno(),
+                    size - copied,
+                    copied,
+                    offset + copied,
+                )
+                if n == 0:
+                    break
+                copied += n
+        except OSError:
+            # e.g. cross-device copies on older kernels, continue below
+            pass
+    if copied < size and hasattr(os, "sendfile"):
+        try:
+            dst.seek(offset + copied)
+            while copied < size:
+                n = os.sendfile(dst.fileno(), src.fileno(), copied, size - copied)
+                if n == 0:
+                    break
+                copied += n
+        except OSError:
+            pass
+    if copied < size:
+        # buffered copy as the last resort
+        src.seek(copied)
+        dst.seek(offset + copied)
+        shutil.copyfileobj(src, dst)
@@ -0,0 +1,105 @@
+from __future__ import annotations
+
+import copy
+import io
+import threading
+from typing import BinaryIO, Dict, Hashable, Iterator, Optional, Tuple
+
+from tuspyserver.storage.base import TusStorage, TusStorageWriter
+
+
+class MemoryWriter(TusStorageWriter):
+    def __init__(self, storage: MemoryStorage, uid: str, offset: int):
+        self._storage = storage
+        self._uid = uid
+        self._offset = offset
+
+    def write(self, data: bytes) -> None:
+        with self._storage._lock:
+            buffer = self._storage._data[self._uid]
+            buffer[self._offset : self._offset + len(data)] = data
+        self._offset += len(data)
+
+    def close(self) -> None:
+        pass
+
+
+class MemoryStorage(TusStorage):
+    """
+    Keeps uploads in process memory, for tests and benchmarks.
+    """
+
+    def __init__(self):
+        self._data: Dict[str, bytearray] = {}
+        self._info: Dict[str, Tuple[int, dict]] = {}
+        self._lock = threading.Lock()
+
+    # data
+
+    def create(self, uid: str, size: Optional[int] = None) -> bool:
+        with self._lock:
+            self._data.setdefault(uid, bytearray())
+        return False
+
+    def open(self, uid: str, offset: int) -> MemoryWriter:
+        if uid not in self._data:
+            raise FileNotFoundError(uid)
+        return MemoryWriter(self, uid, offset)
+
+    def truncate(self, uid: str, size: int) -> None:
+        with self._lock:
+            del self._data[uid][size:]
+
+    @property
+    def can_truncate(self) -> bool:
+        return True
+
+    def stat(self, uid: str) -> Optional[int]:
+        buffer = self._data.get(uid)
+        return None if buffer is None else len(buffer)
+
+    def read(
+        self,
+        uid: str,
+        start: int = 0,
+        end: Optional[int] = None,
+        block_size: int = 1024 * 1024,
+    ) -> Iterator[bytes]:
+        buffer = self._data[uid]
+        end = len(buffer) if end is None else min(end, len(buffer))
+        for pos in range(start, end, block_size):
+            yield bytes(buffer[pos : min(pos + block_size, end)])
+
+    def open_read(self, uid: str) -> BinaryIO:
+        with self._lock:
+            return io.BytesIO(bytes(self._data[uid]))
+
+    def delete(self, uid: str) -> None:
+        with self._lock:
+            self._data.pop(uid, None)
+            self._info.pop(uid, None)
+
+    def path(self, uid: str) -> str:
+        return f"memory://{uid}"
+
+    def list(self) -> Iterator[str]:
+        return iter(list(self._data))
+
+    # metadata
+
+    def get_info(self, uid: str) -> Optional[dict]:
+        entry = self._info.get(uid)
+        return None if entry is None else copy.deepcopy(entry[1])
+
+    def put_info(self, uid: str, info: dict) -> None:
+        with self._lock:
+            version = self._info[uid][0] + 1 if uid in self._info else 0
+            self._info[uid] = (version, copy.deepcopy(info))
+
+    def delete_info(self, uid: str) -> None:
+        with self._lock:
+            self._info.pop(uid, None)
+
+    def info_stamp(self, uid: str) -> Optional[Hashable]:
+        entry = self._info.get(uid)
+        return None if entry is None else entry[0]
@@ -0,0 +1,489 @@
+"""
+Append-only pack file of small uploads, see `PackedStorage`.
+
+The file is a sequence of records, each of which starts with a header:
+
+    magic "TUSP" | kind u8 | uid length u16 | info length u32 | data length u64
+    uid | info JSON | data
+
+Kinds are `PUT` (the data and metadata of an upload), `INFO` (updated
+metadata) and `DELETE`. The latest record of an upload wins. The index of
+the live uploads is kept in memory and rebuilt by scanning the file, which
+is tailed on every access so that several processes can share it.
+"""
+
+from __future__ import annotations
+
+import datetime
+import io
+import json
+import os
+import struct
+import threading
+from contextlib import contextmanager
+from typing import (
+    BinaryIO,
+    Dict,
+    Hashable,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
+
+from tuspyserver.lock import MemoryLockProvider, TusLock, TusLockProvider, fcntl
+from tuspyserver.storage.base import TusStorage, TusStorageWriter, expires_before
+
+MAGIC = b"TUSP"
+PUT = 1
+INFO = 2
+DELETE = 3
+
+_HEADER = struct.Struct("<4sBHIQ")
+
+
+class _Entry:
+    __slots__ = (
+        "data_pos",
+        "data_length",
+        "info_pos",
+        "info_length",
+        "stamp",
+        "put_size",
+        "info_size",
+    )
+
+    def __init__(self, data_pos, data_length, info_pos, info_length, stamp):
+        self.data_pos = data_pos
+        self.data_length = data_length
+        self.info_pos = info_pos
+        self.info_length = info_length
+        # position of the latest record of the upload
+        self.stamp = stamp
+        # sizes of the put record and of the latest info record
+        self.put_size = 0
+        self.info_size = 0
+
+
+def _encode(kind: int, uid: str, info: Optional[dict], data: bytes = b"") -> bytes:
+    key = uid.encode("ascii")
+    blob = (
+        json.dumps(info, separators=(",", ":")).encode("utf-8")
+        if info is not None
+        else b""
+    )
+    return (
+        _HEADER.pack(MAGIC, kind, len(key), len(blob), len(data)) + key + blob + data
+    )
+
+
+class TusPackFile:
+    """
+    The pack file at `path`, and the index of the uploads in it. Appends are
+    serialized across processes with a lock on `path + ".lock"`, and synced
+    to disk if `sync` is set.
+    """
+
+    def __init__(self, path: str, sync: bool = False):
+        self.path = path
+        self.sync = sync
+        self._lock = threading.RLock()
+        self._fd: Optional[int] = None
+        self._ino: Optional[int] = None
+        self._scanned = 0
+        self._index: Dict[str, _Entry] = {}
+        self._garbage = 0
+
+    # index
+
+    def _refresh(self) -> None:
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            self._reset(None)
+            return
+        if st.st_ino != self._ino:
+            # new file, or compacted by another process
+            self._reset(os.open(self.path, os.O_RDONLY), st.st_ino)
+        if st.st_size > self._scanned:
+            self._scan(st.st_size)
+
+    def _reset(self, fd: Optional[int], ino: Optional[int] = None) -> None:
+        if self._fd is not None:
+            os.close(self._fd)
+        self._fd = fd
+        self._ino = ino
+        self._scanned = 0
+        self._index = {}
+        self._garbage = 0
+
+    def _scan(self, end: int) -> None:
+        pos = self._scanned
+        while pos + _HEADER.size <= end:
+            magic, kind, key_length, info_length, data_length = _HEADER.unpack(
+                os.pread(self._fd, _HEADER.size, pos)
+            )
+            size = _HEADER.size + key_length + info_length + data_length
+            # stop at a torn record, it is cut off by the next append
+            if magic != MAGIC or pos + size > end:
+                break
+            uid = os.pread(self._fd, key_length, pos + _HEADER.size).decode("ascii")
+            info_pos = pos + _HEADER.size + key_length
+            previous = self._index.get(uid)
+            if previous is not None and kind in (PUT, DELETE):
+                self._garbage += previous.put_size + previous.info_size
+            if kind == PUT:
+                entry = self._index[uid] = _Entry(
+                    info_pos + info_length, data_length, info_pos, info_length, pos
+                )
+                entry.put_size = size
+            elif kind == INFO and previous is not None:
+                # the data stays in the put record, older info records are dead
+                self._garbage += previous.info_size
+                previous.info_pos = info_pos
+                previous.info_length = info_length
+                previous.stamp = pos
+                previous.info_size = size
+            else:
+                self._index.pop(uid, None)
+                self._garbage += size
+            pos += size
+        self._scanned = pos
+
+    def _lookup(self, uid: str, fresh: bool = False) -> Optional[_Entry]:
+        # records of an upload are never changed in place, and a compacted
+        # file is read through the old one until it is reopened, so only
+        # misses look for records appended, or compactions done, by other
+        # processes. Writes and compaction always check.
+        entry = None if fresh else self._index.get(uid)
+        if entry is None:
+            self._refresh()
+            entry = self._index.get(uid)
+        return entry
+
+    def get(self, uid: str) -> Optional[_Entry]:
+        with self._lock:
+            return self._lookup(uid)
+
+    def uids(self) -> List[str]:
+        with self._lock:
+            self._refresh()
+            return list(self._index)
+
+    def read_data(self, uid: str, fresh: bool = False) -> Optional[bytes]:
+        with self._lock:
+            entry = self._lookup(uid, fresh)
+            if entry is None:
+                return None
+            return os.pread(self._fd, entry.data_length, entry.data_pos)
+
+    def get_info(self, uid: str) -> Optional[dict]:
+        with self._lock:
+            entry = self._lookup(uid)
+            if entry is None or entry.info_length == 0:
+                return None
+            return json.loads(os.pread(self._fd, entry.info_length, entry.info_pos))
+
+    # writes
+
+    def put(self, uid: str, data: bytes, info: Optional[dict]) -> None:
+        self._append(_encode(PUT, uid, info, data))
+
+    def put_info(self, uid: str, info: dict) -> None:
+        self._append(_encode(INFO, uid, info))
+
+    def delete(self, uid: str) -> bool:
+        if self.get(uid) is None:
+            return False
+        self._append(_encode(DELETE, uid, None))
+        return True
+
+    def _append(self, record: bytes) -> None:
+        with self._lock, self._locked():
+            self._refresh()
+            flags = os.O_WRONLY | os.O_CREAT | os.O_APPEND
+            fd = os.open(self.path, flags, 0o644)
+            try:
+                # drop a record torn by a crash, everything before is scanned
+                if os.fstat(fd).st_size > self._scanned:
+                    os.truncate(fd, self._scanned)
+                os.write(fd, record)
+                if self.sync:
+                    os.fsync(fd)
+            finally:
+                os.close(fd)
+            self._refresh()
+
+    def _locked(self):
+        return _FileLock(self.path + ".lock")
+
+    # compaction
+
+    def compact(self, min_garbage: int = 16 * 1024 * 1024) -> bool:
+        """
+        Rewrite the live records into a new file if at least half of the
+        file, and at least `min_garbage` bytes, are dead.
+        """
+        with self._lock, self._locked():
+            self._refresh()
+            if self._garbage < min_garbage or self._garbage * 2 < self._scanned:
+                return False
+            tmp = self.path + ".compact"
+            with open(tmp, "wb") as f:
+                for uid, entry in self._index.items():
+                    info = (
+                        json.loads(
+                            os.pread(self._fd, entry.info_length, entry.info_pos)
+                        )
+                        if entry.info_length
+                        else None
+                    )
+                    data = os.pread(self._fd, entry.data_length, entry.data_pos)
+                    f.write(_encode(PUT, uid, info, data))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.path)
+            self._refresh()
+            return True
+
+    def close(self) -> None:
+        with self._lock:
+            self._reset(None)
+
+
+class _FileLock:
+    # serializes writers across processes, a no-op where flock is missing
+    def __init__(self, path: str):
+        self.path = path
+        self._fd: Optional[int] = None
+
+    def __enter__(self):
+        if fcntl is None:
+            return self
+        try:
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        except FileNotFoundError:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc) -> None:
+        if self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+
+
+class _PackedLockProvider(TusLockProvider):
+    # packed uploads have no file to lock, they are locked within the process
+    def __init__(self, storage: PackedStorage, provider: TusLockProvider):
+        self._storage = storage
+        self._provider = provider
+        self._memory = MemoryLockProvider()
+
+    def acquire(self, uid: str) -> Optional[TusLock]:
+        if self._storage.pack.get(uid) is not None:
+            return self._memory.acquire(uid)
+        return self._provider.acquire(uid)
+
+
+class PackedStorage(TusStorage):
+    """
+    Keeps uploads of up to `threshold` bytes that are stored in one go with
+    `put`, along with their metadata, as records of a single append-only
+    pack file, `pack_path`, instead of as files of `storage`. Everything
+    else is handed to `storage`.
+
+    Packed uploads are located as `pack://<uid>`. They are moved to
+    `storage` if they are written to again, or when a completion hook needs
+    their `local_path`. `compact` reclaims the space of deleted uploads.
+    """
+
+    def __init__(
+        self,
+        storage: TusStorage,
+        pack_path: str,
+        threshold: int = 64 * 1024,
+        sync: bool = False,
+    ):
+        self.storage = storage
+        self.threshold = threshold
+        self.pack = TusPackFile(pack_path, sync=sync)
+
+    def is_packed(self, uid: str) -> bool:
+        return self.pack.get(uid) is not None
+
+    def _unpack(self, uid: str) -> None:
+        # a stale copy must not overwrite what another process unpacked
+        data = self.pack.read_data(uid, fresh=True)
+        if data is None:
+            return
+        self.storage.put(uid, data, self.pack.get_info(uid))
+        self.pack.delete(uid)
+
+    # data
+
+    def put(self, uid: str, data: bytes, info: Optional[dict] = None) -> None:
+        if len(data) > self.threshold:
+            return self.storage.put(uid, data, info)
+        self.pack.put(uid, data, info)
+
+    def create(self, uid: str, size: Optional[int] = None) -> bool:
+        return self.storage.create(uid, size)
+
+    def create_many(self, items: Iterable[Tuple[str, Optional[int]]]) -> List[bool]:
+        return self.storage.create_many(items)
+
+    def open(self, uid: str, offset: int) -> TusStorageWriter:
+        self._unpack(uid)
+        return self.storage.open(uid, offset)
+
+    def truncate(self, uid: str, size: int) -> None:
+        self._unpack(uid)
+        self.storage.truncate(uid, size)
+
+    @property
+    def can_truncate(self) -> bool:
+        return self.storage.can_truncate
+
+    @property
+    def can_read_incomplete(self) -> bool:
+        return self.storage.can_read_incomplete
+
+    def stat(self, uid: str) -> Optional[int]:
+        entry = self.pack.get(uid)
+        if entry is not None:
+            return entry.data_length
+        return self.storage.stat(uid)
+
+    def read(
+        self,
+        uid: str,
+        start: int = 0,
+        end: Optional[int] = None,
+        block_size: int = 1024 * 1024,
+    ) -> Iterator[bytes]:
+        data = self.pack.read_data(uid)
+        if data is None:
+            yield from self.storage.read(uid, start, end, block_size)
+            return
+        end = len(data) if end is None else min(end, len(data))
+        view = memoryview(data)
+        for pos in range(start, end, block_size):
+            yield bytes(view[pos : min(pos + block_size, end)])
+
+    def open_read(self, uid: str) -> BinaryIO:
+        data = self.pack.read_data(uid)
+        if data is None:
+            return self.storage.open_read(uid)
+        return io.BytesIO(data)
+
+    def data_file(self, uid: str) -> Optional[Tuple[str, int]]:
+        # the pack file is replaced when it is compacted, so packed uploads
+        # are read through `open_read` instead
+        if self.is_packed(uid):
+            return None
+        return self.storage.data_file(uid)
+
+    def delete(self, uid: str) -> None:
+        # a crash while unpacking may have left a copy in `storage`
+        self.pack.delete(uid)
+        self.storage.delete(uid)
+
+    def complete(self, uid: str) -> None:
+        if not self.is_packed(uid):
+            self.storage.complete(uid)
+
+    def dedup(self, uid: str, key: str, size: int) -> bool:
+        if self.is_packed(uid):
+            return False
+        return self.storage.dedup(uid, key, size)
+
+    def link(self, uid: str, key: str, size: int) -> bool:
+        return self.storage.link(uid, key, size)
+
+    def content_size(self, key: str) -> Optional[int]:
+        return self.storage.content_size(key)
+
+    def release(self, key: str) -> None:
+        self.storage.release(key)
+
+    def concat(self, uid: str, parts: List[str]) -> None:
+        if any(self.is_packed(part) for part in parts):
+            # stream the parts through a writer
+            return super().concat(uid, parts)
+        self.storage.concat(uid, parts)
+
+    def compact(self) -> None:
+        self.pack.compact()
+        self.storage.compact()
+
+    def lock_provider(self) -> TusLockProvider:
+        return _PackedLockProvider(self, self.storage.lock_provider())
+
+    def path(self, uid: str) -> str:
+        if self.is_packed(uid):
+            return f"pack://{uid}"
+        return self.storage.path(uid)
+
+    @contextmanager
+    def local_path(self, uid: str) -> Iterator[str]:
+        if self.is_packed(uid):
+            self._unpack(uid)
+        with self.storage.local_path(uid) as path:
+            yield path
+
+    def list(self) -> Iterator[str]:
+        yield from self.pack.uids()
+        yield from self.storage.list()
+
+    # metadata
+
+    def get_info(self, uid: str) -> Optional[dict]:
+        entry = self.pack.get(uid)
+        if entry is not None and entry.info_length:
+            return self.pack.get_info(uid)
+        return self.storage.get_info(uid)
+
+    def put_info(self, uid: str, info: dict) -> None:
+        entry = self.pack.get(uid)
+        if entry is not None and entry.info_length:
+            return self.pack.put_info(uid, info)
+        self.storage.put_info(uid, info)
+
+    def put_many(self, items: Iterable[Tuple[str, dict]]) -> None:
+        # new uploads are never packed
+        self.storage.put_many(items)
+
+    def update_info(self, uid: str, info: dict, changed: Set[str]) -> None:
+        entry = self.pack.get(uid)
+        if entry is not None and entry.info_length:
+            return self.pack.put_info(uid, info)
+        self.storage.update_info(uid, info, changed)
+
+    def sync_info(self, uid: str) -> None:
+        if not self.is_packed(uid):
+            self.storage.sync_info(uid)
+
+    def delete_info(self, uid: str) -> None:
+        self.pack.delete(uid)
+        self.storage.delete_info(uid)
+
+    def info_stamp(self, uid: str) -> Optional[Hashable]:
+        entry = self.pack.get(uid)
+        if entry is not None and entry.info_length:
+            return ("pack", entry.stamp)
+        return self.storage.info_stamp(uid)
+
+    def expiring(
+        self, before: datetime.datetime
+    ) -> Iterator[Tuple[str, Union[float, str]]]:
+        for uid in self.pack.uids():
+            info = self.pack.get_info(uid)
+            if info is not None and expires_before(info.get("expires"), before):
+                yield uid, info["expires"]
+        yield from self.storage.expiring(before)
@@ -0,0 +1,318 @@
+from __future__ import annotations
+
+import json
+from typing import Any, Dict, Hashable, Iterator, List, Optional
+
+try:
+    import boto3
+    from botocore.exceptions import ClientError
+except ImportError:  # pragma: no cover
+    boto3 = None
+    ClientError = Exception
+
+from tuspyserver.storage.base import TusStorage, TusStorageWriter
+
+# S3 rejects multipart parts below 5 MiB, except for the last one
+MIN_PART_SIZE = 5 * 1024 * 1024
+
+_MISSING_CODES = {"404", "NoSuchKey", "NoSuchUpload", "NotFound"}
+
+
+def _is_missing(e: Exception) -> bool:
+    return (
+        isinstance(e, ClientError)
+        and e.response.get("Error", {}).get("Code") in _MISSING_CODES
+    )
+
+
+class S3Writer(TusStorageWriter):
+    def __init__(self, storage: S3Storage, uid: str, offset: int):
+        self._storage = storage
+        self._uid = uid
+        self._upload_id = storage._upload_id(uid)
+        if self._upload_id is None:
+            raise FileNotFoundError(uid)
+        self._parts = storage._list_parts(uid, self._upload_id)
+        # bytes below the part size are kept in a tail object between requests
+        self._buffer = bytearray(storage._get_tail(uid) or b"")
+        stored = sum(p["Size"] for p in self._parts) + len(self._buffer)
+        if stored != offset:
+            raise ValueError(f"Upload {uid} has {stored} bytes stored, not {offset}")
+
+    def write(self, data: bytes) -> None:
+        self._buffer += data
+        part_size = self._storage.part_size
+        while len(self._buffer) >= part_size:
+            part, self._buffer = self._buffer[:part_size], self._buffer[part_size:]
+            self._storage._upload_part(
+                self._uid, self._upload_id, len(self._parts) + 1, bytes(part)
+            )
+            self._parts.append({"PartNumber": len(self._parts) + 1, "Size": len(part)})
+
+    def sync(self) -> None:
+        # parts are durable once uploaded, the rest goes to the tail object
+        self._storage._put_tail(self._uid, bytes(self._buffer))
+
+    def close(self) -> None:
+        self._storage._put_tail(self._uid, bytes(self._buffer))
+
+
+class S3Storage(TusStorage):
+    """
+    Stores uploads in an S3-compatible bucket using multipart uploads.
+
+    Parts are uploaded as soon as `part_size` bytes have been received, so
+    uploads are never staged locally. Data that doesn't fill a part at the
+    end of a request is kept in a `<key>.part` object until the next one.
+    Point `endpoint_url` at a local stand-in (MinIO, moto) for testing.
+    """
+
+    def __init__(
+        self,
+        bucket: str,
+        prefix: str = "",
+        part_size: int = 8 * 1024 * 1024,
+        client: Any = None,
+        **client_kwargs: Any,
+    ):
+        if client is None:
+            if boto3 is None:
+                raise RuntimeError("S3Storage requires boto3: pip install boto3")
+            client = boto3.client("s3", **client_kwargs)
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix
+        self.part_size = max(part_size, MIN_PART_SIZE)
+        self._upload_ids: Dict[str, str] = {}
+
+    def key(self, uid: str) -> str:
+        return f"{self.prefix}{uid}"
+
+    # helpers
+
+    def _head(self, key: str) -> Optional[dict]:
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=key)
+        except ClientError as e:
+            if _is_missing(e):
+                return None
+            raise
+
+    def _get(self, key: str) -> Optional[bytes]:
+        try:
+            obj = self.client.get_object(Bucket=self.bucket, Key=key)
+        except ClientError as e:
+            if _is_missing(e):
+                return None
+            raise
+        return obj["Body"].read()
+
+    def _upload_id(self, uid: str) -> Optional[str]:
+        if uid in self._upload_ids:
+            return self._upload_ids[uid]
+        # another worker may have created the upload
+        key = self.key(uid)
+        response = self.client.list_multipart_uploads(Bucket=self.bucket, Prefix=key)
+        for upload in response.get("Uploads", []):
+            if upload["Key"] == key:
+                self._upload_ids[uid] = upload["UploadId"]
+                return upload["UploadId"]
+        return None
+
+    def _list_parts(self, uid: str, upload_id: str) -> List[dict]:
+        parts: List[dict] = []
+        kwargs = {"Bucket": self.bucket, "Key": self.key(uid), "UploadId": upload_id}
+        while True:
+            response = self.client.list_parts(**kwargs)
+            parts.extend(
+                {"PartNumber": p["PartNumber"], "ETag": p["ETag"], "Size": p["Size"]}
+                for p in response.get("Parts", [])
+            )
+            if not response.get("IsTruncated"):
+                return parts
+            kwargs["PartNumberMarker"] = response["NextPartNumberMarker"]
+
+    def _upload_part(self, uid: str, upload_id: str, number: int, data: bytes):
+        self.client.upload_part(
+            Bucket=self.bucket,
+            Key=self.key(uid),
+            UploadId=upload_id,
+            PartNumber=number,
+            Body=data,
+        )
+
+    def _get_tail(self, uid: str) -> Optional[bytes]:
+        return self._get(f"{self.key(uid)}.part")
+
+    def _put_tail(self, uid: str, data: bytes) -> None:
+        key = f"{self.key(uid)}.part"
+        if data:
+            self.client.put_object(Bucket=self.bucket, Key=key, Body=data)
+        else:
+            self.client.delete_object(Bucket=self.bucket, Key=key)
+
+    # data
+
+    def create(self, uid: str, size: Optional[int] = None) -> bool:
+        response = self.client.create_multipart_upload(
+            Bucket=self.bucket, Key=self.key(uid)
+        )
+        self._upload_ids[uid] = response["UploadId"]
+        return False
+
+    def open(self, uid: str, offset: int) -> S3Writer:
+        return S3Writer(self, uid, offset)
+
+    def truncate(self, uid: str, size: int) -> None:
+        upload_id = self._upload_id(uid)
+        if upload_id is None:
+            raise ValueError(f"Upload {uid} is already complete")
+        committed = sum(p["Size"] for p in self._list_parts(uid, upload_id))
+        # uploaded parts can't be removed from a multipart upload, only the
+        # tail object can be cut
+        if size < committed:
+            raise NotImplementedError(
+                f"S3Storage can't truncate {uid} below its uploaded parts"
+            )
+        tail = self._get_tail(uid) or b""
+        self._put_tail(uid, tail[: size - committed])
+
+    @property
+    def can_truncate(self) -> bool:
+        # uploaded parts can't be cut
+        return False
+
+    def stat(self, uid: str) -> Optional[int]:
+        upload_id = self._upload_id(uid)
+        if upload_id is None:
+            # completed uploads are plain objects
+            head = self._head(self.key(uid))
+            return None if head is None else head["ContentLength"]
+        tail = self._head(f"{self.key(uid)}.part")
+        return sum(p["Size"] for p in self._list_parts(uid, upload_id)) + (
+            tail["ContentLength"] if tail else 0
+        )
+
+    def read(
+        self,
+        uid: str,
+        start: int = 0,
+        end: Optional[int] = None,
+        block_size: int = 1024 * 1024,
+    ) -> Iterator[bytes]:
+        if end is not None and end <= start:
+            return
+        byte_range = f"bytes={start}-{'' if end is None else end - 1}"
+        obj = self.client.get_object(
+            Bucket=self.bucket, Key=self.key(uid), Range=byte_range
+        )
+        yield from obj["Body"].iter_chunks(block_size)
+
+    @property
+    def can_read_incomplete(self) -> bool:
+        # the object only exists once the multipart upload is complete
+        return False
+
+    def complete(self, uid: str) -> None:
+        upload_id = self._upload_id(uid)
+        if upload_id is None:
+            return
+        key = self.key(uid)
+        parts = self._list_parts(uid, upload_id)
+        tail = self._get_tail(uid)
+        if tail:
+            self._upload_part(uid, upload_id, len(parts) + 1, tail)
+            parts = self._list_parts(uid, upload_id)
+        if parts:
+            self.client.complete_multipart_upload(
+                Bucket=self.bucket,
+                Key=key,
+                UploadId=upload_id,
+                MultipartUpload={
+                    "Parts": [
+                        {"PartNumber": p["PartNumber"], "ETag": p["ETag"]}
+                        for p in parts
+                    ]
+                },
+            )
+        else:
+            # empty uploads have no parts to complete
+            self.client.abort_multipart_upload(
+                Bucket=self.bucket, Key=key, UploadId=upload_id
+            )
+            self.client.put_object(Bucket=self.bucket, Key=key, Body=b"")
+        self._upload_ids.pop(uid, None)
+        self._put_tail(uid, b"")
+
+    def concat(self, uid: str, parts: List[str]) -> None:
+        upload_id = self._upload_id(uid)
+        sizes = [self._head(self.key(part))["ContentLength"] for part in parts]
+        # server-side copies are limited to parts of at least 5 MiB, except
+        # for the last one
+        if upload_id is None or any(size < MIN_PART_SIZE for size in sizes[:-1]):
+            super().concat(uid, parts)
+            return
+        for number, part in enumerate(parts, start=1):
+            self.client.upload_part_copy(
+                Bucket=self.bucket,
+                Key=self.key(uid),
+                UploadId=upload_id,
+                PartNumber=number,
+                CopySource={"Bucket": self.bucket, "Key": self.key(part)},
+            )
+
+    def delete(self, uid: str) -> None:
+        key = self.key(uid)
+        upload_id = self._upload_id(uid)
+        if upload_id is not None:
+            try:
+                self.client.abort_multipart_upload(
+                    Bucket=self.bucket, Key=key, UploadId=upload_id
+                )
+            except ClientError as e:
+                if not _is_missing(e):
+                    raise
+        self._upload_ids.pop(uid, None)
+        self.client.delete_objects(
+            Bucket=self.bucket,
+            Delete={
+                "Objects": [
+                    {"Key": key},
+                    {"Key": f"{key}.part"},
+                    {"Key": f"{key}.info"},
+                ],
+                "Quiet": True,
+            },
+        )
+
+    def path(self, uid: str) -> str:
+        return f"s3://{self.bucket}/{self.key(uid)}"
+
+    def list(self) -> Iterator[str]:
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix):
+            for obj in page.get("Contents", []):
+                name = obj["Key"][len(self.prefix) :]
+                if name.endswith(".info"):
+                    yield name[: -len(".info")]
+
+    # metadata
+
+    def get_info(self, uid: str) -> Optional[dict]:
+        content = self._get(f"{self.key(uid)}.info")
+        return None if not content else json.loads(content)
+
+    def put_info(self, uid: str, info: dict) -> None:
+        self.client.put_object(
+            Bucket=self.bucket,
+            Key=f"{self.key(uid)}.info",
+            Body=json.dumps(info).encode("utf-8"),
+            ContentType="application/json",
+        )
+
+    def delete_info(self, uid: str) -> None:
+        self.client.delete_object(Bucket=self.bucket, Key=f"{self.key(uid)}.info")
+
+    def info_stamp(self, uid: str) -> Optional[Hashable]:
+        head = self._head(f"{self.key(uid)}.info")
+        return None if head is None else head["ETag"]
@@ -0,0 +1,103 @@
+"""
+Binary format of the `.info` sidecar files of `FileSystemStorage`.
+
+A fixed-width header holds the counters that change while an upload is
+streamed, so they can be updated in place with a single `pwrite`. The rest
+of the upload info follows as a compact JSON blob that is only rewritten
+when it changes:
+
+    magic "TUSI" | version u16 | header size u16
+    offset u64 | upload_part u64 | upload_chunk_size u64 | size i64
+    checksum_offset u64 | checksum_state i64 | blob length u32
+    blob
+
+All integers are little-endian, `None` is stored as -1. Files that don't
+start with the magic are legacy JSON documents.
+"""
+
+from __future__ import annotations
+
+import json
+import struct
+from typing import Optional
+
+MAGIC = b"TUSI"
+VERSION = 1
+
+_PREFIX = struct.Struct("<4sHH")
+_COUNTERS = struct.Struct("<QQQqQq")
+_BLOB_LENGTH = struct.Struct("<I")
+# in header order
+COUNTER_FIELDS = (
+    "offset",
+    "upload_part",
+    "upload_chunk_size",
+    "size",
+    "checksum_offset",
+    "checksum_state",
+)
+_NULLABLE = {"size", "checksum_state"}
+
+PREFIX_SIZE = _PREFIX.size
+COUNTERS_OFFSET = _PREFIX.size
+HEADER_SIZE = _PREFIX.size + _COUNTERS.size + _BLOB_LENGTH.size
+
+
+def is_binary(data: bytes) -> bool:
+    return data[: len(MAGIC)] == MAGIC
+
+
+def is_current(prefix: bytes) -> bool:
+    """
+    Whether the header of a file starting with `prefix` can be updated in
+    place with `encode_counters`.
+    """
+    if len(prefix) < PREFIX_SIZE or not is_binary(prefix):
+        return False
+    _, version, header_size = _PREFIX.unpack_from(prefix)
+    return version == VERSION and header_size == HEADER_SIZE
+
+
+def _counters(info: dict) -> list:
+    values = []
+    for name in COUNTER_FIELDS:
+        value = info.get(name)
+        if value is None:
+            value = -1 if name in _NULLABLE else 0
+        values.append(value)
+    return values
+
+
+def encode_counters(info: dict) -> bytes:
+    return _COUNTERS.pack(*_counters(info))
+
+
+def encode_info(info: dict) -> bytes:
+    blob = json.dumps(
+        {k: v for k, v in info.items() if k not in COUNTER_FIELDS},
+        separators=(",", ":"),
+    ).encode("utf-8")
+    return (
+        _PREFIX.pack(MAGIC, VERSION, HEADER_SIZE)
+        + encode_counters(info)
+        + _BLOB_LENGTH.pack(len(blob))
+        + blob
+    )
+
+
+def decode_info(data: bytes) -> Optional[dict]:
+    if not is_binary(data):
+        # legacy JSON
+        content = data.decode("utf-8").strip()
+        return json.loads(content) if content else None
+    if len(data) < PREFIX_SIZE:
+        raise ValueError("Truncated upload info")
+    _, version, header_size = _PREFIX.unpack_from(data)
+    if version > VERSION:
+        raise ValueError(f"Unsupported upload info version: {version}")
+    values = _COUNTERS.unpack_from(data, PREFIX_SIZE)
+    (blob_length,) = _BLOB_LENGTH.unpack_from(data, PREFIX_SIZE + _COUNTERS.size)
+    info = json.loads(data[header_size : header_size + blob_length])
+    for name, value in zip(COUNTER_FIELDS, values):
+        info[name] = None if name in _NULLABLE and value == -1 else value
+    return info
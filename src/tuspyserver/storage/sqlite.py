@@ -0,0 +1,245 @@
+from __future__ import annotations
+
+import datetime
+import json
+import sqlite3
+import threading
+from typing import Hashable, Iterable, Iterator, List, Optional, Tuple
+
+from tuspyserver.storage.base import TusMetadataStore
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS uploads (
+    uid TEXT PRIMARY KEY,
+    version INTEGER NOT NULL DEFAULT 0,
+    size INTEGER,
+    "offset" INTEGER NOT NULL DEFAULT 0,
+    completed INTEGER NOT NULL DEFAULT 0,
+    created_at TEXT,
+    expires TEXT,
+    info TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS uploads_expires ON uploads (expires);
+CREATE INDEX IF NOT EXISTS uploads_created_at ON uploads (created_at);
+CREATE INDEX IF NOT EXISTS uploads_completed ON uploads (completed, expires);
+"""
+
+UPSERT = """
+INSERT INTO uploads (uid, size, "offset", completed, created_at, expires, info)
+VALUES (?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (uid) DO UPDATE SET
+    version = version + 1,
+    size = excluded.size,
+    "offset" = excluded."offset",
+    completed = excluded.completed,
+    created_at = excluded.created_at,
+    expires = excluded.expires,
+    info = excluded.info
+"""
+
+
+def _normalize_expires(expires) -> Optional[str]:
+    # iso strings compare in date order, which keeps the index usable
+    if not expires:
+        return None
+    if isinstance(expires, str):
+        return datetime.datetime.fromisoformat(expires).isoformat()
+    return datetime.datetime.fromtimestamp(expires).isoformat()
+
+
+def _row(uid: str, info: dict) -> tuple:
+    size = info.get("size")
+    offset = info.get("offset") or 0
+    return (
+        uid,
+        size,
+        offset,
+        int(size is not None and offset >= size),
+        info.get("created_at"),
+        _normalize_expires(info.get("expires")),
+        json.dumps(info),
+    )
+
+
+class SQLiteMetadataStore(TusMetadataStore):
+    """
+    Keeps upload metadata in a SQLite database in WAL mode, instead of a
+    `.info` file per upload. Indexes on the expiry date, the creation date
+    and the completion state back the bulk queries used for garbage
+    collection, admin listings and metrics.
+
+    The database can be shared by several worker processes on one host.
+    """
+
+    def __init__(self, path: str, timeout: float = 30.0):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        self._connection().executescript(SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        # sqlite connections can't be shared between threads
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=self.timeout)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    # metadata
+
+    def get_info(self, uid: str) -> Optional[dict]:
+        row = (
+            self._connection()
+            .execute("SELECT info FROM uploads WHERE uid = ?", (uid,))
+            .fetchone()
+        )
+        return None if row is None else json.loads(row[0])
+
+    def put_info(self, uid: str, info: dict) -> None:
+        db = self._connection()
+        with db:
+            db.execute(UPSERT, _row(uid, info))
+
+    def put_many(self, items: Iterable[Tuple[str, dict]]) -> None:
+        """
+        Write the metadata of many uploads in a single transaction.
+        """
+        db = self._connection()
+        with db:
+            db.executemany(UPSERT, (_row(uid, info) for uid, info in items))
+
+    def delete_info(self, uid: str) -> None:
+        db = self._connection()
+        with db:
+            db.execute("DELETE FROM uploads WHERE uid = ?", (uid,))
+
+    def info_stamp(self, uid: str) -> Optional[Hashable]:
+        row = (
+            self._connection()
+            .execute("SELECT version FROM uploads WHERE uid = ?", (uid,))
+            .fetchone()
+        )
+        return None if row is None else row[0]
+
+    def list(self) -> Iterator[str]:
+        return self.query()
+
+    # bulk queries
+
+    def expired(self, before: datetime.datetime) -> Iterator[str]:
+        return self.query(expires_before=before)
+
+    def expiring(self, before: datetime.datetime) -> Iterator[Tuple[str, str]]:
+        where, args = self._filters(expires_before=before)
+        cursor = self._connection().execute(
+            f"SELECT uid, expires FROM uploads{where} ORDER BY expires", args
+        )
+        while True:
+            rows = cursor.fetchmany(1000)
+            if not rows:
+                return
+            for uid, expires in rows:
+                yield uid, expires
+
+    def query(
+        self,
+        completed: Optional[bool] = None,
+        expires_before: Optional[datetime.datetime] = None,
+        created_before: Optional[datetime.datetime] = None,
+        created_after: Optional[datetime.datetime] = None,
+        limit: Optional[int] = None,
+    ) -> Iterator[str]:
+        """
+        Iterate over the ids of the uploads matching all given filters,
+        ordered by expiry date if filtered by it, by creation date otherwise.
+        """
+        where, args = self._filters(
+            completed, expires_before, created_before, created_after
+        )
+        order = "expires" if expires_before is not None else "created_at"
+        sql = f"SELECT uid FROM uploads{where} ORDER BY {order}"
+        if limit is not None:
+            sql += " LIMIT ?"
+            args.append(limit)
+        cursor = self._connection().execute(sql, args)
+        while True:
+            rows = cursor.fetchmany(1000)
+            if not rows:
+                return
+            for row in rows:
+                yield row[0]
+
+    def count(
+        self,
+        completed: Optional[bool] = None,
+        expires_before: Optional[datetime.datetime] = None,
+    ) -> int:
+        where, args = self._filters(completed, expires_before)
+        return (
+            self._connection()
+            .execute(f"SELECT COUNT(*) FROM uploads{where}", args)
+            .fetchone()[0]
+        )
+
+    def in_flight(self) -> int:
+        """
+        Number of uploads that haven't received all of their bytes yet.
+        """
+        return self.count(completed=False)
+
+    def bytes_received(self, completed: Optional[bool] = None) -> int:
+        where, args = self._filters(completed)
+        return (
+            self._connection()
+            .execute(f'SELECT COALESCE(SUM("offset"), 0) FROM uploads{where}', args)
+            .fetchone()[0]
+        )
+
+    @staticmethod
+    def _filters(
+        completed: Optional[bool] = None,
+        expires_before: Optional[datetime.datetime] = None,
+        created_before: Optional[datetime.datetime] = None,
+        created_after: Optional[datetime.datetime] = None,
+    ) -> Tuple[str, List]:
+        clauses, args = [], []
+        if completed is not None:
+            clauses.append("completed = ?")
+            args.append(int(completed))
+        if expires_before is not None:
+            clauses.append("expires < ?")
+            args.append(expires_before.isoformat())
+        # created_at is stored as str(datetime), with a space separator
+        if created_before is not None:
+            clauses.append("created_at < ?")
+            args.append(str(created_before))
+        if created_after is not None:
+            clauses.append("created_at > ?")
+            args.append(str(created_after))
+        return (" WHERE " + " AND ".join(clauses) if clauses else ""), args
+
+
+def import_info_files(
+    store: SQLiteMetadataStore, source: TusMetadataStore, batch_size: int = 1000
+) -> int:
+    """
+    Copy the metadata of all uploads in `source`, e.g. the `.info` files of a
+    `FileSystemStorage`, into `store`. Returns the number of imported uploads.
+    """
+    count = 0
+    batch = []
+    for uid in source.list():
+        info = source.get_info(uid)
+        if info is None:
+            continue
+        batch.append((uid, info))
+        if len(batch) >= batch_size:
+            store.put_many(batch)
+            count += len(batch)
+            batch = []
+    if batch:
+        store.put_many(batch)
+        count += len(batch)
+    return count
@@ -0,0 +1,232 @@
+from __future__ import annotations
+
+import inspect
+import json
+import threading
+import typing
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+if typing.TYPE_CHECKING:
+    from tuspyserver.file import TusUploadFile
+    from tuspyserver.params import TusUploadParams
+
+from fastapi import HTTPException
+from starlette.concurrency import iterate_in_threadpool
+
+
+class TusUploadRejected(HTTPException):
+    """
+    Raised by a chunk processor to reject an upload. The request is answered
+    with `status_code`, and the upload is deleted.
+    """
+
+    def __init__(self, detail: str = "Upload rejected", status_code: int = 422):
+        super().__init__(status_code=status_code, detail=detail)
+
+
+class TusChunkProcessor:
+    """
+    Sees the data of an upload in order, as it is written to storage, so
+    processing overlaps with the transfer instead of following it.
+
+    Each upload has a state, created by `start` and passed to `process` with
+    every block of data. Between requests, the state is kept in process, and
+    what `suspend` returns is persisted with the upload so it can be resumed
+    elsewhere or after a restart. If there is no usable state, the data
+    stored so far is replayed through a fresh state first.
+
+    `process` runs on the event loop, slow processing should be handed off to
+    a thread. Raise `TusUploadRejected` to reject the upload. Once the upload
+    is complete, `finish` returns a JSON-serializable result, which is passed
+    to completion hooks that accept a `taps` argument.
+    """
+
+    name: Optional[str] = None
+
+    def start(self, uid: str, params: TusUploadParams) -> Any:
+        return None
+
+    async def process(self, uid: str, state: Any, data: bytes) -> None: ...
+
+    def suspend(self, state: Any) -> Any:
+        """
+        JSON-serializable copy of `state` to persist, or `None` if it can't
+        be persisted.
+        """
+        return None
+
+    def resume(self, uid: str, params: TusUploadParams, saved: Any) -> Any:
+        return saved
+
+    async def finish(self, uid: str, state: Any) -> Any:
+        return None
+
+
+class CallbackProcessor(TusChunkProcessor):
+    """
+    Processor for an async callback `fn(uid, state, data)`, whose state is a
+    dict that is persisted as long as it holds JSON-serializable values.
+    The final state is the result.
+    """
+
+    def __init__(self, fn: Callable, name: Optional[str] = None):
+        self.fn = fn
+        self.name = name or fn.__name__
+
+    def start(self, uid: str, params: TusUploadParams) -> Any:
+        return {}
+
+    async def process(self, uid: str, state: Any, data: bytes) -> None:
+        result = self.fn(uid, state, data)
+        if inspect.isawaitable(result):
+            await result
+
+    def suspend(self, state: Any) -> Any:
+        try:
+            return json.loads(json.dumps(state))
+        except (TypeError, ValueError):
+            return None
+
+    async def finish(self, uid: str, state: Any) -> Any:
+        return self.suspend(state)
+
+
+class GeneratorStage(TusChunkProcessor):
+    """
+    Processor for an async generator function `fn(uid, params)`. Blocks of
+    data are sent into the generator, followed by `None` once the upload is
+    complete, and the next value it yields is the result:
+
+        async def sniff(uid, params):
+            head = b""
+            while (data := (yield)) is not None:
+                head = (head + data)[:512]
+            yield {"type": guess_type(head)}
+
+    Its state can't be persisted, resumes elsewhere replay the stored data.
+    """
+
+    def __init__(self, fn: Callable, name: Optional[str] = None):
+        self.fn = fn
+        self.name = name or fn.__name__
+
+    def start(self, uid: str, params: TusUploadParams) -> Any:
+        return _Stage(self.fn(uid, params))
+
+    async def process(self, uid: str, state: Any, data: bytes) -> None:
+        await state.send(data)
+
+    async def finish(self, uid: str, state: Any) -> Any:
+        try:
+            return await state.send(None)
+        except StopAsyncIteration:
+            return None
+        finally:
+            await state.generator.aclose()
+
+
+class _Stage:
+    def __init__(self, generator):
+        self.generator = generator
+        self.started = False
+
+    async def send(self, value: Any) -> Any:
+        # the first send runs the generator up to its first `yield`
+        if not self.started:
+            await self.generator.asend(None)
+            self.started = True
+        return await self.generator.asend(value)
+
+
+def as_processor(processor: Union[TusChunkProcessor, Callable]) -> TusChunkProcessor:
+    if isinstance(processor, TusChunkProcessor):
+        return processor
+    if inspect.isasyncgenfunction(processor):
+        return GeneratorStage(processor)
+    if callable(processor):
+        return CallbackProcessor(processor)
+    raise TypeError(f"Not a chunk processor: {processor!r}")
+
+
+class TusChunkTaps:
+    """
+    The chunk processors of the router, and the states of the uploads in
+    progress, by upload id.
+    """
+
+    def __init__(
+        self,
+        processors: Sequence[Union[TusChunkProcessor, Callable]],
+        maxsize: int = 1024,
+    ):
+        self.processors = [as_processor(p) for p in processors]
+        names = [self._name(p) for p in self.processors]
+        if len(set(names)) != len(names):
+            raise ValueError(f"Chunk processor names must be unique: {names}")
+        self.maxsize = maxsize
+        self._states: OrderedDict[str, Tuple[int, List[Any]]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _name(processor: TusChunkProcessor) -> str:
+        return processor.name or type(processor).__name__
+
+    async def resume(self, file: TusUploadFile, params: TusUploadParams) -> List[Any]:
+        uid = file.uid
+        offset = params.offset
+        with self._lock:
+            entry = self._states.pop(uid, None)
+        if entry is not None and entry[0] == offset:
+            return entry[1]
+        # persisted states
+        saved = params.tap_state or {}
+        if params.tap_offset == offset and all(
+            saved.get(self._name(p)) is not None for p in self.processors
+        ):
+            return [
+                p.resume(uid, params, saved[self._name(p)]) for p in self.processors
+            ]
+        # replay the data stored so far
+        states = self.start(uid, params)
+        if offset > 0:
+            blocks = file.storage.read(uid, 0, offset)
+            async for block in iterate_in_threadpool(blocks):
+                await self.process(uid, states, block)
+        return states
+
+    def start(self, uid: str, params: TusUploadParams) -> List[Any]:
+        return [p.start(uid, params) for p in self.processors]
+
+    async def process(self, uid: str, states: List[Any], data: bytes) -> None:
+        for processor, state in zip(self.processors, states):
+            await processor.process(uid, state, data)
+
+    def snapshot(self, states: List[Any]) -> Optional[Dict[str, Any]]:
+        """
+        The states to persist with the upload params.
+        """
+        return {
+            self._name(p): p.suspend(state)
+            for p, state in zip(self.processors, states)
+        }
+
+    def suspend(self, uid: str, offset: int, states: List[Any]) -> None:
+        """
+        Keep the states for the next request.
+        """
+        with self._lock:
+            self._states[uid] = (offset, states)
+            while len(self._states) > self.maxsize:
+                self._states.popitem(last=False)
+
+    async def finish(self, uid: str, states: List[Any]) -> Dict[str, Any]:
+        self.discard(uid)
+        return {
+            self._name(p): await p.finish(uid, state)
+            for p, state in zip(self.processors, states)
+        }
+
+    def discard(self, uid: str) -> None:
+        with self._lock:
+            self._states.pop(uid, None)
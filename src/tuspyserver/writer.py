@@ -0,0 +1,84 @@
+from __future__ import annotations
+
+import asyncio
+import inspect
+from concurrent.futures import Executor
+from typing import Any, Callable, Optional
+
+
+class TusUploadWriter:
+    """
+    Runs the blocking write operations of a single upload in order.
+
+    With an executor, operations are handed to it through a bounded queue so
+    that reading the request body and writing to disk overlap. A full queue
+    makes `submit` wait, which stops reading from the socket (backpressure).
+    Without an executor, operations run inline.
+    """
+
+    def __init__(self, executor: Optional[Executor] = None, queue_depth: int = 4):
+        self.executor = executor
+        self._queue: Optional[asyncio.Queue] = None
+        self._queue_depth = max(1, queue_depth)
+        self._task: Optional[asyncio.Task] = None
+        self._error: Optional[BaseException] = None
+
+    async def run(self, fn: Callable[..., Any], *args: Any) -> Any:
+        # coroutine functions run on the loop, in order with the others
+        if inspect.iscoroutinefunction(fn):
+            return await fn(*args)
+        if self.executor is None:
+            return fn(*args)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, fn, *args)
+
+    async def submit(self, fn: Callable[..., Any], *args: Any) -> None:
+        if self._error is not None:
+            raise self._error
+        if self.executor is None:
+            # failures are kept like those of queued operations, so the
+            # caller doesn't write past data that is missing
+            try:
+                await self.run(fn, *args)
+            except Exception as e:
+                self._error = e
+                raise
+            return
+        if self._task is None:
+            self._queue = asyncio.Queue(maxsize=self._queue_depth)
+            self._task = asyncio.create_task(self._consume())
+        await self._queue.put((fn, args))
+
+    async def drain(self) -> None:
+        if self._queue is not None:
+            await self._queue.join()
+        if self._error is not None:
+            raise self._error
+
+    async def close(self) -> None:
+        # finish pending operations, errors are kept for the caller to inspect
+        if self._task is None:
+            return
+        await self._queue.join()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    @property
+    def error(self) -> Optional[BaseException]:
+        return self._error
+
+    async def _consume(self) -> None:
+        while True:
+            fn, args = await self._queue.get()
+            try:
+                # skip remaining operations once one of them failed
+                if self._error is None:
+                    await self.run(fn, *args)
+            except Exception as e:
+                self._error = e
+            finally:
+                self._queue.task_done()
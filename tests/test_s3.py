@@ -0,0 +1,143 @@
+import base64
+import os
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+boto3 = pytest.importorskip("boto3")
+moto = pytest.importorskip("moto")
+
+from tuspyserver import create_tus_router  # noqa: E402
+from tuspyserver.storage import S3Storage  # noqa: E402
+from tuspyserver.storage.s3 import MIN_PART_SIZE  # noqa: E402
+
+BUCKET = "uploads"
+HEADERS = {"Tus-Resumable": "1.0.0"}
+PATCH_HEADERS = {**HEADERS, "Content-Type": "application/offset+octet-stream"}
+METADATA = "filename {},filetype {}".format(
+    base64.b64encode(b"data.bin").decode(),
+    base64.b64encode(b"application/octet-stream").decode(),
+)
+
+
+@pytest.fixture
+def s3():
+    with moto.mock_aws():
+        client = boto3.client("s3", region_name="us-east-1")
+        client.create_bucket(Bucket=BUCKET)
+        yield client
+
+
+@pytest.fixture
+def client(s3, tmp_path):
+    app = FastAPI()
+    app.include_router(
+        create_tus_router(
+            files_dir=str(tmp_path),
+            storage=S3Storage(BUCKET, client=s3),
+        )
+    )
+    with TestClient(app) as client:
+        yield client
+
+
+def create(client, length, **headers):
+    response = client.post(
+        "/files/",
+        headers={
+            **HEADERS,
+            "Upload-Length": str(length),
+            "Upload-Metadata": METADATA,
+            **headers,
+        },
+    )
+    assert response.status_code == 201
+    return response.headers["Location"].rstrip("/").rsplit("/", 1)[-1]
+
+
+def patch(client, uid, offset, data):
+    response = client.patch(
+        f"/files/{uid}",
+        content=data,
+        headers={**PATCH_HEADERS, "Upload-Offset": str(offset)},
+    )
+    assert response.status_code == 204
+    return int(response.headers["Upload-Offset"])
+
+
+def offset(client, uid):
+    response = client.head(f"/files/{uid}", headers=HEADERS)
+    assert response.status_code == 200
+    return int(response.headers["Upload-Offset"])
+
+
+def stored(s3, uid):
+    return s3.get_object(Bucket=BUCKET, Key=uid)["Body"].read()
+
+
+def test_create(client, s3):
+    uid = create(client, 10)
+
+    assert offset(client, uid) == 0
+    uploads = s3.list_multipart_uploads(Bucket=BUCKET).get("Uploads", [])
+    assert [upload["Key"] for upload in uploads] == [uid]
+    assert f"{uid}.info" in {
+        obj["Key"] for obj in s3.list_objects_v2(Bucket=BUCKET)["Contents"]
+    }
+
+
+def test_patch_resume(client, s3):
+    data = os.urandom(MIN_PART_SIZE + 1024)
+    uid = create(client, len(data))
+
+    # a small write is kept in the tail object, a large one fills a part
+    assert patch(client, uid, 0, data[:1000]) == 1000
+    assert offset(client, uid) == 1000
+    assert patch(client, uid, 1000, data[1000:-10]) == len(data) - 10
+    assert offset(client, uid) == len(data) - 10
+    assert patch(client, uid, len(data) - 10, data[-10:]) == len(data)
+
+    assert stored(s3, uid) == data
+    assert not s3.list_multipart_uploads(Bucket=BUCKET).get("Uploads")
+
+
+@pytest.mark.parametrize("first", [MIN_PART_SIZE, 1024])
+def test_concat(client, s3, first):
+    # parts of at least 5 MiB are copied on the server, smaller ones are
+    # streamed through the router
+    datas = [os.urandom(first), os.urandom(2048)]
+    parts = []
+    for data in datas:
+        uid = create(client, len(data), **{"Upload-Concat": "partial"})
+        patch(client, uid, 0, data)
+        parts.append(uid)
+
+    response = client.post(
+        "/files/",
+        headers={
+            **HEADERS,
+            "Upload-Metadata": METADATA,
+            "Upload-Concat": "final;" + " ".join(f"/files/{uid}" for uid in parts),
+        },
+    )
+    assert response.status_code == 201
+    uid = response.headers["Location"].rstrip("/").rsplit("/", 1)[-1]
+
+    assert offset(client, uid) == sum(map(len, datas))
+    assert stored(s3, uid) == b"".join(datas)
+
+
+def test_delete(client, s3):
+    complete = create(client, 5)
+    patch(client, complete, 0, b"hello")
+    incomplete = create(client, 10)
+    patch(client, incomplete, 0, b"hello")
+
+    for uid in (complete, incomplete):
+        response = client.delete(f"/files/{uid}", headers=HEADERS)
+        assert response.status_code == 204
+        assert client.head(f"/files/{uid}", headers=HEADERS).status_code == 404
+
+    assert not s3.list_objects_v2(Bucket=BUCKET).get("Contents")
+    assert not s3.list_multipart_uploads(Bucket=BUCKET).get("Uploads")